@@ -12,104 +12,104 @@ Funcionalidades:
 =================================================================
 """
 
-from flask import Flask, render_template, request, redirect, url_for, flash, session, send_from_directory, send_file, g
+from flask import Flask, Blueprint, current_app, render_template, request, redirect, url_for, flash, session, send_from_directory, send_file, g, jsonify, has_request_context, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session as SessaoFlask
 from flask_wtf.csrf import CSRFProtect
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 from flask_talisman import Talisman
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import Engine, make_url
+from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
+from jinja2 import FileSystemBytecodeCache
+from contextlib import contextmanager
 from functools import wraps
-from datetime import datetime
-import bcrypt
+from datetime import date, datetime, timedelta
+import atexit
+import bisect
+import click
+import copy
+import csv
+import glob
+import gzip
+import hashlib
+import hmac
+import json
 import os
+import shutil
+import sqlite3
+import struct
+import threading
+import tempfile
+import time
+import zlib
+import unicodedata
 import uuid
+import zipfile
 import random
+import secrets
 import string
 
 import sys
 import io
 import logging
-from logging.handlers import RotatingFileHandler
+from logging.handlers import QueueHandler, QueueListener, WatchedFileHandler
+import queue
 
-# Configurar encoding UTF-8 para Windows
-if sys.platform == 'win32':
-    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
-    sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8')
+try:
+    import fcntl  # trava de rotação entre processos (indisponível no Windows)
+except ImportError:
+    fcntl = None
 
-# Configurar logging de segurança
-if not os.path.exists('logs'):
-    os.makedirs('logs')
+try:
+    import brotli  # opcional: sem ele as respostas saem com gzip
+except ImportError:
+    brotli = None
+
+class SessaoRoteada(SessaoFlask):
+    """Sessão que envia tudo ao shard em `info['shard']` (ver seção SHARDS)"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        indice = self.info.get('shard')
+        if bind is None and indice:
+            return self._db.engines[f'shard{indice}']
+        return super().get_bind(mapper, clause=clause, bind=bind, **kwargs)
+
+
+# Extensões criadas sem app: são ligadas em create_app(), então importar
+# este módulo não cria pastas, arquivos de log nem conexões.
+db = SQLAlchemy(session_options={'class_': SessaoRoteada})
+csrf = CSRFProtect()
+
+
+def limite_excedido(limite):
+    """on_breach do Flask-Limiter: registra o bloqueio no log de segurança"""
+    log_seguranca('limite_excedido', limite=str(limite.limit))
 
-security_handler = RotatingFileHandler(
-    'logs/security.log', maxBytes=1048576, backupCount=5
-)
-security_handler.setLevel(logging.WARNING)
-security_handler.setFormatter(logging.Formatter(
-    '%(asctime)s - %(levelname)s - %(message)s'
-))
 
-app_logger = logging.getLogger('security')
-app_logger.addHandler(security_handler)
-app_logger.setLevel(logging.WARNING)
-
-app = Flask(__name__)
-# Security: Generate a strong random secret key in production
-# Use: python -c "import secrets; print(secrets.token_hex(32))"
-app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'casal-comercial-2024-secreto-dev-only')
-app.config['WTF_CSRF_ENABLED'] = True
-app.config['WTF_CSRF_TIME_LIMIT'] = 3600  # 1 hour
-
-# Session Security
-app.config['SESSION_COOKIE_SECURE'] = False  # Set to True in production with HTTPS
-app.config['SESSION_COOKIE_HTTPONLY'] = True  # Prevents XSS access to session cookie
-app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'  # CSRF protection
-app.config['PERMANENT_SESSION_LIFETIME'] = 3600  # 1 hour session timeout
-
-# Initialize CSRF protection
-csrf = CSRFProtect(app)
-
-# Initialize Rate Limiter (anti-brute force)
 limiter = Limiter(
-    app=app,
     key_func=get_remote_address,
     default_limits=["200 per day", "50 per hour"],
-    storage_uri="memory://"
+    storage_uri="memory://",
+    on_breach=limite_excedido
 )
+talisman = Talisman()
 
-# Initialize Security Headers
-Talisman(app, 
-    force_https=False,  # Set to True in production with HTTPS
-    strict_transport_security=False,  # Enable in production
-    content_security_policy={
-        'default-src': "'self'",
-        'script-src': ["'self'", "'unsafe-inline'"],  # Allow inline for now
-        'style-src': ["'self'", "'unsafe-inline'", "https://fonts.googleapis.com"],
-        'font-src': ["'self'", "https://fonts.gstatic.com"],
-        'img-src': ["'self'", "data:", "blob:"],
-        'connect-src': "'self'",
-    },
-    referrer_policy='strict-origin-when-cross-origin',
-    feature_policy={
-        'geolocation': "'none'",
-        'microphone': "'none'",
-        'camera': "'self'",
-    }
-)
-# Database configuration - use persistent storage on Render
-# Render persists /opt/render/project/src/data/ directory
-db_path = os.environ.get('DATABASE_PATH', 'casal_comercial.db')
-app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{db_path}'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['UPLOAD_FOLDER'] = 'uploads_comercial'
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max
-
-# Criar pasta uploads se não existir
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-os.makedirs(os.path.join(app.config['UPLOAD_FOLDER'], 'perfis'), exist_ok=True)
-os.makedirs(os.path.join(app.config['UPLOAD_FOLDER'], 'tarefas'), exist_ok=True)
-os.makedirs(os.path.join(app.config['UPLOAD_FOLDER'], 'recompensas'), exist_ok=True)
-
-db = SQLAlchemy(app)
+# Todas as rotas e comandos do app; registrado em create_app()
+bp = Blueprint('comercial', __name__, cli_group=None)
+
+app_logger = logging.getLogger('security')
+
+
+@db.event.listens_for(Engine, 'connect')
+def configurar_sqlite(conexao, _registro):
+    """WAL: leitores (e o backup online) não bloqueiam escritores"""
+    if isinstance(conexao, sqlite3.Connection):
+        cursor = conexao.cursor()
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.close()
 
 # =================================================================
 # MODELOS
@@ -121,6 +121,11 @@ class Casal(db.Model):
     codigo = db.Column(db.String(10), unique=True, nullable=False)
     data_criacao = db.Column(db.DateTime, default=datetime.now)
     ativo = db.Column(db.Boolean, default=True)
+    shard = db.Column(db.Integer)  # banco dos dados do casal; NULL = principal, negativo = em mudança
+    # Membros: quem criou (A) e quem entrou pelo código (B). Só mudam por
+    # criar_casal e ocupar_vaga_casal; o parceiro sai pela chave primária.
+    parceiro_a_id = db.Column(db.Integer)
+    parceiro_b_id = db.Column(db.Integer)
     
     # Relacionamentos
     membros = db.relationship('Usuario', backref='casal', lazy=True)
@@ -137,11 +142,15 @@ class Casal(db.Model):
     
     def contar_membros(self):
         """Retorna quantos usuários estão vinculados a este casal"""
-        return len(self.membros)
+        return (self.parceiro_a_id is not None) + (self.parceiro_b_id is not None)
     
     def esta_completo(self):
         """Verifica se o casal já tem 2 membros"""
         return self.contar_membros() >= 2
+    
+    def id_parceiro(self, usuario_id):
+        """Id do outro membro do casal (None se ainda não há)"""
+        return self.parceiro_b_id if usuario_id == self.parceiro_a_id else self.parceiro_a_id
 
 
 class Usuario(db.Model):
@@ -165,22 +174,26 @@ class Usuario(db.Model):
     
     @property
     def pontos_ganhos(self):
-        """Calcula pontos ganhos em tarefas concluídas"""
+        """Calcula pontos ganhos em tarefas concluídas (incluindo as arquivadas)"""
         if not self.casal_id:
             return 0
-        return db.session.query(db.func.sum(Tarefa.pontos)).filter(
+        ativos = db.session.query(db.func.sum(Tarefa.pontos)).filter(
             Tarefa.usuario_id == self.id,
             Tarefa.concluida == True
         ).scalar() or 0
+        total = db.session.get(TotalArquivado, self.id)
+        return ativos + (total.pontos_ganhos if total else 0)
     
     @property
     def pontos_gastos(self):
-        """Calcula pontos gastos em resgates"""
+        """Calcula pontos gastos em resgates (incluindo os arquivados)"""
         if not self.casal_id:
             return 0
-        return db.session.query(db.func.sum(Resgate.custo)).filter(
+        ativos = db.session.query(db.func.sum(Resgate.custo)).filter(
             Resgate.usuario_id == self.id
         ).scalar() or 0
+        total = db.session.get(TotalArquivado, self.id)
+        return ativos + (total.pontos_gastos if total else 0)
     
     @property
     def saldo(self):
@@ -189,22 +202,20 @@ class Usuario(db.Model):
     
     def verificar_senha(self, senha):
         """Verifica se a senha está correta usando bcrypt"""
+        import bcrypt  # importado sob demanda: só o login precisa
         return bcrypt.checkpw(senha.encode('utf-8'), self.senha_hash.encode('utf-8'))
     
     def tem_parceiro(self):
         """Verifica se o usuário tem um parceiro vinculado"""
         if not self.casal_id:
             return False
-        return Casal.query.get(self.casal_id).contar_membros() == 2
+        return db.session.get(Casal, self.casal_id).esta_completo()
     
     def get_parceiro(self):
         """Retorna o parceiro do usuário (se existir)"""
         if not self.casal_id or not self.tem_parceiro():
             return None
-        return Usuario.query.filter(
-            Usuario.casal_id == self.casal_id,
-            Usuario.id != self.id
-        ).first()
+        return db.session.get(Usuario, db.session.get(Casal, self.casal_id).id_parceiro(self.id))
 
 
 class Tarefa(db.Model):
@@ -230,6 +241,7 @@ class Tarefa(db.Model):
     # Timestamps
     data_criacao = db.Column(db.DateTime, default=datetime.now)
     data_conclusao = db.Column(db.DateTime)
+    prazo = db.Column(db.DateTime, index=True)  # Opcional; usado pelos lembretes
     
     # Relacionamentos explícitos
     usuario = db.relationship('Usuario', foreign_keys=[usuario_id], backref='tarefas_recebidas')
@@ -278,16 +290,238 @@ class Resgate(db.Model):
     recompensa = db.relationship('Recompensa', backref='resgates')
 
 
+class ItemArquivado(db.Model):
+    """Tarefa concluída ou vale utilizado movido para o arquivo (payload compactado)"""
+    id = db.Column(db.Integer, primary_key=True)
+    tipo = db.Column(db.String(10), nullable=False)  # tarefa, resgate
+    item_id = db.Column(db.Integer, nullable=False)  # id original
+    casal_id = db.Column(db.Integer, nullable=False)
+    usuario_id = db.Column(db.Integer)
+    pontos = db.Column(db.Integer, default=0)
+    data = db.Column(db.DateTime)  # data_conclusao / data_resgate
+    dados = db.Column(db.LargeBinary)  # JSON compactado com zlib
+
+    __table_args__ = (
+        db.Index('ix_item_arquivado_casal_tipo_data', 'casal_id', 'tipo', 'data'),
+    )
+
+
+class TotalArquivado(db.Model):
+    """Totais por usuário dos itens arquivados, para manter o saldo correto"""
+    usuario_id = db.Column(db.Integer, db.ForeignKey('usuario.id'), primary_key=True)
+    pontos_ganhos = db.Column(db.Integer, default=0, nullable=False)
+    pontos_gastos = db.Column(db.Integer, default=0, nullable=False)
+    tarefas = db.Column(db.Integer, default=0, nullable=False)
+    resgates = db.Column(db.Integer, default=0, nullable=False)
+
+
+class EstatisticaDiaria(db.Model):
+    """Totais de um usuário num dia, atualizados a cada conclusão/resgate"""
+    usuario_id = db.Column(db.Integer, db.ForeignKey('usuario.id'), primary_key=True)
+    dia = db.Column(db.Date, primary_key=True)
+    casal_id = db.Column(db.Integer, nullable=False)
+    pontos_ganhos = db.Column(db.Integer, default=0, nullable=False)
+    pontos_gastos = db.Column(db.Integer, default=0, nullable=False)
+    tarefas = db.Column(db.Integer, default=0, nullable=False)
+    resgates = db.Column(db.Integer, default=0, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_estatistica_diaria_casal_dia', 'casal_id', 'dia'),
+    )
+
+
+class Sequencia(db.Model):
+    """Dias seguidos com pelo menos uma tarefa concluída (streak), por usuário"""
+    usuario_id = db.Column(db.Integer, db.ForeignKey('usuario.id'), primary_key=True)
+    atual = db.Column(db.Integer, default=0, nullable=False)
+    recorde = db.Column(db.Integer, default=0, nullable=False)
+    ultimo_dia = db.Column(db.Date)
+
+
+class ModeloTarefa(db.Model):
+    """Tarefa frequente de um casal, aprendida a cada criar_tarefa (base das sugestões)"""
+    id = db.Column(db.Integer, primary_key=True)
+    casal_id = db.Column(db.Integer, db.ForeignKey('casal.id'), nullable=False)
+    chave = db.Column(db.String(100), nullable=False)  # título normalizado (sem acentos/caixa)
+    titulo = db.Column(db.String(100), nullable=False)
+    descricao = db.Column(db.Text)
+    pontos = db.Column(db.Integer, default=10)
+    frequencia = db.Column(db.String(20))
+    usos = db.Column(db.Integer, default=1, nullable=False)
+    atualizado_em = db.Column(db.DateTime, default=datetime.now, index=True)
+
+    __table_args__ = (
+        db.UniqueConstraint('casal_id', 'chave', name='uq_modelo_tarefa_casal_chave'),
+    )
+
+
+class Notificacao(db.Model):
+    """Caixa de saída de notificações (lida pela UI e por um futuro canal push)"""
+    id = db.Column(db.Integer, primary_key=True)
+    usuario_id = db.Column(db.Integer, db.ForeignKey('usuario.id'), nullable=False)
+    casal_id = db.Column(db.Integer, nullable=False)
+    tarefa_id = db.Column(db.Integer)
+    tipo = db.Column(db.String(20), nullable=False)  # lembrete, atrasada
+    prazo = db.Column(db.DateTime)  # prazo da tarefa quando a notificação foi gerada
+    mensagem = db.Column(db.String(200), nullable=False)
+    criada_em = db.Column(db.DateTime, default=datetime.now)
+    lida_em = db.Column(db.DateTime)
+    enviada_em = db.Column(db.DateTime)  # preenchido pelo canal push
+
+    __table_args__ = (
+        # Uma notificação por tarefa/tipo/prazo: varreduras repetidas não duplicam
+        db.UniqueConstraint('tarefa_id', 'tipo', 'prazo', name='uq_notificacao_tarefa_tipo_prazo'),
+        db.Index('ix_notificacao_usuario_lida', 'usuario_id', 'lida_em'),
+    )
+
+
+class Evento(db.Model):
+    """Log de auditoria append-only: uma linha por mutação, numerada por casal"""
+    id = db.Column(db.Integer, primary_key=True)
+    casal_id = db.Column(db.Integer, nullable=False)
+    seq = db.Column(db.Integer, nullable=False)  # 1, 2, 3... dentro do casal
+    usuario_id = db.Column(db.Integer)  # quem fez
+    tipo = db.Column(db.String(30), nullable=False)  # tarefa_excluida, recompensa_aprovada...
+    alvo_id = db.Column(db.Integer)  # id da tarefa/recompensa/vale
+    dados = db.Column(db.Text)  # JSON compacto
+    criado_em = db.Column(db.DateTime, default=datetime.now)
+
+    __table_args__ = (
+        db.Index('ix_evento_casal_seq', 'casal_id', 'seq', unique=True),
+    )
+
+
+class SequenciaEvento(db.Model):
+    """Último seq de Evento usado por casal (sobrevive à compactação)"""
+    casal_id = db.Column(db.Integer, primary_key=True)
+    ultimo = db.Column(db.Integer, default=0, nullable=False)
+
+
+class LoteEventos(db.Model):
+    """Eventos antigos compactados: um bloco zlib por casal e compactação"""
+    id = db.Column(db.Integer, primary_key=True)
+    casal_id = db.Column(db.Integer, nullable=False)
+    seq_inicio = db.Column(db.Integer, nullable=False)
+    seq_fim = db.Column(db.Integer, nullable=False)
+    criado_ate = db.Column(db.DateTime, nullable=False, index=True)  # evento mais novo do bloco
+    dados = db.Column(db.LargeBinary, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_lote_eventos_casal_seq', 'casal_id', 'seq_fim'),
+    )
+
+
+class ContadorId(db.Model):
+    """Contador do shard para ids globais de tarefa, recompensa e resgate"""
+    nome = db.Column(db.String(20), primary_key=True)
+    valor = db.Column(db.Integer, nullable=False)
+
+
+class TokenRenovacao(db.Model):
+    """Refresh token da API. Só o hash SHA-256 é guardado.
+
+    Cada uso gera um token novo na mesma `familia`; reapresentar um token
+    já usado revoga a família inteira (indício de token vazado).
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    usuario_id = db.Column(db.Integer, db.ForeignKey('usuario.id'), nullable=False, index=True)
+    familia = db.Column(db.String(32), nullable=False, index=True)
+    token_hash = db.Column(db.String(64), unique=True, nullable=False)
+    criado_em = db.Column(db.DateTime, default=datetime.now)
+    expira_em = db.Column(db.DateTime, nullable=False)
+    usado_em = db.Column(db.DateTime)
+    revogado = db.Column(db.Boolean, default=False, nullable=False)
+
+
+# =================================================================
+# GUARDA CONTRA LAZY LOADS (MODO TESTE)
+# =================================================================
+
+# Com BLOQUEAR_LAZY_LOAD (ligado por padrão quando TESTING=True) qualquer
+# relacionamento carregado sob demanda durante uma requisição gere erro.
+# As consultas de listagem devem declarar joinedload/contains_eager.
+
+
+class LazyLoadInesperado(Exception):
+    """Relacionamento carregado sob demanda durante uma requisição"""
+
+
+@db.event.listens_for(db.orm.Session, 'do_orm_execute')
+def bloquear_lazy_load(orm_execute_state):
+    """Levanta LazyLoadInesperado em lazy loads quando a guarda está ativa"""
+    if not orm_execute_state.is_select or orm_execute_state.lazy_loaded_from is None:
+        return
+    if not has_request_context() or not current_app.config.get('BLOQUEAR_LAZY_LOAD'):
+        return
+    relacionamento = orm_execute_state.loader_strategy_path[-1]
+    raise LazyLoadInesperado(
+        f'Lazy load de {relacionamento.parent.class_.__name__}.{relacionamento.key} '
+        f'durante {request.endpoint}; use joinedload/selectinload na consulta.'
+    )
+
+
 # =================================================================
 # DECORADORES E UTILS
 # =================================================================
 
+def token_bearer():
+    """Retorna o token do header `Authorization: Bearer ...` (ou None)"""
+    cabecalho = request.headers.get('Authorization', '')
+    if cabecalho[:7].lower() == 'bearer ':
+        return cabecalho[7:].strip() or None
+    return None
+
+
+def serializador_tokens():
+    return URLSafeTimedSerializer(current_app.config['SECRET_KEY'], salt='api-token-acesso')
+
+
+def gerar_token_acesso(usuario):
+    """Token de acesso assinado com o id do usuário.
+
+    O casal não vai no token: o vínculo muda depois da emissão (entrar num
+    casal), então casal_id_atual() o lê do usuário.
+    """
+    return serializador_tokens().dumps({'u': usuario.id})
+
+
+def dados_token_acesso():
+    """Valida o token Bearer só pela assinatura (sem consultar o banco).
+
+    Retorna {'u': usuario_id} ou None se ausente/inválido/expirado.
+    """
+    if 'token_api' not in g:
+        token = token_bearer()
+        dados = None
+        if token:
+            try:
+                dados = serializador_tokens().loads(
+                    token, max_age=current_app.config['API_TOKEN_ACESSO_SEGUNDOS']
+                )
+            except (BadSignature, SignatureExpired):
+                dados = None
+        g.token_api = dados
+    return g.token_api
+
+
+def erro_token(mensagem, status=401):
+    resposta = jsonify({'erro': mensagem})
+    resposta.status_code = status
+    if status == 401:
+        resposta.headers['WWW-Authenticate'] = 'Bearer'
+    return resposta
+
+
 def login_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
+        if token_bearer():
+            if dados_token_acesso() is None:
+                return erro_token('token_invalido')
+            return f(*args, **kwargs)
         if 'usuario_id' not in session:
             flash('Faça login primeiro!', 'error')
-            return redirect(url_for('login'))
+            return redirect(url_for('comercial.login'))
         return f(*args, **kwargs)
     return decorated_function
 
@@ -296,43 +530,240 @@ def casal_required(f):
     """Decorador que exige que o usuário esteja vinculado a um casal"""
     @wraps(f)
     def decorated_function(*args, **kwargs):
+        if token_bearer():
+            if not casal_id_atual():
+                return erro_token('sem_casal', 403)
+            return f(*args, **kwargs)
         usuario = get_current_user()
         if not usuario or not usuario.casal_id:
             flash('Você precisa criar ou vincular-se a um casal primeiro!', 'warning')
-            return redirect(url_for('vincular_casal'))
+            return redirect(url_for('comercial.vincular_casal'))
         return f(*args, **kwargs)
     return decorated_function
 
 
+def usuario_id_atual():
+    """Id do usuário autenticado (token Bearer ou sessão)"""
+    if token_bearer():
+        dados = dados_token_acesso()
+        return dados['u'] if dados else None
+    return session.get('usuario_id')
+
+
+def casal_id_atual():
+    """Id do casal do usuário autenticado (token Bearer ou sessão)"""
+    usuario = get_current_user()
+    return usuario.casal_id if usuario else None
+
+
 def get_current_user():
     """Retorna o usuário logado atual"""
-    if 'usuario_id' in session:
-        return Usuario.query.get(session['usuario_id'])
+    usuario_id = usuario_id_atual()
+    if usuario_id:
+        return db.session.get(Usuario, usuario_id)
     return None
 
 
-def validar_imagem_conteudo(arquivo):
-    """Valida se o arquivo é realmente uma imagem pelo conteúdo (magic numbers)"""
-    magic_numbers = {
-        b'\xff\xd8\xff': 'jpg',
-        b'\x89PNG\r\n\x1a\n': 'png',
-        b'GIF87a': 'gif',
-        b'GIF89a': 'gif',
-        b'RIFF': 'webp',  # WebP começa com RIFF
-        b'\x00\x00\x00 ftyp': 'heic',
-    }
-    
-    header = arquivo.read(16)
-    arquivo.seek(0)  # Reset pointer
-    
-    for magic, ext in magic_numbers.items():
-        if header.startswith(magic):
-            return True
-    return False
+@bp.before_app_request
+def proteger_csrf():
+    """CSRF só para quem se autentica por cookie.
 
+    Requests com `Authorization: Bearer` não precisam: o navegador não envia
+    esse header sozinho em requests de outros sites.
+    """
+    if not current_app.config['WTF_CSRF_ENABLED']:
+        return
+    if request.method not in current_app.config['WTF_CSRF_METHODS'] or not request.endpoint:
+        return
+    if token_bearer() or request.endpoint in ENDPOINTS_SEM_CSRF:
+        return
+    csrf.protect()
 
-def salvar_foto(arquivo, pasta):
-    """Salva a foto com validação de segurança"""
+
+# Limites das imagens enviadas (sobrescrevíveis pelo config do app). Um
+# arquivo pequeno pode declarar 60000x60000 pixels e virar uma "bomba" de
+# memória quando alguém gerar uma miniatura; por isso as dimensões são
+# lidas dos cabeçalhos e checadas antes de o arquivo ser aceito.
+IMAGEM_MAX_LADO = 12000
+IMAGEM_MAX_PIXELS = 50_000_000  # câmeras de 48 MP cabem
+IMAGEM_MAX_QUADROS = 300  # GIF animado
+IMAGEM_MAX_SEGMENTOS = 256  # segmentos JPEG antes do SOF (inclui bytes de preenchimento)
+IMAGEM_MAX_BYTES = 5 * 1024 * 1024
+
+# Extensão aceita -> formato que o conteúdo precisa ter
+EXTENSOES_IMAGEM = {'jpg': 'jpeg', 'jpeg': 'jpeg', 'png': 'png', 'gif': 'gif', 'webp': 'webp'}
+
+# Marcadores SOF (início de quadro) do JPEG: C0-CF menos DHT (C4), JPG (C8) e DAC (CC)
+_MARCADORES_SOF = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+
+class ImagemInvalida(ValueError):
+    """Upload que não é uma imagem aceita, está corrompido ou passa dos limites"""
+
+
+class _LeitorImagem:
+    """Lê o arquivo em pedaços pequenos; pular() avança sem ler (memória constante)"""
+
+    def __init__(self, fluxo):
+        self.fluxo = fluxo
+        inicio = fluxo.tell()
+        fluxo.seek(0, 2)
+        self.fim = fluxo.tell()
+        fluxo.seek(inicio)
+
+    def ler(self, n):
+        dados = self.fluxo.read(n)
+        if len(dados) != n:
+            raise ImagemInvalida('arquivo truncado')
+        return dados
+
+    def pular(self, n):
+        if self.fluxo.tell() + n > self.fim:
+            raise ImagemInvalida('arquivo truncado')
+        self.fluxo.seek(n, 1)
+
+
+def _quadros_png(leitor):
+    comprimento, tipo, largura, altura = struct.unpack('>I4sII', leitor.ler(16))
+    if comprimento != 13 or tipo != b'IHDR':
+        raise ImagemInvalida('PNG sem IHDR')
+    yield largura, altura
+
+
+def _quadros_jpeg(leitor):
+    for _ in range(IMAGEM_MAX_SEGMENTOS):
+        if leitor.ler(1) != b'\xff':
+            raise ImagemInvalida('JPEG com segmento inválido')
+        marcador = leitor.ler(1)[0]
+        if marcador == 0xFF:  # byte de preenchimento; o 0xFF atual inicia o marcador
+            leitor.fluxo.seek(-1, 1)
+            continue
+        if marcador == 0x01 or 0xD0 <= marcador <= 0xD7:  # marcadores sem conteúdo
+            continue
+        if marcador in (0xD8, 0xD9, 0xDA):
+            raise ImagemInvalida('JPEG sem SOF')
+        comprimento = struct.unpack('>H', leitor.ler(2))[0]
+        if comprimento < 2:
+            raise ImagemInvalida('JPEG com segmento inválido')
+        if marcador in _MARCADORES_SOF:
+            if comprimento < 8:
+                raise ImagemInvalida('JPEG com SOF inválido')
+            _precisao, altura, largura = struct.unpack('>BHH', leitor.ler(5))
+            yield largura, altura
+            return
+        leitor.pular(comprimento - 2)
+    raise ImagemInvalida('JPEG com segmentos demais antes do SOF')
+
+
+def _pular_subblocos_gif(leitor):
+    while True:
+        tamanho = leitor.ler(1)[0]
+        if not tamanho:
+            return
+        leitor.pular(tamanho)
+
+
+def _quadros_gif(leitor):
+    # A tela lógica é o tamanho que os decodificadores alocam; cada quadro é checado também
+    largura, altura, flags = struct.unpack('<HHB', leitor.ler(5))
+    leitor.pular(2)
+    yield largura, altura
+    if flags & 0x80:
+        leitor.pular(3 << ((flags & 0x07) + 1))  # tabela de cores global
+    quadros = 0
+    while True:
+        bloco = leitor.ler(1)
+        if bloco == b';':
+            if not quadros:
+                raise ImagemInvalida('GIF sem quadros')
+            return
+        if bloco == b'!':  # extensão
+            leitor.pular(1)
+            _pular_subblocos_gif(leitor)
+        elif bloco == b',':  # quadro
+            _esquerda, _topo, largura, altura, flags = struct.unpack('<HHHHB', leitor.ler(9))
+            if flags & 0x80:
+                leitor.pular(3 << ((flags & 0x07) + 1))  # tabela de cores local
+            leitor.pular(1)  # tamanho mínimo do código LZW
+            _pular_subblocos_gif(leitor)
+            quadros += 1
+            yield largura, altura
+        else:
+            raise ImagemInvalida('GIF com bloco inválido')
+
+
+def _quadros_webp(leitor):
+    tamanho_riff, assinatura = struct.unpack('<I4s', leitor.ler(8))
+    if assinatura != b'WEBP':
+        raise ImagemInvalida('RIFF que não é WebP')
+    if tamanho_riff + 8 > leitor.fim:
+        raise ImagemInvalida('arquivo truncado')
+    tipo, _tamanho = struct.unpack('<4sI', leitor.ler(8))
+    if tipo == b'VP8 ':  # com perdas
+        dados = leitor.ler(10)
+        if dados[3:6] != b'\x9d\x01\x2a':
+            raise ImagemInvalida('WebP VP8 inválido')
+        largura, altura = struct.unpack('<HH', dados[6:10])
+        yield largura & 0x3FFF, altura & 0x3FFF
+    elif tipo == b'VP8L':  # sem perdas
+        dados = leitor.ler(5)
+        if dados[0] != 0x2F:
+            raise ImagemInvalida('WebP VP8L inválido')
+        bits = int.from_bytes(dados[1:5], 'little')
+        yield (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    elif tipo == b'VP8X':  # estendido (animação, alfa, metadados): tamanho da tela
+        dados = leitor.ler(10)
+        yield int.from_bytes(dados[4:7], 'little') + 1, int.from_bytes(dados[7:10], 'little') + 1
+    else:
+        raise ImagemInvalida('WebP com chunk desconhecido')
+
+
+FORMATOS_IMAGEM = (
+    (b'\xff\xd8', 'jpeg', _quadros_jpeg),
+    (b'\x89PNG\r\n\x1a\n', 'png', _quadros_png),
+    (b'GIF87a', 'gif', _quadros_gif),
+    (b'GIF89a', 'gif', _quadros_gif),
+    (b'RIFF', 'webp', _quadros_webp),
+)
+
+
+def ler_cabecalho_imagem(fluxo, max_lado=IMAGEM_MAX_LADO, max_pixels=IMAGEM_MAX_PIXELS,
+                         max_quadros=IMAGEM_MAX_QUADROS):
+    """Formato e dimensões de uma imagem, lendo só os cabeçalhos.
+
+    Devolve (formato, largura, altura). Levanta ImagemInvalida se o conteúdo
+    não for JPEG/PNG/GIF/WebP, estiver corrompido ou declarar dimensões
+    acima dos limites, parando na primeira violação. Volta o ponteiro ao
+    início do arquivo.
+    """
+    inicio = fluxo.tell()
+    try:
+        leitor = _LeitorImagem(fluxo)
+        assinatura = fluxo.read(8)
+        for magica, formato, quadros in FORMATOS_IMAGEM:
+            if assinatura.startswith(magica):
+                break
+        else:
+            raise ImagemInvalida('formato não aceito')
+        fluxo.seek(inicio + len(magica))
+        dimensoes = None
+        for numero, (largura, altura) in enumerate(quadros(leitor)):
+            if numero > max_quadros:
+                raise ImagemInvalida(f'mais de {max_quadros} quadros')
+            if not largura or not altura:
+                raise ImagemInvalida('dimensão zero')
+            if largura > max_lado or altura > max_lado or largura * altura > max_pixels:
+                raise ImagemInvalida(f'{largura}x{altura} passa do limite')
+            dimensoes = dimensoes or (largura, altura)
+        return formato, *dimensoes
+    except struct.error:
+        raise ImagemInvalida('cabeçalho inválido')
+    finally:
+        fluxo.seek(inicio)
+
+
+def validar_foto(arquivo):
+    """Extensão da foto enviada se ela passar nas validações; None (com flash) se não"""
     if not arquivo or not arquivo.filename:
         return None
     if '.' not in arquivo.filename:
@@ -340,28 +771,45 @@ def salvar_foto(arquivo, pasta):
     
     # Validar extensão
     ext = arquivo.filename.rsplit('.', 1)[1].lower()
-    extensoes_permitidas = ['jpg', 'jpeg', 'png', 'gif', 'webp']
     
-    if ext not in extensoes_permitidas:
+    if ext not in EXTENSOES_IMAGEM:
         flash('Tipo de arquivo não permitido!', 'error')
         return None
     
-    # Validar conteúdo do arquivo (magic numbers)
-    if not validar_imagem_conteudo(arquivo):
-        flash('Arquivo inválido!', 'error')
-        return None
-    
     # Validar tamanho (máximo 5MB para segurança)
     arquivo.seek(0, 2)  # Ir para o final
     tamanho = arquivo.tell()
     arquivo.seek(0)  # Reset
     
-    if tamanho > 5 * 1024 * 1024:  # 5MB
+    if tamanho > IMAGEM_MAX_BYTES:
         flash('Arquivo muito grande! Máximo 5MB.', 'error')
         return None
     
+    # Validar conteúdo: formato real igual ao da extensão e dimensões dentro dos limites
+    try:
+        formato, _largura, _altura = ler_cabecalho_imagem(
+            arquivo,
+            max_lado=current_app.config['IMAGEM_MAX_LADO'],
+            max_pixels=current_app.config['IMAGEM_MAX_PIXELS'],
+            max_quadros=current_app.config['IMAGEM_MAX_QUADROS'],
+        )
+        if formato != EXTENSOES_IMAGEM[ext]:
+            raise ImagemInvalida(f'conteúdo {formato} com extensão .{ext}')
+    except ImagemInvalida as erro:
+        log_seguranca('upload_recusado', motivo=str(erro), tamanho=tamanho)
+        flash('Arquivo inválido!', 'error')
+        return None
+    return ext
+
+
+def salvar_foto(arquivo, pasta):
+    """Salva a foto com validação de segurança"""
+    ext = validar_foto(arquivo)
+    if not ext:
+        return None
+    
     try:
-        pasta_completa = os.path.join(app.config['UPLOAD_FOLDER'], pasta)
+        pasta_completa = os.path.join(current_app.config['UPLOAD_FOLDER'], pasta)
         os.makedirs(pasta_completa, exist_ok=True)
         
         # Gerar nome seguro
@@ -375,7 +823,7 @@ def salvar_foto(arquivo, pasta):
         if os.path.exists(caminho_completo):
             return f"{pasta}/{filename}"
     except Exception as e:
-        app.logger.error(f"Erro ao salvar foto: {e}")
+        current_app.logger.error(f"Erro ao salvar foto: {e}")
         flash('Erro ao salvar arquivo!', 'error')
     
     return None
@@ -427,18 +875,20 @@ def sanitizar_input(texto):
 # REACT FRONTEND (NOVA IDENTIDADE VISUAL)
 # =================================================================
 
-@app.route('/')
+@bp.route('/')
 def index():
     """Serve o novo frontend React com identidade visual moderna"""
     return send_file('static/react/index.html')
 
 
-@app.route('/<path:path>')
+@bp.route('/<path:path>')
 def catch_all(path):
     """Serve arquivos estáticos ou React SPA"""
     # Serve arquivos estáticos existentes
     if os.path.exists(os.path.join('static', 'react', path)):
-        return send_from_directory('static/react', path)
+        # assets/ do build já têm o hash do conteúdo no nome
+        return send_from_directory('static/react', path,
+                                   max_age=CACHE_ESTATICO_S if path.startswith('assets/') else None)
     if os.path.exists(os.path.join('static', 'react', 'assets', path)):
         return send_from_directory('static/react/assets', path)
     
@@ -450,15 +900,15 @@ def catch_all(path):
 # LEGACY ROUTES (API e páginas antigas - mantidas para compatibilidade)
 # =================================================================
 
-@app.route('/legacy/')
+@bp.route('/legacy/')
 def legacy_index():
     """Página inicial legada - redireciona para login ou dashboard"""
     if 'usuario_id' in session:
-        return redirect(url_for('dashboard'))
-    return redirect(url_for('login'))
+        return redirect(url_for('comercial.dashboard'))
+    return redirect(url_for('comercial.login'))
 
 
-@app.route('/registrar', methods=['GET', 'POST'])
+@bp.route('/registrar', methods=['GET', 'POST'])
 @limiter.limit("3 per minute")  # Limitar criação de contas
 def registrar():
     """Página de registro público - qualquer pessoa pode criar conta"""
@@ -473,33 +923,36 @@ def registrar():
         # Validações de segurança
         if not nome or len(nome) < 2:
             flash('Nome inválido! Mínimo 2 caracteres.', 'error')
-            return redirect(url_for('registrar'))
+            return redirect(url_for('comercial.registrar'))
         
         if not validar_username(username):
             flash('Username inválido! Use apenas letras, números e underline (3-20 chars).', 'error')
-            return redirect(url_for('registrar'))
+            return redirect(url_for('comercial.registrar'))
         
         if not validar_email(email):
             flash('Email inválido!', 'error')
-            return redirect(url_for('registrar'))
+            return redirect(url_for('comercial.registrar'))
         
         if not validar_senha(senha):
             flash('Senha deve ter no mínimo 6 caracteres!', 'error')
-            return redirect(url_for('registrar'))
+            return redirect(url_for('comercial.registrar'))
         
         if senha != confirmar_senha:
             flash('As senhas não conferem!', 'error')
-            return redirect(url_for('registrar'))
+            return redirect(url_for('comercial.registrar'))
         
         if Usuario.query.filter_by(username=username).first():
+            log_seguranca('registro_recusado', username=username[:50], motivo='username_existente')
             flash('Este nome de usuário já existe!', 'error')
-            return redirect(url_for('registrar'))
+            return redirect(url_for('comercial.registrar'))
         
         if Usuario.query.filter_by(email=email).first():
+            log_seguranca('registro_recusado', username=username[:50], motivo='email_existente')
             flash('Este email já está cadastrado!', 'error')
-            return redirect(url_for('registrar'))
+            return redirect(url_for('comercial.registrar'))
         
         # Criar novo usuário
+        import bcrypt
         novo_usuario = Usuario(
             nome=nome,
             username=username,
@@ -512,12 +965,12 @@ def registrar():
         db.session.commit()
         
         flash('Conta criada com sucesso! Faça login para continuar.', 'success')
-        return redirect(url_for('login'))
+        return redirect(url_for('comercial.login'))
     
     return render_template('comercial/registrar.html')
 
 
-@app.route('/login', methods=['GET', 'POST'])
+@bp.route('/login', methods=['GET', 'POST'])
 @limiter.limit("5 per minute")  # Anti-brute force
 def login():
     """Página de login"""
@@ -533,29 +986,31 @@ def login():
             # Verificar se usuário já tem casal
             if usuario.casal_id:
                 flash(f'Bem-vindo de volta, {usuario.nome}! ❤️', 'success')
-                return redirect(url_for('dashboard'))
+                return redirect(url_for('comercial.dashboard'))
             else:
                 flash(f'Bem-vindo, {usuario.nome}! Agora crie ou vincule-se a um casal.', 'info')
-                return redirect(url_for('vincular_casal'))
+                return redirect(url_for('comercial.vincular_casal'))
         else:
+            log_seguranca('login_falhou', username=username[:50],
+                          motivo='senha_incorreta' if usuario else 'usuario_inexistente')
             flash('Usuário ou senha incorretos!', 'error')
     
     return render_template('comercial/login.html')
 
 
-@app.route('/logout')
+@bp.route('/logout')
 def logout():
     """Logout do usuário"""
     session.pop('usuario_id', None)
     flash('Até logo! 👋', 'info')
-    return redirect(url_for('login'))
+    return redirect(url_for('comercial.login'))
 
 
 # =================================================================
 # ROTAS DE VÍNCULO DE CASAL
 # =================================================================
 
-@app.route('/vincular-casal')
+@bp.route('/vincular-casal')
 @login_required
 def vincular_casal():
     """Página para criar ou vincular-se a um casal"""
@@ -563,14 +1018,14 @@ def vincular_casal():
     
     # Se já tem casal completo (com parceiro), vai para dashboard
     if usuario.casal_id and usuario.tem_parceiro():
-        return redirect(url_for('dashboard'))
+        return redirect(url_for('comercial.dashboard'))
     
     # Se tem casal mas não tem parceiro, mostra código
     casal = None
     codigo_novo = session.pop('codigo_casal_criado', None)
     
     if usuario.casal_id:
-        casal = Casal.query.get(usuario.casal_id)
+        casal = db.session.get(Casal, usuario.casal_id)
     
     return render_template('comercial/vincular_casal.html', 
                          usuario=usuario, 
@@ -578,7 +1033,7 @@ def vincular_casal():
                          codigo_novo=codigo_novo)
 
 
-@app.route('/criar-casal', methods=['POST'])
+@bp.route('/criar-casal', methods=['POST'])
 @login_required
 def criar_casal():
     """Cria um novo casal e gera código de convite"""
@@ -586,15 +1041,24 @@ def criar_casal():
     
     if usuario.casal_id:
         flash('Você já está em um casal!', 'error')
-        return redirect(url_for('dashboard'))
+        return redirect(url_for('comercial.dashboard'))
+    
+    # O shard sai antes da primeira gravação: casal e usuario vão pelo
+    # diretório anexado ao shard, na mesma transação da auditoria. Com WAL o
+    # SQLite não garante o commit atômico entre os dois arquivos; o
+    # shards-rebalancear reemite o evento se uma queda levar só o diretório.
+    indice = escolher_shard(usuario.id)
+    rotear_shard(indice or 0)
     
     # Criar novo casal
-    casal = Casal(codigo=Casal.gerar_codigo())
+    casal = Casal(codigo=Casal.gerar_codigo(), shard=indice)
     db.session.add(casal)
     db.session.flush()  # Obter ID sem commit
     
     # Vincular usuário ao casal
     usuario.casal_id = casal.id
+    casal.parceiro_a_id = usuario.id
+    registrar_evento('casal_criado', casal.id, usuario.id, casal.id)
     db.session.commit()
     
     # Armazenar código na sessão para exibição imediata
@@ -602,10 +1066,35 @@ def criar_casal():
     
     flash(f'🎉 Casal criado! Seu código de convite é: {casal.codigo}', 'success')
     flash('Compartilhe este código com seu parceiro(a) para vinculá-lo(a).', 'info')
-    return redirect(url_for('vincular_casal'))
+    return redirect(url_for('comercial.vincular_casal'))
+
+
+def ocupar_vaga_casal(casal_id, usuario_id):
+    """Põe o usuário na vaga B do casal, se ela e o usuário estiverem livres.
+
+    Dois UPDATEs condicionais na mesma transação: com dois pedidos ao mesmo
+    tempo só um encontra a vaga vazia, e o mesmo usuário não entra em dois
+    casais. Devolve False (sem alterar nada visível) se perdeu a corrida;
+    quem chama desfaz a transação.
+    """
+    vaga = db.session.execute(
+        db.update(Casal)
+        .where(Casal.id == casal_id, Casal.parceiro_b_id.is_(None), Casal.parceiro_a_id != usuario_id)
+        .values(parceiro_b_id=usuario_id)
+        .execution_options(synchronize_session='fetch')
+    )
+    if vaga.rowcount != 1:
+        return False
+    livre = db.session.execute(
+        db.update(Usuario)
+        .where(Usuario.id == usuario_id, Usuario.casal_id.is_(None))
+        .values(casal_id=casal_id)
+        .execution_options(synchronize_session='fetch')
+    )
+    return livre.rowcount == 1
 
 
-@app.route('/entrar-casal', methods=['POST'])
+@bp.route('/entrar-casal', methods=['POST'])
 @login_required
 def entrar_casal():
     """Vincula usuário a um casal existente via código"""
@@ -613,32 +1102,45 @@ def entrar_casal():
     
     if usuario.casal_id:
         flash('Você já está vinculado a um casal!', 'error')
-        return redirect(url_for('dashboard'))
+        return redirect(url_for('comercial.dashboard'))
     
     codigo = request.form['codigo'].upper().strip()
     casal = Casal.query.filter_by(codigo=codigo).first()
     
     if not casal:
         flash('Código de convite não encontrado!', 'error')
-        return redirect(url_for('vincular_casal'))
+        return redirect(url_for('comercial.vincular_casal'))
     
     if casal.esta_completo():
         flash('Este casal já está completo (já tem 2 membros)!', 'error')
-        return redirect(url_for('vincular_casal'))
+        return redirect(url_for('comercial.vincular_casal'))
     
-    # Vincular usuário ao casal
-    usuario.casal_id = casal.id
+    indice = shard_do_casal(casal.id)
+    if indice < 0:
+        flash('Este casal está em manutenção. Tente de novo em alguns segundos.', 'error')
+        return redirect(url_for('comercial.vincular_casal'))
+    
+    # Vincular usuário ao casal (a checagem acima é só para a mensagem; quem
+    # garante a vaga é o UPDATE condicional). O shard do casal é escolhido
+    # antes, para o vínculo e a auditoria irem na mesma transação (ver
+    # criar_casal sobre o commit entre o diretório e o shard).
+    rotear_shard(indice)
+    if not ocupar_vaga_casal(casal.id, usuario.id):
+        db.session.rollback()
+        flash('Este casal já está completo (já tem 2 membros)!', 'error')
+        return redirect(url_for('comercial.vincular_casal'))
+    registrar_evento('parceiro_entrou', casal.id, usuario.id, casal.id)
     db.session.commit()
     
     flash('🎉 Vinculado com sucesso! Agora vocês podem usar o app juntos.', 'success')
-    return redirect(url_for('dashboard'))
+    return redirect(url_for('comercial.dashboard'))
 
 
 # =================================================================
 # DASHBOARD
 # =================================================================
 
-@app.route('/dashboard')
+@bp.route('/dashboard')
 @login_required
 def dashboard():
     """Dashboard principal do usuário"""
@@ -646,9 +1148,9 @@ def dashboard():
     
     # Se não tem casal, redireciona para vincular
     if not usuario.casal_id:
-        return redirect(url_for('vincular_casal'))
+        return redirect(url_for('comercial.vincular_casal'))
     
-    casal = Casal.query.get(usuario.casal_id)
+    casal = db.session.get(Casal, usuario.casal_id)
     parceiro = usuario.get_parceiro()
     
     # Resumo rápido
@@ -692,24 +1194,28 @@ def dashboard():
                          tarefas_criadas=tarefas_criadas,
                          recompensas_para_aprovar=recompensas_para_aprovar,
                          recompensas_aprovadas=recompensas_aprovadas,
-                         vales_pendentes=vales_pendentes)
+                         vales_pendentes=vales_pendentes,
+                         notificacoes=notificacoes_nao_lidas(usuario.id, limite=5),
+                         agora=datetime.now())
 
 
 # =================================================================
 # ROTAS DE TAREFAS
 # =================================================================
 
-@app.route('/tarefas')
+@bp.route('/tarefas')
 @login_required
 @casal_required
 def pagina_tarefas():
     """Página de gerenciamento de tarefas"""
     usuario = get_current_user()
-    casal = Casal.query.get(usuario.casal_id)
+    casal = db.session.get(Casal, usuario.casal_id)
     parceiro = usuario.get_parceiro()
     
     # Minhas tarefas pendentes
-    minhas_tarefas = Tarefa.query.filter_by(
+    minhas_tarefas = Tarefa.query.options(
+        db.joinedload(Tarefa.criado_por)
+    ).filter_by(
         casal_id=casal.id,
         usuario_id=usuario.id,
         concluida=False
@@ -727,27 +1233,33 @@ def pagina_tarefas():
                          casal=casal,
                          parceiro=parceiro,
                          minhas_tarefas=minhas_tarefas,
-                         tarefas_criadas=tarefas_criadas)
+                         tarefas_criadas=tarefas_criadas,
+                         agora=datetime.now())
 
 
-@app.route('/tarefa/criar', methods=['POST'])
+@bp.route('/tarefa/criar', methods=['POST'])
 @login_required
 @casal_required
 def criar_tarefa():
     """Cria uma nova tarefa para o parceiro"""
     usuario = get_current_user()
-    casal = Casal.query.get(usuario.casal_id)
+    casal = db.session.get(Casal, usuario.casal_id)
     parceiro = usuario.get_parceiro()
     
     if not parceiro:
         flash('Você precisa de um parceiro vinculado para criar tarefas!', 'error')
-        return redirect(url_for('pagina_tarefas'))
+        return redirect(url_for('comercial.pagina_tarefas'))
     
     titulo = request.form['titulo']
     descricao = request.form.get('descricao', '')
     pontos = int(request.form.get('pontos', 10))
     recorrente = request.form.get('recorrente') == '1'
     frequencia = request.form.get('frequencia', 'diaria') if recorrente else None
+    try:
+        prazo = ler_prazo(request.form.get('prazo'))
+    except ValueError:
+        flash('Prazo inválido!', 'error')
+        return redirect(url_for('comercial.pagina_tarefas'))
     
     tarefa = Tarefa(
         titulo=titulo,
@@ -757,34 +1269,52 @@ def criar_tarefa():
         usuario_id=parceiro.id,  # Quem deve fazer
         criado_por_id=usuario.id,  # Quem criou
         recorrente=recorrente,
-        frequencia=frequencia
+        frequencia=frequencia,
+        prazo=prazo
     )
     db.session.add(tarefa)
+    aprender_modelo(casal.id, titulo, descricao, pontos, frequencia)
+    registrar_evento('tarefa_criada', casal.id, usuario.id, tarefa,
+                     titulo=titulo, pontos=pontos, para=parceiro.id, prazo=prazo)
     db.session.commit()
     
     if recorrente:
-        freq_texto = {'diaria': 'diaria', 'semanal': 'semanal', 'quinzenal': 'quinzenal', 'mensal': 'mensal'}.get(frequencia, 'recorrente')
+        freq_texto = rotulo_frequencia(frequencia).lower()
         flash(f'Tarefa {freq_texto} criada para {parceiro.nome}!', 'success')
     else:
         flash(f'Tarefa criada para {parceiro.nome}!', 'success')
     
-    return redirect(url_for('pagina_tarefas'))
+    return redirect(url_for('comercial.pagina_tarefas'))
 
 
-@app.route('/tarefa/concluir/<int:id>', methods=['POST'])
+@bp.route('/tarefa/concluir/<int:id>', methods=['POST'])
 @login_required
 @casal_required
 def concluir_tarefa(id):
     """Marca uma tarefa como concluída"""
     usuario = get_current_user()
-    casal = Casal.query.get(usuario.casal_id)
+    casal = db.session.get(Casal, usuario.casal_id)
     
     tarefa = Tarefa.query.filter_by(id=id, casal_id=casal.id).first_or_404()
     
     # Verificar se a tarefa é do usuário
     if tarefa.usuario_id != usuario.id:
         flash('Esta tarefa não é sua!', 'error')
-        return redirect(url_for('pagina_tarefas'))
+        return redirect(url_for('comercial.pagina_tarefas'))
+    
+    # Marcar como concluída só se ainda estiver pendente: um clique duplo ou
+    # um POST repetido não conta pontos, estatísticas e sequência de novo
+    agora = datetime.now()
+    concluiu = db.session.execute(
+        db.update(Tarefa)
+        .where(Tarefa.id == tarefa.id, Tarefa.concluida == False)
+        .values(concluida=True, data_conclusao=agora)
+        .execution_options(synchronize_session='fetch')
+    ).rowcount
+    if not concluiu:
+        db.session.rollback()
+        flash('Esta tarefa já foi concluída!', 'info')
+        return redirect(url_for('comercial.pagina_tarefas'))
     
     # Processar foto de comprovação
     foto = request.files.get('foto_comprovacao')
@@ -793,12 +1323,11 @@ def concluir_tarefa(id):
         if caminho_foto:
             tarefa.foto = caminho_foto
     
-    # Marcar como concluída
-    tarefa.concluida = True
-    tarefa.data_conclusao = datetime.now()
-    db.session.commit()
+    registrar_conclusoes([tarefa], agora)
+    registrar_evento('tarefa_concluida', casal.id, usuario.id, tarefa.id,
+                     titulo=tarefa.titulo, pontos=tarefa.pontos, foto=bool(tarefa.foto))
     
-    # Se for recorrente, criar nova tarefa
+    # Se for recorrente, criar a próxima na mesma transação
     if tarefa.recorrente:
         nova_tarefa = Tarefa(
             titulo=tarefa.titulo,
@@ -808,57 +1337,62 @@ def concluir_tarefa(id):
             usuario_id=tarefa.usuario_id,
             criado_por_id=tarefa.criado_por_id,
             recorrente=tarefa.recorrente,
-            frequencia=tarefa.frequencia
+            frequencia=tarefa.frequencia,
+            prazo=proximo_prazo(tarefa.prazo, tarefa.frequencia)
         )
         db.session.add(nova_tarefa)
-        db.session.commit()
-        freq_texto = {'diaria': 'diaria', 'semanal': 'semanal', 'quinzenal': 'quinzenal', 'mensal': 'mensal'}.get(tarefa.frequencia, 'recorrente')
+    db.session.commit()
+    
+    if tarefa.recorrente:
+        freq_texto = rotulo_frequencia(tarefa.frequencia).lower()
         flash(f'Voce ganhou {tarefa.pontos} pontos! Nova tarefa {freq_texto} criada!', 'success')
     else:
         flash(f'Voce ganhou {tarefa.pontos} pontos!', 'success')
     
-    return redirect(url_for('pagina_tarefas'))
+    return redirect(url_for('comercial.pagina_tarefas'))
 
 
-@app.route('/tarefa/excluir/<int:id>')
+@bp.route('/tarefa/excluir/<int:id>')
 @login_required
 @casal_required
 def excluir_tarefa(id):
     """Exclui uma tarefa"""
     usuario = get_current_user()
-    casal = Casal.query.get(usuario.casal_id)
+    casal = db.session.get(Casal, usuario.casal_id)
     
     tarefa = Tarefa.query.filter_by(id=id, casal_id=casal.id).first_or_404()
     
     # Só quem criou pode excluir
     if tarefa.criado_por_id != usuario.id:
         flash('Voce nao pode excluir esta tarefa!', 'error')
-        return redirect(url_for('pagina_tarefas'))
+        return redirect(url_for('comercial.pagina_tarefas'))
     
     # Remover foto se existir
     if tarefa.foto:
         try:
-            os.remove(os.path.join(app.config['UPLOAD_FOLDER'], tarefa.foto))
+            os.remove(os.path.join(current_app.config['UPLOAD_FOLDER'], tarefa.foto))
         except:
             pass
     
     db.session.delete(tarefa)
+    registrar_evento('tarefa_excluida', casal.id, usuario.id, tarefa.id,
+                     titulo=tarefa.titulo, pontos=tarefa.pontos, para=tarefa.usuario_id)
     db.session.commit()
     flash('Tarefa removida!', 'info')
-    return redirect(url_for('pagina_tarefas'))
+    return redirect(url_for('comercial.pagina_tarefas'))
 
 
 # =================================================================
 # ROTAS DE RECOMPENSAS
 # =================================================================
 
-@app.route('/recompensas/sugerir')
+@bp.route('/recompensas/sugerir')
 @login_required
 @casal_required
 def pagina_sugerir_recompensa():
     """Página para sugerir recompensas"""
     usuario = get_current_user()
-    casal = Casal.query.get(usuario.casal_id)
+    casal = db.session.get(Casal, usuario.casal_id)
     
     # Minhas recompensas pendentes
     minhas_pendentes = Recompensa.query.filter_by(
@@ -869,7 +1403,9 @@ def pagina_sugerir_recompensa():
     ).order_by(Recompensa.data_criacao.desc()).all()
     
     # Minhas recompensas aprovadas
-    minhas_aprovadas = Recompensa.query.filter_by(
+    minhas_aprovadas = Recompensa.query.options(
+        db.joinedload(Recompensa.aprovado_por)
+    ).filter_by(
         casal_id=casal.id,
         usuario_id=usuario.id,
         status='aprovada',
@@ -892,13 +1428,13 @@ def pagina_sugerir_recompensa():
                          minhas_rejeitadas=minhas_rejeitadas)
 
 
-@app.route('/recompensa/sugerir', methods=['POST'])
+@bp.route('/recompensa/sugerir', methods=['POST'])
 @login_required
 @casal_required
 def sugerir_recompensa():
     """Sugere uma nova recompensa"""
     usuario = get_current_user()
-    casal = Casal.query.get(usuario.casal_id)
+    casal = db.session.get(Casal, usuario.casal_id)
     
     titulo = request.form['titulo']
     descricao = request.form.get('descricao', '')
@@ -919,57 +1455,62 @@ def sugerir_recompensa():
         status='pendente'
     )
     db.session.add(recompensa)
+    registrar_evento('recompensa_sugerida', casal.id, usuario.id, recompensa,
+                     titulo=titulo, custo_sugerido=custo_sugerido)
     db.session.commit()
     
     flash('Recompensa enviada para aprovacao do parceiro!', 'success')
-    return redirect(url_for('pagina_sugerir_recompensa'))
+    return redirect(url_for('comercial.pagina_sugerir_recompensa'))
 
 
-@app.route('/recompensa/excluir/<int:id>')
+@bp.route('/recompensa/excluir/<int:id>')
 @login_required
 @casal_required
 def excluir_recompensa(id):
     """Exclui uma recompensa sugerida"""
     usuario = get_current_user()
-    casal = Casal.query.get(usuario.casal_id)
+    casal = db.session.get(Casal, usuario.casal_id)
     
     recompensa = Recompensa.query.filter_by(id=id, casal_id=casal.id).first_or_404()
     
     if recompensa.criado_por_id != usuario.id:
         flash('Voce nao pode excluir esta recompensa!', 'error')
-        return redirect(url_for('pagina_sugerir_recompensa'))
+        return redirect(url_for('comercial.pagina_sugerir_recompensa'))
     
     if recompensa.foto:
         try:
-            os.remove(os.path.join(app.config['UPLOAD_FOLDER'], recompensa.foto))
+            os.remove(os.path.join(current_app.config['UPLOAD_FOLDER'], recompensa.foto))
         except:
             pass
     
     recompensa.ativa = False
+    registrar_evento('recompensa_excluida', casal.id, usuario.id, recompensa.id, titulo=recompensa.titulo)
     db.session.commit()
     flash('Recompensa removida!', 'info')
-    return redirect(url_for('pagina_sugerir_recompensa'))
+    return redirect(url_for('comercial.pagina_sugerir_recompensa'))
 
 
 # =================================================================
 # ROTAS DE APROVAÇÃO
 # =================================================================
 
-@app.route('/aprovacoes')
+@bp.route('/aprovacoes')
 @login_required
 @casal_required
 def pagina_aprovacoes():
     """Página para aprovar recompensas do parceiro"""
     usuario = get_current_user()
-    casal = Casal.query.get(usuario.casal_id)
+    casal = db.session.get(Casal, usuario.casal_id)
     parceiro = usuario.get_parceiro()
     
     if not parceiro:
         flash('Aguardando parceiro se vincular!', 'warning')
-        return redirect(url_for('dashboard'))
+        return redirect(url_for('comercial.dashboard'))
     
     # Recompensas do parceiro pendentes de aprovação
-    recompensas_para_aprovar = Recompensa.query.filter_by(
+    recompensas_para_aprovar = Recompensa.query.options(
+        db.joinedload(Recompensa.criado_por)
+    ).filter_by(
         casal_id=casal.id,
         usuario_id=parceiro.id,
         status='pendente',
@@ -983,20 +1524,20 @@ def pagina_aprovacoes():
                          recompensas_para_aprovar=recompensas_para_aprovar)
 
 
-@app.route('/recompensa/aprovar/<int:id>', methods=['POST'])
+@bp.route('/recompensa/aprovar/<int:id>', methods=['POST'])
 @login_required
 @casal_required
 def aprovar_recompensa(id):
     """Aprova ou rejeita uma recompensa"""
     usuario = get_current_user()
-    casal = Casal.query.get(usuario.casal_id)
+    casal = db.session.get(Casal, usuario.casal_id)
     
     recompensa = Recompensa.query.filter_by(id=id, casal_id=casal.id).first_or_404()
     
     # Só o parceiro (quem vai "pagar") pode aprovar
     if recompensa.usuario_id == usuario.id:
         flash('Voce nao pode aprovar sua propria recompensa!', 'error')
-        return redirect(url_for('pagina_aprovacoes'))
+        return redirect(url_for('comercial.pagina_aprovacoes'))
     
     acao = request.form['acao']
     
@@ -1006,29 +1547,32 @@ def aprovar_recompensa(id):
         recompensa.status = 'aprovada'
         recompensa.aprovado_por_id = usuario.id
         recompensa.data_aprovacao = datetime.now()
+        registrar_evento('recompensa_aprovada', casal.id, usuario.id, recompensa.id,
+                         titulo=recompensa.titulo, custo=custo, custo_sugerido=recompensa.custo_sugerido)
         db.session.commit()
         flash(f'Recompensa aprovada com custo de {custo} pontos!', 'success')
     else:
         recompensa.status = 'rejeitada'
         recompensa.aprovado_por_id = usuario.id
         recompensa.data_aprovacao = datetime.now()
+        registrar_evento('recompensa_rejeitada', casal.id, usuario.id, recompensa.id, titulo=recompensa.titulo)
         db.session.commit()
         flash('Recompensa rejeitada.', 'info')
     
-    return redirect(url_for('pagina_aprovacoes'))
+    return redirect(url_for('comercial.pagina_aprovacoes'))
 
 
 # =================================================================
 # ROTAS DA LOJA
 # =================================================================
 
-@app.route('/loja')
+@bp.route('/loja')
 @login_required
 @casal_required
 def pagina_loja():
     """Loja de recompensas aprovadas"""
     usuario = get_current_user()
-    casal = Casal.query.get(usuario.casal_id)
+    casal = db.session.get(Casal, usuario.casal_id)
     parceiro = usuario.get_parceiro()
     
     # Minhas recompensas aprovadas (que posso resgatar)
@@ -1043,16 +1587,17 @@ def pagina_loja():
                          usuario=usuario,
                          casal=casal,
                          parceiro=parceiro,
+                         saldo=usuario.saldo,  # calculado uma vez: cada leitura de usuario.saldo consulta o banco
                          minhas_recompensas=minhas_recompensas)
 
 
-@app.route('/resgatar/<int:recompensa_id>', methods=['POST'])
+@bp.route('/resgatar/<int:recompensa_id>', methods=['POST'])
 @login_required
 @casal_required
 def resgatar(recompensa_id):
     """Resgata uma recompensa"""
     usuario = get_current_user()
-    casal = Casal.query.get(usuario.casal_id)
+    casal = db.session.get(Casal, usuario.casal_id)
     
     recompensa = Recompensa.query.filter_by(
         id=recompensa_id,
@@ -1062,40 +1607,51 @@ def resgatar(recompensa_id):
     # Verificar se a recompensa é do usuário
     if recompensa.usuario_id != usuario.id:
         flash('Esta recompensa nao e sua!', 'error')
-        return redirect(url_for('pagina_loja'))
+        return redirect(url_for('comercial.pagina_loja'))
     
     if recompensa.status != 'aprovada':
         flash('Esta recompensa ainda nao foi aprovada!', 'error')
-        return redirect(url_for('pagina_loja'))
+        return redirect(url_for('comercial.pagina_loja'))
     
     if usuario.saldo < recompensa.custo:
         flash(f'Pontos insuficientes! Voce tem {usuario.saldo} pts.', 'error')
-        return redirect(url_for('pagina_loja'))
+        return redirect(url_for('comercial.pagina_loja'))
     
     # Criar resgate
     resgate = Resgate(
         usuario_id=usuario.id,
         recompensa_id=recompensa.id,
-        custo=recompensa.costo
+        custo=recompensa.custo,
+        data_resgate=datetime.now()
     )
     db.session.add(resgate)
+    # O INSERT pega a trava de escrita do banco; o saldo relido depois dele
+    # já conta resgates simultâneos (quem chegou depois espera a trava)
+    db.session.flush()
+    if usuario.saldo < 0:
+        db.session.rollback()
+        flash('Pontos insuficientes! Outro resgate acabou de usar seus pontos.', 'error')
+        return redirect(url_for('comercial.pagina_loja'))
+    registrar_resgates([(usuario.id, casal.id, resgate.custo)], resgate.data_resgate)
+    registrar_evento('recompensa_resgatada', casal.id, usuario.id, resgate,
+                     recompensa_id=recompensa.id, titulo=recompensa.titulo, custo=resgate.custo)
     db.session.commit()
     
     flash(f'Voce resgatou: {recompensa.titulo}! Seu parceiro foi notificado.', 'success')
-    return redirect(url_for('pagina_loja'))
+    return redirect(url_for('comercial.pagina_loja'))
 
 
 # =================================================================
 # ROTAS DE HISTÓRICO
 # =================================================================
 
-@app.route('/historico/conclusoes')
+@bp.route('/historico/conclusoes')
 @login_required
 @casal_required
 def pagina_historico_conclusoes():
     """Histórico de tarefas concluídas"""
     usuario = get_current_user()
-    casal = Casal.query.get(usuario.casal_id)
+    casal = db.session.get(Casal, usuario.casal_id)
     parceiro = usuario.get_parceiro()
     
     # Tarefas concluídas do casal
@@ -1111,17 +1667,19 @@ def pagina_historico_conclusoes():
                          tarefas_concluidas=tarefas_concluidas)
 
 
-@app.route('/historico/resgates')
+@bp.route('/historico/resgates')
 @login_required
 @casal_required
 def pagina_historico_resgates():
     """Histórico de resgates (vales)"""
     usuario = get_current_user()
-    casal = Casal.query.get(usuario.casal_id)
+    casal = db.session.get(Casal, usuario.casal_id)
     parceiro = usuario.get_parceiro()
     
     # Meus vales (resgates que fiz)
-    meus_vales = Resgate.query.join(Recompensa).filter(
+    meus_vales = Resgate.query.join(Recompensa).options(
+        db.contains_eager(Resgate.recompensa)
+    ).filter(
         Recompensa.casal_id == casal.id,
         Resgate.usuario_id == usuario.id
     ).order_by(Resgate.data_resgate.desc()).all()
@@ -1129,7 +1687,9 @@ def pagina_historico_resgates():
     # Vales do parceiro pendentes (o que ele me deve)
     vales_parceiro = []
     if parceiro:
-        vales_parceiro = Resgate.query.join(Recompensa).filter(
+        vales_parceiro = Resgate.query.join(Recompensa).options(
+            db.contains_eager(Resgate.recompensa)
+        ).filter(
             Recompensa.casal_id == casal.id,
             Resgate.usuario_id == parceiro.id,
             Resgate.utilizado == False
@@ -1143,13 +1703,13 @@ def pagina_historico_resgates():
                          vales_parceiro=vales_parceiro)
 
 
-@app.route('/vale/usar/<int:id>')
+@bp.route('/vale/usar/<int:id>')
 @login_required
 @casal_required
 def usar_vale(id):
     """Marca um vale como utilizado"""
     usuario = get_current_user()
-    casal = Casal.query.get(usuario.casal_id)
+    casal = db.session.get(Casal, usuario.casal_id)
     
     vale = Resgate.query.join(Recompensa).filter(
         Resgate.id == id,
@@ -1159,26 +1719,3505 @@ def usar_vale(id):
     # Só quem resgatou pode marcar como usado
     if vale.usuario_id != usuario.id:
         flash('Este vale nao e seu!', 'error')
-        return redirect(url_for('pagina_historico_resgates'))
+        return redirect(url_for('comercial.pagina_historico_resgates'))
     
-    vale.utilizado = True
+    # Só marca se ainda não foi usado: a rota é GET, então recarregar a
+    # página ou um prefetch do link não gera outro evento vale_usado
+    usou = db.session.execute(
+        db.update(Resgate)
+        .where(Resgate.id == vale.id, Resgate.utilizado == False)
+        .values(utilizado=True)
+        .execution_options(synchronize_session='fetch')
+    ).rowcount
+    if not usou:
+        db.session.rollback()
+        flash('Este vale já foi utilizado!', 'info')
+        return redirect(url_for('comercial.pagina_historico_resgates'))
+    registrar_evento('vale_usado', casal.id, usuario.id, vale.id, recompensa_id=vale.recompensa_id)
     db.session.commit()
     
     flash('Vale utilizado! Aproveitem! 💕', 'success')
-    return redirect(url_for('pagina_historico_resgates'))
+    return redirect(url_for('comercial.pagina_historico_resgates'))
 
 
 # =================================================================
-# INICIALIZAÇÃO
+# PERFIL E AVATARES
 # =================================================================
 
-def init_db():
-    """Inicializa o banco de dados"""
-    with app.app_context():
-        db.create_all()
-        print("[OK] Banco de dados criado com sucesso!")
+# A foto de perfil é recortada no centro em quadrados AVATAR_LADOS e salva
+# em UPLOAD_FOLDER/perfis como <hash>-<lado>.webp, com o hash do arquivo
+# enviado no nome: o conteúdo de uma URL nunca muda, então /avatares/ sai
+# com cache público de um ano (immutable) e pode ficar atrás de uma CDN
+# (CDN_URL). Usuario.foto guarda o recorte maior.
 
+AVATAR_LADOS = (64, 128, 256)
+AVATAR_VERSAO = b'1'  # entra no hash: mudar o recorte gera nomes novos
+AVATAR_QUALIDADE = 82
+RE_COR = re.compile(r'^#[0-9a-fA-F]{6}$')
 
-if __name__ == '__main__':
-    init_db()
+
+def nome_avatar(foto, lado):
+    """'perfis/abc-256.webp' -> 'abc-64.webp' (recorte de outro tamanho)"""
+    return f"{os.path.basename(foto).rsplit('-', 1)[0]}-{lado}.webp"
+
+
+@bp.app_template_global()
+def url_avatar(usuario, lado=AVATAR_LADOS[0]):
+    """URL do avatar do usuário no tamanho pedido; None se ele usa emoji"""
+    if not usuario or not usuario.foto:
+        return None
+    return (current_app.config['CDN_URL'] or '') + url_for('comercial.avatar', nome=nome_avatar(usuario.foto, lado))
+
+
+def gerar_avatar(arquivo):
+    """Recorta a foto (já validada) nos AVATAR_LADOS; devolve o caminho do maior"""
+    from PIL import Image, ImageOps  # importado sob demanda: só o upload de avatar precisa
+
+    dados = arquivo.read()
+    resumo = hashlib.sha256(AVATAR_VERSAO + dados).hexdigest()[:20]
+    pasta = os.path.join(current_app.config['UPLOAD_FOLDER'], 'perfis')
+    os.makedirs(pasta, exist_ok=True)
+    caminhos = {lado: os.path.join(pasta, f'{resumo}-{lado}.webp') for lado in AVATAR_LADOS}
+    if not all(os.path.exists(caminho) for caminho in caminhos.values()):
+        Image.MAX_IMAGE_PIXELS = current_app.config['IMAGEM_MAX_PIXELS']
+        with Image.open(io.BytesIO(dados)) as imagem:
+            imagem.draft('RGB', (AVATAR_LADOS[-1] * 2, AVATAR_LADOS[-1] * 2))  # JPEG: decodifica já reduzido
+            imagem = ImageOps.exif_transpose(imagem)  # fotos de celular vêm giradas no EXIF
+            imagem = imagem.convert('RGBA' if 'A' in imagem.getbands() or 'transparency' in imagem.info else 'RGB')
+            for lado, caminho in caminhos.items():
+                recorte = ImageOps.fit(imagem, (lado, lado), Image.Resampling.LANCZOS)
+                temporario = f'{caminho}.{uuid.uuid4().hex}.tmp'
+                recorte.save(temporario, 'WEBP', quality=AVATAR_QUALIDADE, method=6)
+                os.replace(temporario, caminho)
+    return f'perfis/{resumo}-{AVATAR_LADOS[-1]}.webp'
+
+
+def apagar_avatar(foto):
+    """Apaga os recortes de um avatar que nenhum usuário usa mais"""
+    if not foto or Usuario.query.filter_by(foto=foto).first():
+        return
+    for lado in AVATAR_LADOS:
+        try:
+            os.remove(os.path.join(current_app.config['UPLOAD_FOLDER'], 'perfis', nome_avatar(foto, lado)))
+        except OSError:
+            pass
+
+
+@bp.route('/perfil')
+@login_required
+def pagina_perfil():
+    """Página de edição do perfil (nome, emoji, cor e foto)"""
+    usuario = get_current_user()
+    return render_template('comercial/perfil.html', usuario=usuario, lados=AVATAR_LADOS)
+
+
+@bp.route('/perfil', methods=['POST'])
+@login_required
+def salvar_perfil():
+    """Atualiza nome, emoji e cor do usuário"""
+    usuario = get_current_user()
+    nome = sanitizar_input(request.form.get('nome', ''))[:50]
+    emoji = request.form.get('emoji', '').strip()
+    cor = request.form.get('cor', '').strip()
+
+    if len(nome) < 2:
+        flash('Nome inválido! Mínimo 2 caracteres.', 'error')
+        return redirect(url_for('comercial.pagina_perfil'))
+    if not emoji or len(emoji) > 10 or '<' in emoji:
+        flash('Emoji inválido!', 'error')
+        return redirect(url_for('comercial.pagina_perfil'))
+    if not RE_COR.match(cor):
+        flash('Cor inválida!', 'error')
+        return redirect(url_for('comercial.pagina_perfil'))
+
+    usuario.nome, usuario.emoji, usuario.cor = nome, emoji, cor.lower()
+    db.session.commit()
+    flash('Perfil atualizado!', 'success')
+    return redirect(url_for('comercial.pagina_perfil'))
+
+
+@bp.route('/perfil/foto', methods=['POST'])
+@limiter.limit("10 per hour")
+@login_required
+def enviar_foto_perfil():
+    """Troca a foto de perfil (recortada nos tamanhos de avatar)"""
+    usuario = get_current_user()
+    arquivo = request.files.get('foto')
+    if not validar_foto(arquivo):
+        if not arquivo or not arquivo.filename:
+            flash('Escolha uma foto!', 'error')
+        return redirect(url_for('comercial.pagina_perfil'))
+
+    try:
+        foto = gerar_avatar(arquivo)
+    except Exception as e:
+        current_app.logger.error(f"Erro ao gerar avatar: {e}")
+        flash('Não foi possível ler esta imagem!', 'error')
+        return redirect(url_for('comercial.pagina_perfil'))
+
+    antiga, usuario.foto = usuario.foto, foto
+    db.session.commit()
+    if antiga != foto:
+        apagar_avatar(antiga)
+    flash('Foto atualizada!', 'success')
+    return redirect(url_for('comercial.pagina_perfil'))
+
+
+@bp.route('/perfil/foto/remover', methods=['POST'])
+@login_required
+def remover_foto_perfil():
+    """Volta para o avatar de emoji"""
+    usuario = get_current_user()
+    antiga, usuario.foto = usuario.foto, None
+    db.session.commit()
+    apagar_avatar(antiga)
+    flash('Foto removida!', 'success')
+    return redirect(url_for('comercial.pagina_perfil'))
+
+
+@bp.route('/avatares/<nome>')
+@limiter.exempt
+def avatar(nome):
+    """Recorte de avatar: público e imutável (o nome muda quando a foto muda)"""
+    resposta = send_from_directory(os.path.abspath(os.path.join(current_app.config['UPLOAD_FOLDER'], 'perfis')),
+                                   nome, max_age=CACHE_ESTATICO_S)
+    resposta.cache_control.public = True
+    resposta.cache_control.immutable = True
+    return resposta
+
+
+@bp.route('/uploads/<path:filename>')
+@limiter.exempt
+@login_required
+def uploaded_file(filename):
+    """Fotos de tarefas e recompensas (nomes aleatórios, nunca reescritos)"""
+    resposta = send_from_directory(os.path.abspath(current_app.config['UPLOAD_FOLDER']), filename,
+                                   max_age=CACHE_ESTATICO_S)
+    resposta.cache_control.public = False  # só para quem está logado: nada de cache compartilhado
+    resposta.cache_control.private = True
+    resposta.cache_control.immutable = True
+    return resposta
+
+
+# =================================================================
+# AUTENTICAÇÃO POR TOKEN (API)
+# =================================================================
+
+# Clientes JSON/SPA trocam usuário e senha por um par de tokens:
+# - acesso: assinado, curto (15 min), validado sem consultar o banco;
+# - renovação: aleatório, guardado como hash, trocado a cada uso.
+# O bcrypt só roda em POST /api/token.
+
+ENDPOINTS_SEM_CSRF = {
+    'comercial.api_token',
+    'comercial.api_token_renovar',
+    'comercial.api_token_revogar',
+}
+
+
+def hash_token(token):
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+
+def emitir_tokens(usuario, familia=None):
+    """Cria um refresh token (na família dada ou numa nova) e o token de acesso"""
+    token_renovacao = secrets.token_urlsafe(32)
+    db.session.add(TokenRenovacao(
+        usuario_id=usuario.id,
+        familia=familia or uuid.uuid4().hex,
+        token_hash=hash_token(token_renovacao),
+        expira_em=datetime.now() + timedelta(days=current_app.config['API_TOKEN_RENOVACAO_DIAS'])
+    ))
+    return {
+        'access_token': gerar_token_acesso(usuario),
+        'token_type': 'Bearer',
+        'expires_in': current_app.config['API_TOKEN_ACESSO_SEGUNDOS'],
+        'refresh_token': token_renovacao,
+    }
+
+
+def ler_token_renovacao():
+    dados = request.get_json(silent=True)
+    token = dados.get('refresh_token') if isinstance(dados, dict) else None
+    return token if isinstance(token, str) and token else None
+
+
+@bp.route('/api/token', methods=['POST'])
+@limiter.limit("5 per minute")  # Anti-brute force (mesmo limite do login)
+def api_token():
+    """Login da API: {"username", "senha"} -> token de acesso + refresh token"""
+    dados = request.get_json(silent=True)
+    dados = dados if isinstance(dados, dict) else {}
+    username = dados.get('username')
+    senha = dados.get('senha')
+    if not isinstance(username, str) or not isinstance(senha, str):
+        return erro_token('credenciais_ausentes', 400)
+
+    usuario = Usuario.query.filter_by(username=username).first()
+    if not usuario or not usuario.verificar_senha(senha):
+        log_seguranca('login_falhou', username=username[:50],
+                      motivo='senha_incorreta' if usuario else 'usuario_inexistente')
+        return erro_token('credenciais_invalidas')
+
+    # Limpa os refresh tokens vencidos do usuário a cada novo login
+    db.session.execute(
+        db.delete(TokenRenovacao).where(
+            TokenRenovacao.usuario_id == usuario.id,
+            TokenRenovacao.expira_em < datetime.now()
+        )
+    )
+    tokens = emitir_tokens(usuario)
+    db.session.commit()
+    return jsonify(tokens)
+
+
+@bp.route('/api/token/renovar', methods=['POST'])
+@limiter.limit("30 per minute")
+def api_token_renovar():
+    """Troca um refresh token por um par novo; o antigo deixa de valer"""
+    token = ler_token_renovacao()
+    if not token:
+        return erro_token('refresh_token_ausente', 400)
+
+    agora = datetime.now()
+    registro = TokenRenovacao.query.filter_by(token_hash=hash_token(token)).first()
+    if not registro or registro.expira_em < agora:
+        return erro_token('refresh_token_invalido')
+    if registro.revogado:
+        return erro_token('refresh_token_revogado')
+
+    # Marca como usado só se ninguém usou antes (corrida entre duas abas)
+    marcado = db.session.execute(
+        db.update(TokenRenovacao)
+        .where(
+            TokenRenovacao.id == registro.id,
+            TokenRenovacao.usado_em.is_(None),
+            TokenRenovacao.revogado == False
+        )
+        .values(usado_em=agora),
+        execution_options={'synchronize_session': False}
+    ).rowcount
+
+    if not marcado:
+        # Reuso de token já trocado: revoga a família inteira
+        db.session.execute(
+            db.update(TokenRenovacao)
+            .where(TokenRenovacao.familia == registro.familia)
+            .values(revogado=True),
+            execution_options={'synchronize_session': False}
+        )
+        db.session.commit()
+        log_seguranca('refresh_reutilizado', usuario_id=registro.usuario_id, familia=registro.familia)
+        return erro_token('refresh_token_revogado')
+
+    usuario = db.session.get(Usuario, registro.usuario_id)
+    tokens = emitir_tokens(usuario, familia=registro.familia)
+    db.session.commit()
+    return jsonify(tokens)
+
+
+@bp.route('/api/token/revogar', methods=['POST'])
+def api_token_revogar():
+    """Logout da API: revoga o refresh token e todos os derivados dele"""
+    token = ler_token_renovacao()
+    if not token:
+        return erro_token('refresh_token_ausente', 400)
+
+    registro = TokenRenovacao.query.filter_by(token_hash=hash_token(token)).first()
+    if registro:
+        db.session.execute(
+            db.update(TokenRenovacao)
+            .where(TokenRenovacao.familia == registro.familia)
+            .values(revogado=True),
+            execution_options={'synchronize_session': False}
+        )
+        db.session.commit()
+    return jsonify({'revogado': True})
+
+
+# =================================================================
+# AÇÕES EM LOTE (API)
+# =================================================================
+
+MAX_ITENS_LOTE = 200
+
+
+def ler_ids_lote():
+    """Lê a lista de ids do corpo JSON ({"ids": [...]}) ou do formulário (ids=1&ids=2)"""
+    dados = request.get_json(silent=True)
+    if dados is not None:
+        brutos = dados.get('ids', []) if isinstance(dados, dict) else []
+    else:
+        brutos = request.form.getlist('ids')
+
+    ids = []
+    for valor in brutos:
+        try:
+            id_int = int(valor)
+        except (TypeError, ValueError):
+            continue
+        if id_int not in ids:
+            ids.append(id_int)
+    return ids[:MAX_ITENS_LOTE]
+
+
+def resposta_lote(resultados, **extras):
+    """Monta a resposta padrão das ações em lote com o resultado de cada item"""
+    processados = sum(1 for r in resultados if r['status'] == 'ok')
+    return jsonify({
+        'processados': processados,
+        'falhas': len(resultados) - processados,
+        'resultados': resultados,
+        **extras
+    })
+
+
+@bp.route('/api/tarefas/concluir', methods=['POST'])
+@login_required
+@casal_required
+def concluir_tarefas_lote():
+    """Conclui várias tarefas de uma vez e recria as recorrentes na mesma transação"""
+    usuario_id, casal_id = usuario_id_atual(), casal_id_atual()
+    ids = ler_ids_lote()
+
+    tarefas = {t.id: t for t in Tarefa.query.filter(
+        Tarefa.id.in_(ids),
+        Tarefa.casal_id == casal_id
+    ).all()} if ids else {}
+
+    resultados = []
+    pendentes = {}  # id -> posição em resultados
+    for id in ids:
+        tarefa = tarefas.get(id)
+        if not tarefa:
+            resultados.append({'id': id, 'status': 'nao_encontrada'})
+        elif tarefa.usuario_id != usuario_id:
+            resultados.append({'id': id, 'status': 'nao_e_sua'})
+        elif tarefa.concluida:
+            resultados.append({'id': id, 'status': 'ja_concluida'})
+        else:
+            pendentes[id] = len(resultados)
+            resultados.append({'id': id, 'status': 'ok', 'pontos': tarefa.pontos})
+
+    pontos_ganhos = 0
+    if pendentes:
+        agora = datetime.now()
+        # O UPDATE só pega tarefas ainda pendentes: num pedido repetido ou
+        # simultâneo com os mesmos ids, quem chegou depois não conta de novo
+        concluidas_ids = set(db.session.execute(
+            db.update(Tarefa)
+            .where(Tarefa.id.in_(pendentes), Tarefa.concluida == False)
+            .values(concluida=True, data_conclusao=agora)
+            .returning(Tarefa.id),
+            execution_options={'synchronize_session': False}
+        ).scalars())
+        concluidas = []
+        for id, posicao in pendentes.items():
+            if id in concluidas_ids:
+                concluidas.append(tarefas[id])
+            else:
+                resultados[posicao] = {'id': id, 'status': 'ja_concluida'}
+
+        novas_tarefas = [{
+            'titulo': tarefa.titulo,
+            'descricao': tarefa.descricao,
+            'pontos': tarefa.pontos,
+            'casal_id': tarefa.casal_id,
+            'usuario_id': tarefa.usuario_id,
+            'criado_por_id': tarefa.criado_por_id,
+            'recorrente': True,
+            'frequencia': tarefa.frequencia,
+            'prazo': proximo_prazo(tarefa.prazo, tarefa.frequencia)
+        } for tarefa in concluidas if tarefa.recorrente]
+
+        if concluidas:
+            pontos_ganhos = sum(tarefa.pontos or 0 for tarefa in concluidas)
+            registrar_conclusoes(concluidas, agora)
+            for tarefa in concluidas:
+                registrar_evento('tarefa_concluida', casal_id, usuario_id, tarefa.id,
+                                 titulo=tarefa.titulo, pontos=tarefa.pontos)
+            if novas_tarefas:
+                db.session.execute(db.insert(Tarefa), atribuir_ids_globais(novas_tarefas))
+        db.session.commit()
+
+    return resposta_lote(resultados, pontos_ganhos=pontos_ganhos)
+
+
+@bp.route('/api/tarefas/excluir', methods=['POST'])
+@login_required
+@casal_required
+def excluir_tarefas_lote():
+    """Exclui várias tarefas criadas pelo usuário com um único DELETE"""
+    usuario_id, casal_id = usuario_id_atual(), casal_id_atual()
+    ids = ler_ids_lote()
+
+    tarefas = {t.id: t for t in Tarefa.query.filter(
+        Tarefa.id.in_(ids),
+        Tarefa.casal_id == casal_id
+    ).all()} if ids else {}
+
+    resultados = []
+    excluir_ids = []
+    fotos = []
+    for id in ids:
+        tarefa = tarefas.get(id)
+        if not tarefa:
+            resultados.append({'id': id, 'status': 'nao_encontrada'})
+        elif tarefa.criado_por_id != usuario_id:
+            resultados.append({'id': id, 'status': 'sem_permissao'})
+        else:
+            excluir_ids.append(id)
+            if tarefa.foto:
+                fotos.append(tarefa.foto)
+            resultados.append({'id': id, 'status': 'ok'})
+
+    if excluir_ids:
+        db.session.execute(
+            db.delete(Tarefa).where(Tarefa.id.in_(excluir_ids)),
+            execution_options={'synchronize_session': False}
+        )
+        for id in excluir_ids:
+            registrar_evento('tarefa_excluida', casal_id, usuario_id, id, titulo=tarefas[id].titulo,
+                             pontos=tarefas[id].pontos, para=tarefas[id].usuario_id)
+        db.session.commit()
+
+    # Remover fotos só depois do commit
+    for foto in fotos:
+        try:
+            os.remove(os.path.join(current_app.config['UPLOAD_FOLDER'], foto))
+        except OSError:
+            pass
+
+    return resposta_lote(resultados)
+
+
+@bp.route('/api/recompensas/aprovar', methods=['POST'])
+@login_required
+@casal_required
+def aprovar_recompensas_lote():
+    """Aprova ou rejeita várias recompensas do parceiro de uma vez
+
+    Corpo JSON: {"itens": [{"id": 1, "acao": "aprovar", "custo": 50},
+                           {"id": 2, "acao": "rejeitar"}]}
+    """
+    usuario_id, casal_id = usuario_id_atual(), casal_id_atual()
+    dados = request.get_json(silent=True) or {}
+    itens = dados.get('itens', []) if isinstance(dados, dict) else []
+    itens = [i for i in itens if isinstance(i, dict)][:MAX_ITENS_LOTE]
+
+    ids = []
+    for item in itens:
+        try:
+            ids.append(int(item.get('id')))
+        except (TypeError, ValueError):
+            pass
+
+    recompensas = {r.id: r for r in Recompensa.query.filter(
+        Recompensa.id.in_(ids),
+        Recompensa.casal_id == casal_id,
+        Recompensa.ativa == True
+    ).all()} if ids else {}
+
+    agora = datetime.now()
+    resultados = []
+    atualizacoes = []
+    vistos = set()
+    for item in itens:
+        try:
+            id = int(item.get('id'))
+        except (TypeError, ValueError):
+            resultados.append({'id': item.get('id'), 'status': 'id_invalido'})
+            continue
+        recompensa = recompensas.get(id)
+        acao = item.get('acao')
+        if id in vistos:
+            resultados.append({'id': id, 'status': 'duplicada'})
+        elif not recompensa:
+            resultados.append({'id': id, 'status': 'nao_encontrada'})
+        elif recompensa.usuario_id == usuario_id:
+            resultados.append({'id': id, 'status': 'propria_recompensa'})
+        elif recompensa.status != 'pendente':
+            resultados.append({'id': id, 'status': 'ja_avaliada'})
+        elif acao == 'aprovar':
+            try:
+                custo = int(item.get('custo', recompensa.custo_sugerido))
+            except (TypeError, ValueError):
+                resultados.append({'id': id, 'status': 'custo_invalido'})
+                continue
+            if custo < 0:
+                resultados.append({'id': id, 'status': 'custo_invalido'})
+                continue
+            atualizacoes.append({
+                'id': id,
+                'custo': custo,
+                'status': 'aprovada',
+                'aprovado_por_id': usuario_id,
+                'data_aprovacao': agora
+            })
+            resultados.append({'id': id, 'status': 'ok', 'acao': 'aprovada', 'custo': custo})
+        elif acao == 'rejeitar':
+            atualizacoes.append({
+                'id': id,
+                'status': 'rejeitada',
+                'aprovado_por_id': usuario_id,
+                'data_aprovacao': agora
+            })
+            resultados.append({'id': id, 'status': 'ok', 'acao': 'rejeitada'})
+        else:
+            resultados.append({'id': id, 'status': 'acao_invalida'})
+        vistos.add(id)
+
+    if atualizacoes:
+        # Um UPDATE só, guardado por status = 'pendente': se o parceiro avaliou
+        # a mesma recompensa em outro pedido ao mesmo tempo, ela não volta no
+        # RETURNING e não é avaliada (nem registrada) de novo
+        ids_avaliar = [a['id'] for a in atualizacoes]
+        valores = {
+            'status': db.case({a['id']: a['status'] for a in atualizacoes}, value=Recompensa.id),
+            'aprovado_por_id': usuario_id,
+            'data_aprovacao': agora
+        }
+        custos = {a['id']: a['custo'] for a in atualizacoes if a['status'] == 'aprovada'}
+        if custos:
+            valores['custo'] = db.case(custos, value=Recompensa.id, else_=Recompensa.custo)
+        avaliadas_ids = set(db.session.execute(
+            db.update(Recompensa)
+            .where(Recompensa.id.in_(ids_avaliar), Recompensa.status == 'pendente')
+            .values(**valores)
+            .returning(Recompensa.id),
+            execution_options={'synchronize_session': False}
+        ).scalars())
+        for posicao, resultado in enumerate(resultados):
+            if resultado['status'] == 'ok' and resultado['id'] not in avaliadas_ids:
+                resultados[posicao] = {'id': resultado['id'], 'status': 'ja_avaliada'}
+        for a in atualizacoes:
+            if a['id'] not in avaliadas_ids:
+                continue
+            if a['status'] == 'aprovada':
+                registrar_evento('recompensa_aprovada', casal_id, usuario_id, a['id'],
+                                 titulo=recompensas[a['id']].titulo, custo=a['custo'],
+                                 custo_sugerido=recompensas[a['id']].custo_sugerido)
+            else:
+                registrar_evento('recompensa_rejeitada', casal_id, usuario_id, a['id'],
+                                 titulo=recompensas[a['id']].titulo)
+        db.session.commit()
+
+    return resposta_lote(resultados)
+
+
+@bp.route('/api/vales/usar', methods=['POST'])
+@login_required
+@casal_required
+def usar_vales_lote():
+    """Marca vários vales do usuário como utilizados"""
+    usuario_id, casal_id = usuario_id_atual(), casal_id_atual()
+    ids = ler_ids_lote()
+
+    vales = {v.id: v for v in Resgate.query.join(Recompensa).filter(
+        Resgate.id.in_(ids),
+        Recompensa.casal_id == casal_id
+    ).all()} if ids else {}
+
+    resultados = []
+    usar_ids = []
+    for id in ids:
+        vale = vales.get(id)
+        if not vale:
+            resultados.append({'id': id, 'status': 'nao_encontrado'})
+        elif vale.usuario_id != usuario_id:
+            resultados.append({'id': id, 'status': 'nao_e_seu'})
+        elif vale.utilizado:
+            resultados.append({'id': id, 'status': 'ja_utilizado'})
+        else:
+            usar_ids.append(id)
+            resultados.append({'id': id, 'status': 'ok'})
+
+    if usar_ids:
+        # Guardado por utilizado = False, como na conclusão em lote
+        usados_ids = set(db.session.execute(
+            db.update(Resgate)
+            .where(Resgate.id.in_(usar_ids), Resgate.utilizado == False)
+            .values(utilizado=True)
+            .returning(Resgate.id),
+            execution_options={'synchronize_session': False}
+        ).scalars())
+        for posicao, resultado in enumerate(resultados):
+            if resultado['status'] == 'ok' and resultado['id'] not in usados_ids:
+                resultados[posicao] = {'id': resultado['id'], 'status': 'ja_utilizado'}
+        for id in usar_ids:
+            if id in usados_ids:
+                registrar_evento('vale_usado', casal_id, usuario_id, id, recompensa_id=vales[id].recompensa_id)
+        db.session.commit()
+
+    return resposta_lote(resultados)
+
+
+# =================================================================
+# MODELOS DE TAREFA (SUGESTÕES)
+# =================================================================
+
+# O autocomplete do título da tarefa é servido de um índice em memória por
+# processo (app.extensions['sugestoes']): modelos padrão + tarefas que o
+# casal já criou MIN_USOS_MODELO vezes. O índice é carregado uma vez e
+# depois só lê os ModeloTarefa alterados desde a última marca, no máximo a
+# cada SUGESTOES_INTERVALO_S; as consultas por tecla não tocam o banco.
+
+MIN_USOS_MODELO = 2
+MAX_SUGESTOES = 8
+SUGESTOES_INTERVALO_S = 30
+
+MODELOS_PADRAO = [
+    {'titulo': 'Lavar a louça', 'pontos': 10, 'frequencia': 'diaria'},
+    {'titulo': 'Tirar o lixo', 'pontos': 5, 'frequencia': 'diaria'},
+    {'titulo': 'Arrumar a cama', 'pontos': 5, 'frequencia': 'diaria'},
+    {'titulo': 'Fazer o jantar', 'pontos': 15, 'frequencia': 'diaria'},
+    {'titulo': 'Passear com o cachorro', 'pontos': 10, 'frequencia': 'diaria'},
+    {'titulo': 'Regar as plantas', 'pontos': 5, 'frequencia': 'semanal'},
+    {'titulo': 'Lavar a roupa', 'pontos': 15, 'frequencia': 'semanal'},
+    {'titulo': 'Passar roupa', 'pontos': 15, 'frequencia': 'semanal'},
+    {'titulo': 'Limpar o banheiro', 'pontos': 20, 'frequencia': 'semanal'},
+    {'titulo': 'Aspirar a casa', 'pontos': 15, 'frequencia': 'semanal'},
+    {'titulo': 'Trocar a roupa de cama', 'pontos': 10, 'frequencia': 'semanal'},
+    {'titulo': 'Fazer as compras do mercado', 'pontos': 20, 'frequencia': 'semanal'},
+    {'titulo': 'Limpar a geladeira', 'pontos': 20, 'frequencia': 'mensal'},
+    {'titulo': 'Pagar as contas', 'pontos': 10, 'frequencia': 'mensal'},
+]
+
+
+def chave_modelo(titulo):
+    """Título normalizado: minúsculas, sem acentos e com espaços simples"""
+    return ' '.join(re.findall(r'[^\W_]+', normalizar_busca(titulo)))[:100]
+
+
+class IndiceSugestoes:
+    """Índice de prefixos em memória: busca binária sobre (início de palavra, chave)"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sincronizando = threading.Lock()  # uma sincronização por vez (ver indice_sugestoes)
+        self.modelos = {}  # casal_id (None = padrão) -> {chave: modelo}
+        self.entradas = {}  # casal_id -> lista ordenada de (texto a partir de cada palavra, chave)
+        self.marca = None
+        self.carregado = False
+        self.verificado_em = 0.0
+        self.atualizar([(None, {**modelo, 'descricao': '', 'usos': 0}) for modelo in MODELOS_PADRAO])
+
+    def atualizar(self, itens):
+        """Insere/atualiza [(casal_id, modelo)] e reordena só os casais afetados.
+
+        Quem busca não pega a trava: a lista de entradas de um casal é trocada
+        inteira (nunca alterada no lugar) e nenhuma chave sai de `modelos`,
+        então uma busca no meio da atualização vê a lista velha ou a nova.
+        """
+        with self.lock:
+            afetados = set()
+            for casal_id, modelo in itens:
+                chave = chave_modelo(modelo['titulo'])
+                if chave:
+                    self.modelos.setdefault(casal_id, {})[chave] = modelo
+                    afetados.add(casal_id)
+            for casal_id in afetados:
+                entradas = []
+                for chave in self.modelos[casal_id]:
+                    palavras = chave.split(' ')
+                    entradas.extend((' '.join(palavras[i:]), chave) for i in range(len(palavras)))
+                entradas.sort()
+                self.entradas[casal_id] = entradas
+
+    def _procurar(self, casal_id, prefixo, limite):
+        entradas = self.entradas.get(casal_id, [])
+        modelos = self.modelos.get(casal_id, {})
+        encontrados = {}
+        i = bisect.bisect_left(entradas, (prefixo,))
+        while i < len(entradas) and entradas[i][0].startswith(prefixo) and len(encontrados) < limite:
+            chave = entradas[i][1]
+            encontrados.setdefault(chave, modelos[chave])
+            i += 1
+        return encontrados
+
+    def sugerir(self, casal_id, texto, limite=MAX_SUGESTOES):
+        """Modelos do casal (mais usados primeiro) seguidos dos padrão que casam com o prefixo"""
+        prefixo = chave_modelo(texto)
+        if not prefixo:
+            return []
+        do_casal = self._procurar(casal_id, prefixo, limite * 4)
+        sugestoes = [dict(modelo, origem='casal') for modelo in
+                     sorted(do_casal.values(), key=lambda m: -m['usos'])[:limite]]
+        if len(sugestoes) < limite:
+            for chave, modelo in self._procurar(None, prefixo, limite).items():
+                if chave not in do_casal:
+                    sugestoes.append(dict(modelo, origem='padrao'))
+        return sugestoes[:limite]
+
+
+def sincronizar_sugestoes(indice):
+    """Carrega no índice os modelos frequentes alterados desde a última marca"""
+    consulta = db.select(
+        ModeloTarefa.casal_id, ModeloTarefa.titulo, ModeloTarefa.descricao, ModeloTarefa.pontos,
+        ModeloTarefa.frequencia, ModeloTarefa.usos, ModeloTarefa.atualizado_em
+    ).where(ModeloTarefa.usos >= MIN_USOS_MODELO)
+    if indice.marca:
+        # Folga para transações que gravaram um pouco depois do horário registrado
+        consulta = consulta.where(ModeloTarefa.atualizado_em > indice.marca - timedelta(seconds=5))
+    itens = []
+    marca = indice.marca
+    for engine in engines_shards():
+        for linha in db.session.execute(consulta.execution_options(yield_per=1000),
+                                        bind_arguments={'bind': engine}):
+            itens.append((linha.casal_id, {
+                'titulo': linha.titulo, 'descricao': linha.descricao or '', 'pontos': linha.pontos,
+                'frequencia': linha.frequencia, 'usos': linha.usos,
+            }))
+            if marca is None or linha.atualizado_em > marca:
+                marca = linha.atualizado_em
+    indice.atualizar(itens)
+    indice.marca = marca
+    indice.carregado = True
+
+
+def indice_sugestoes():
+    """Índice do app atual, sincronizado no máximo a cada SUGESTOES_INTERVALO_S.
+
+    Só uma thread sincroniza por vez; as outras respondem com o índice como
+    está em vez de esperar (só a primeira carga espera).
+    """
+    indice = current_app.extensions['sugestoes']
+    if indice.carregado and time.monotonic() - indice.verificado_em <= SUGESTOES_INTERVALO_S:
+        return indice
+    if indice.sincronizando.acquire(blocking=not indice.carregado):
+        try:
+            agora = time.monotonic()
+            if not indice.carregado or agora - indice.verificado_em > SUGESTOES_INTERVALO_S:
+                indice.verificado_em = agora
+                sincronizar_sugestoes(indice)
+        finally:
+            indice.sincronizando.release()
+    return indice
+
+
+def aprender_modelo(casal_id, titulo, descricao, pontos, frequencia):
+    """Conta mais um uso do título no casal (upsert; sem commit)"""
+    chave = chave_modelo(titulo)
+    if not chave:
+        return
+    stmt = sqlite_insert(ModeloTarefa).values(
+        casal_id=casal_id, chave=chave, titulo=titulo.strip()[:100], descricao=descricao,
+        pontos=pontos, frequencia=frequencia, usos=1, atualizado_em=datetime.now()
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[ModeloTarefa.casal_id, ModeloTarefa.chave],
+        set_={
+            'usos': ModeloTarefa.usos + 1,
+            'titulo': stmt.excluded.titulo,
+            'descricao': stmt.excluded.descricao,
+            'pontos': stmt.excluded.pontos,
+            'frequencia': stmt.excluded.frequencia,
+            'atualizado_em': stmt.excluded.atualizado_em,
+        }
+    )
+    db.session.execute(stmt)
+    # O próximo autocomplete deste processo já busca a mudança
+    current_app.extensions['sugestoes'].verificado_em = 0.0
+
+
+def aprender_modelos_do_historico():
+    """Recalcula ModeloTarefa a partir de todas as tarefas (backfill)"""
+    contagem = {}
+    for linha in db.session.execute(db.select(
+        Tarefa.casal_id, Tarefa.titulo, Tarefa.descricao, Tarefa.pontos, Tarefa.frequencia
+    ).order_by(Tarefa.id).execution_options(yield_per=1000)):
+        chave = chave_modelo(linha.titulo)
+        if not chave:
+            continue
+        modelo = contagem.setdefault((linha.casal_id, chave), {'usos': 0})
+        modelo.update(casal_id=linha.casal_id, chave=chave, titulo=linha.titulo.strip()[:100],
+                      descricao=linha.descricao, pontos=linha.pontos, frequencia=linha.frequencia,
+                      atualizado_em=datetime.now())
+        modelo['usos'] += 1
+    if contagem:
+        stmt = sqlite_insert(ModeloTarefa)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[ModeloTarefa.casal_id, ModeloTarefa.chave],
+            set_={coluna: getattr(stmt.excluded, coluna) for coluna in
+                  ('titulo', 'descricao', 'pontos', 'frequencia', 'usos', 'atualizado_em')}
+        )
+        db.session.execute(stmt, list(contagem.values()))
+    db.session.commit()
+    return len(contagem)
+
+
+@bp.route('/api/sugestoes')
+@login_required
+@casal_required
+def api_sugestoes():
+    """Autocomplete do título da tarefa (?q=lav), servido da memória"""
+    texto = request.args.get('q', '')[:100]
+    return jsonify({'q': texto, 'sugestoes': indice_sugestoes().sugerir(casal_id_atual(), texto)})
+
+
+@bp.cli.command('modelos-aprender')
+def comando_modelos_aprender():
+    """Recalcula os modelos de tarefa (sugestões) a partir do histórico."""
+    total = sum(em_todos_os_shards(aprender_modelos_do_historico))
+    click.echo(f'[OK] {total} modelos de tarefa recalculados')
+
+
+# =================================================================
+# PRAZOS E LEMBRETES
+# =================================================================
+
+# Tarefas podem ter prazo (Tarefa.prazo, indexado). O varredor
+# (`lembretes-varrer`) percorre só a faixa do índice entre
+# agora - JANELA_ATRASO e agora + LEMBRETE_ANTECEDENCIA, em lotes por
+# (prazo, id), e grava na caixa de saída Notificacao. A restrição única
+# (tarefa_id, tipo, prazo) + ON CONFLICT DO NOTHING torna as varreduras
+# idempotentes: rodar de novo (ou em dois processos) não duplica avisos.
+
+LEMBRETE_ANTECEDENCIA = timedelta(hours=3)
+JANELA_ATRASO = timedelta(days=2)  # cobre o varredor ficar parado por até 2 dias
+LOTE_LEMBRETES = 500
+LEMBRETES_INTERVALO_S = 60
+FREQUENCIA_DIAS = {'diaria': 1, 'semanal': 7, 'quinzenal': 15, 'mensal': 30}
+
+
+def ler_prazo(valor):
+    """Converte o campo datetime-local ('2024-05-01T18:30') em datetime; vazio = sem prazo"""
+    valor = (valor or '').strip()
+    return datetime.fromisoformat(valor) if valor else None
+
+
+def proximo_prazo(prazo, frequencia):
+    """Prazo da próxima ocorrência de uma tarefa recorrente (sempre no futuro)"""
+    if not prazo:
+        return None
+    intervalo = timedelta(days=FREQUENCIA_DIAS.get(frequencia, 1))
+    atrasos = max(0, (datetime.now() - prazo) // intervalo)
+    return prazo + intervalo * (atrasos + 1)
+
+
+def varrer_lembretes(agora=None):
+    """Gera lembretes (prazo próximo) e avisos de atraso; devolve quantos foram criados"""
+    agora = agora or datetime.now()
+    limite = agora + LEMBRETE_ANTECEDENCIA
+    cursor = (agora - JANELA_ATRASO, 0)
+    criadas = 0
+    while True:
+        linhas = db.session.execute(
+            db.select(Tarefa.id, Tarefa.casal_id, Tarefa.usuario_id, Tarefa.titulo, Tarefa.prazo)
+            .where(db.tuple_(Tarefa.prazo, Tarefa.id) > cursor, Tarefa.prazo <= limite,
+                   Tarefa.concluida == False, Tarefa.usuario_id.is_not(None),
+                   Tarefa.casal_id.not_in(casais_em_mudanca()))
+            .order_by(Tarefa.prazo, Tarefa.id)
+            .limit(LOTE_LEMBRETES)
+        ).all()
+        if not linhas:
+            break
+        notificacoes = []
+        for linha in linhas:
+            atrasada = linha.prazo <= agora
+            notificacoes.append({
+                'usuario_id': linha.usuario_id,
+                'casal_id': linha.casal_id,
+                'tarefa_id': linha.id,
+                'tipo': 'atrasada' if atrasada else 'lembrete',
+                'prazo': linha.prazo,
+                'mensagem': (f'"{linha.titulo}" está atrasada' if atrasada
+                             else f'"{linha.titulo}" vence às {linha.prazo:%H:%M}')[:200],
+                'criada_em': agora,
+            })
+        resultado = db.session.connection().execute(sqlite_insert(Notificacao).on_conflict_do_nothing(), notificacoes)
+        criadas += resultado.rowcount
+        # Um commit por lote: a trava de escrita do SQLite fica livre entre lotes
+        db.session.commit()
+        cursor = (linhas[-1].prazo, linhas[-1].id)
+    return criadas
+
+
+def notificacoes_nao_lidas(usuario_id, limite=20):
+    return Notificacao.query.filter_by(usuario_id=usuario_id, lida_em=None) \
+        .order_by(Notificacao.id.desc()).limit(limite).all()
+
+
+def marcar_notificacoes_lidas(usuario_id, ids=None):
+    """Marca como lidas as notificações do usuário (todas, ou só `ids`)"""
+    consulta = db.update(Notificacao).where(Notificacao.usuario_id == usuario_id, Notificacao.lida_em.is_(None))
+    if ids is not None:
+        consulta = consulta.where(Notificacao.id.in_(ids))
+    resultado = db.session.execute(consulta.values(lida_em=datetime.now()),
+                                   execution_options={'synchronize_session': False})
+    db.session.commit()
+    return resultado.rowcount
+
+
+@bp.route('/api/notificacoes')
+@login_required
+def api_notificacoes():
+    """Notificações não lidas do usuário (mais recentes primeiro)"""
+    return jsonify({'notificacoes': [{
+        'id': n.id, 'tipo': n.tipo, 'tarefa_id': n.tarefa_id, 'mensagem': n.mensagem,
+        'prazo': n.prazo.isoformat() if n.prazo else None, 'criada_em': n.criada_em.isoformat(),
+    } for n in notificacoes_nao_lidas(usuario_id_atual(), limite=100)]})
+
+
+@bp.route('/api/notificacoes/lidas', methods=['POST'])
+@login_required
+def api_notificacoes_lidas():
+    """Marca notificações como lidas: {"ids": [...]} ou corpo vazio para todas"""
+    dados = request.get_json(silent=True)
+    if dados is None:
+        dados = {}
+    elif not isinstance(dados, dict):
+        return jsonify({'erro': 'corpo_invalido'}), 400
+    ids = ler_ids_lote() if 'ids' in dados else None
+    return jsonify({'marcadas': marcar_notificacoes_lidas(usuario_id_atual(), ids)})
+
+
+@bp.route('/notificacoes/lidas', methods=['POST'])
+@login_required
+def notificacoes_lidas():
+    """Botão "marcar como lidas" do dashboard"""
+    marcar_notificacoes_lidas(usuario_id_atual())
+    return redirect(url_for('comercial.dashboard'))
+
+
+@bp.cli.command('lembretes-varrer')
+@click.option('--intervalo', type=int, default=0,
+              help=f'Repete a cada N segundos (ex.: {LEMBRETES_INTERVALO_S}); 0 = uma vez.')
+def comando_lembretes_varrer(intervalo):
+    """Gera lembretes de prazo e avisos de atraso na caixa de notificações."""
+    while True:
+        inicio = time.perf_counter()
+        criadas = sum(em_todos_os_shards(varrer_lembretes))
+        click.echo(f'[OK] {criadas} notificações criadas em {(time.perf_counter() - inicio) * 1000:.0f} ms')
+        if not intervalo:
+            break
+        time.sleep(intervalo)
+
+
+# =================================================================
+# AUDITORIA (LOG DE EVENTOS)
+# =================================================================
+
+# As rotas chamam registrar_evento() antes do commit; os eventos ficam na
+# sessão e são gravados no before_commit, na mesma transação da mutação,
+# com um upsert de SequenciaEvento por casal (reserva os seqs) e um único
+# INSERT executemany. Um rollback descarta os eventos junto. Evento é
+# append-only (trigger bloqueia UPDATE); só a compactação apaga linhas,
+# depois de copiá-las para LoteEventos.
+
+EVENTOS_COMPACTAR_DIAS = 90
+EVENTOS_RETENCAO_DIAS = 730
+LOTE_COMPACTACAO_EVENTOS = 5000
+MAX_EVENTOS_PAGINA = 500
+
+DDL_EVENTO = (
+    """CREATE TRIGGER IF NOT EXISTS evento_somente_insercao BEFORE UPDATE ON evento BEGIN
+        SELECT RAISE(ABORT, 'evento e append-only');
+    END""",
+)
+
+
+# SQL pronto: montar as construções do SQLAlchemy a cada commit custava
+# mais que a própria escrita
+SQL_RESERVAR_SEQ = (
+    'INSERT INTO sequencia_evento (casal_id, ultimo) VALUES (?, ?) '
+    'ON CONFLICT (casal_id) DO UPDATE SET ultimo = ultimo + excluded.ultimo RETURNING ultimo'
+)
+SQL_INSERIR_EVENTO = (
+    'INSERT INTO evento (casal_id, seq, usuario_id, tipo, alvo_id, dados, criado_em) '
+    'VALUES (?, ?, ?, ?, ?, ?, ?)'
+)
+
+
+@db.event.listens_for(db.metadata, 'after_create')
+def criar_trigger_evento(_metadata, conexao, **_kw):
+    if conexao.dialect.name == 'sqlite':
+        for ddl in DDL_EVENTO:
+            conexao.exec_driver_sql(ddl)
+
+
+def registrar_evento(tipo, casal_id, usuario_id, alvo=None, **dados):
+    """Agenda um evento para o próximo commit (`alvo` pode ser id ou objeto ainda sem id)"""
+    db.session.info.setdefault('eventos', []).append((casal_id, usuario_id, tipo, alvo, dados))
+
+
+@db.event.listens_for(db.session, 'before_commit')
+def gravar_eventos(sessao):
+    eventos = sessao.info.pop('eventos', None)
+    if not eventos:
+        return
+    sessao.flush()  # ids de objetos criados nesta transação
+    agora = datetime.now().isoformat(' ', 'microseconds')  # mesmo formato do DateTime do SQLAlchemy
+    por_casal = {}
+    for evento in eventos:
+        por_casal.setdefault(evento[0], []).append(evento)
+
+    conexao = sessao.connection()
+    linhas = []
+    for casal_id, lista in por_casal.items():
+        ultimo = conexao.exec_driver_sql(SQL_RESERVAR_SEQ, (casal_id, len(lista))).scalar_one()
+        for i, (_, usuario_id, tipo, alvo, dados) in enumerate(lista):
+            linhas.append((
+                casal_id, ultimo - len(lista) + 1 + i, usuario_id, tipo, getattr(alvo, 'id', alvo),
+                json.dumps(dados, default=str, separators=(',', ':')) if dados else None, agora,
+            ))
+    conexao.exec_driver_sql(SQL_INSERIR_EVENTO, linhas)
+
+
+@db.event.listens_for(db.session, 'after_soft_rollback')
+def descartar_eventos(sessao, _transacao):
+    sessao.info.pop('eventos', None)
+
+
+def evento_para_dict(seq, usuario_id, tipo, alvo_id, dados, criado_em):
+    return {
+        'seq': seq, 'usuario_id': usuario_id, 'tipo': tipo, 'alvo_id': alvo_id,
+        'dados': json.loads(dados) if dados else {},
+        'criado_em': criado_em.isoformat() if isinstance(criado_em, datetime) else criado_em,
+    }
+
+
+def eventos_do_casal(casal_id, desde=0, limite=100):
+    """Eventos com seq > desde, em ordem: primeiro os compactados, depois os recentes"""
+    eventos = []
+    for bloco in db.session.scalars(
+        db.select(LoteEventos.dados)
+        .where(LoteEventos.casal_id == casal_id, LoteEventos.seq_fim > desde)
+        .order_by(LoteEventos.seq_inicio)
+    ):
+        for linha in descompactar_payload(bloco):
+            if linha[0] > desde and len(eventos) < limite:
+                eventos.append(evento_para_dict(*linha))
+        if len(eventos) >= limite:
+            return eventos
+    if eventos:
+        desde = eventos[-1]['seq']
+    eventos.extend(evento_para_dict(*linha) for linha in db.session.execute(
+        db.select(Evento.seq, Evento.usuario_id, Evento.tipo, Evento.alvo_id, Evento.dados, Evento.criado_em)
+        .where(Evento.casal_id == casal_id, Evento.seq > desde)
+        .order_by(Evento.seq)
+        .limit(limite - len(eventos))
+    ))
+    return eventos
+
+
+def compactar_eventos(dias=EVENTOS_COMPACTAR_DIAS, retencao_dias=EVENTOS_RETENCAO_DIAS,
+                      lote=LOTE_COMPACTACAO_EVENTOS):
+    """Move eventos com mais de `dias` para LoteEventos e apaga blocos além da retenção"""
+    corte = datetime.now() - timedelta(days=dias)
+    compactados = 0
+    while True:
+        # id cresce com o tempo: os eventos antigos estão no começo da tabela
+        linhas = db.session.execute(
+            db.select(Evento.id, Evento.casal_id, Evento.seq, Evento.usuario_id, Evento.tipo,
+                      Evento.alvo_id, Evento.dados, Evento.criado_em)
+            .where(Evento.criado_em < corte, Evento.casal_id.not_in(casais_em_mudanca()))
+            .order_by(Evento.id)
+            .limit(lote)
+        ).all()
+        if not linhas:
+            break
+        por_casal = {}
+        for linha in linhas:
+            por_casal.setdefault(linha.casal_id, []).append(linha)
+        blocos = []
+        for casal_id, lista in por_casal.items():
+            lista.sort(key=lambda l: l.seq)
+            blocos.append({
+                'casal_id': casal_id,
+                'seq_inicio': lista[0].seq,
+                'seq_fim': lista[-1].seq,
+                'criado_ate': max(l.criado_em for l in lista),
+                'dados': compactar_payload([
+                    [l.seq, l.usuario_id, l.tipo, l.alvo_id, l.dados, l.criado_em] for l in lista
+                ]),
+            })
+        db.session.execute(db.insert(LoteEventos), blocos)
+        db.session.execute(
+            db.delete(Evento).where(Evento.id.in_([l.id for l in linhas])),
+            execution_options={'synchronize_session': False}
+        )
+        db.session.commit()
+        compactados += len(linhas)
+        if len(linhas) < lote:
+            break
+
+    removidos = db.session.execute(
+        db.delete(LoteEventos).where(LoteEventos.criado_ate < datetime.now() - timedelta(days=retencao_dias)),
+        execution_options={'synchronize_session': False}
+    ).rowcount
+    db.session.commit()
+    return compactados, removidos
+
+
+@bp.route('/api/eventos')
+@login_required
+@casal_required
+def api_eventos():
+    """Histórico de auditoria do casal: ?desde=<seq>&limite=100 (continua de `proximo`)"""
+    desde = request.args.get('desde', 0, type=int)
+    limite = min(max(request.args.get('limite', 100, type=int), 1), MAX_EVENTOS_PAGINA)
+    eventos = eventos_do_casal(casal_id_atual(), desde, limite)
+    return jsonify({'eventos': eventos, 'proximo': eventos[-1]['seq'] if eventos else desde})
+
+
+@bp.cli.command('eventos-compactar')
+@click.option('--dias', type=int, default=EVENTOS_COMPACTAR_DIAS, help='Compacta eventos mais antigos que isso.')
+@click.option('--retencao-dias', type=int, default=EVENTOS_RETENCAO_DIAS, help='Apaga blocos mais antigos que isso.')
+def comando_eventos_compactar(dias, retencao_dias):
+    """Compacta o log de auditoria antigo e aplica a retenção."""
+    compactados, removidos = map(sum, zip(*em_todos_os_shards(compactar_eventos, dias, retencao_dias)))
+    click.echo(f'[OK] {compactados} eventos compactados, {removidos} blocos removidos pela retenção')
+
+
+# =================================================================
+# ESTATÍSTICAS
+# =================================================================
+
+# Os gráficos leem só EstatisticaDiaria (uma linha por usuário/dia), nunca
+# o histórico de tarefas e resgates. As linhas são somadas na mesma
+# transação da conclusão/resgate; `estatisticas-recalcular` as refaz do zero.
+
+COLUNAS_ESTATISTICA = ('pontos_ganhos', 'pontos_gastos', 'tarefas', 'resgates')
+MAX_DIAS_ESTATISTICAS = 3 * 366
+
+
+def somar_estatisticas(linhas):
+    """Soma linhas {usuario_id, casal_id, dia, colunas...} em EstatisticaDiaria com um único upsert"""
+    if not linhas:
+        return
+    linhas = [{
+        'usuario_id': l['usuario_id'],
+        'casal_id': l['casal_id'],
+        'dia': l['dia'],
+        **{coluna: l.get(coluna, 0) for coluna in COLUNAS_ESTATISTICA}
+    } for l in linhas]
+    stmt = sqlite_insert(EstatisticaDiaria)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[EstatisticaDiaria.usuario_id, EstatisticaDiaria.dia],
+        set_={
+            coluna: getattr(EstatisticaDiaria, coluna) + getattr(stmt.excluded, coluna)
+            for coluna in COLUNAS_ESTATISTICA
+        }
+    )
+    db.session.execute(stmt, linhas)
+
+
+def avancar_sequencias(usuario_ids, dia):
+    """Conta `dia` na sequência de cada usuário (idempotente no mesmo dia)"""
+    if not usuario_ids:
+        return
+    stmt = sqlite_insert(Sequencia)
+    novo_atual = db.case(
+        (Sequencia.ultimo_dia >= dia, Sequencia.atual),
+        (Sequencia.ultimo_dia == dia - timedelta(days=1), Sequencia.atual + 1),
+        else_=1
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Sequencia.usuario_id],
+        set_={
+            'atual': novo_atual,
+            'recorde': db.func.max(Sequencia.recorde, novo_atual),
+            'ultimo_dia': db.func.max(Sequencia.ultimo_dia, stmt.excluded.ultimo_dia)
+        }
+    )
+    db.session.execute(stmt, [
+        {'usuario_id': usuario_id, 'atual': 1, 'recorde': 1, 'ultimo_dia': dia}
+        for usuario_id in usuario_ids
+    ])
+
+
+def registrar_conclusoes(tarefas, quando):
+    """Atualiza estatísticas e sequências das tarefas recém-concluídas (sem commit)"""
+    dia = quando.date()
+    linhas = {}
+    for tarefa in tarefas:
+        if not tarefa.usuario_id:
+            continue
+        linha = linhas.setdefault(tarefa.usuario_id, {
+            'usuario_id': tarefa.usuario_id, 'casal_id': tarefa.casal_id, 'dia': dia,
+            'pontos_ganhos': 0, 'tarefas': 0
+        })
+        linha['pontos_ganhos'] += tarefa.pontos or 0
+        linha['tarefas'] += 1
+    somar_estatisticas(list(linhas.values()))
+    avancar_sequencias(list(linhas), dia)
+
+
+def registrar_resgates(resgates, quando):
+    """Atualiza estatísticas a partir de (usuario_id, casal_id, custo) (sem commit)"""
+    linhas = {}
+    for usuario_id, casal_id, custo in resgates:
+        linha = linhas.setdefault(usuario_id, {
+            'usuario_id': usuario_id, 'casal_id': casal_id, 'dia': quando.date(),
+            'pontos_gastos': 0, 'resgates': 0
+        })
+        linha['pontos_gastos'] += custo or 0
+        linha['resgates'] += 1
+    somar_estatisticas(list(linhas.values()))
+
+
+def calcular_sequencia(dias):
+    """(atual, recorde, ultimo_dia) a partir dos dias com tarefa concluída"""
+    atual = recorde = 0
+    anterior = None
+    for dia in sorted(dias):
+        atual = atual + 1 if anterior and dia - anterior == timedelta(days=1) else 1
+        recorde = max(recorde, atual)
+        anterior = dia
+    return atual, recorde, anterior
+
+
+def recalcular_estatisticas():
+    """Refaz EstatisticaDiaria e Sequencia a partir de tarefas, resgates e do arquivo"""
+    dia_conclusao = db.func.date(Tarefa.data_conclusao)
+    dia_resgate = db.func.date(Resgate.data_resgate)
+    dia_arquivo = db.func.date(ItemArquivado.data)
+    consultas = [
+        ('pontos_ganhos', 'tarefas', db.select(
+            Tarefa.usuario_id, Tarefa.casal_id, dia_conclusao,
+            db.func.sum(Tarefa.pontos), db.func.count()
+        ).where(
+            Tarefa.concluida == True, Tarefa.data_conclusao.isnot(None), Tarefa.usuario_id.isnot(None)
+        ).group_by(Tarefa.usuario_id, Tarefa.casal_id, dia_conclusao)),
+        ('pontos_gastos', 'resgates', db.select(
+            Resgate.usuario_id, Recompensa.casal_id, dia_resgate,
+            db.func.sum(Resgate.custo), db.func.count()
+        ).join(Recompensa, Resgate.recompensa_id == Recompensa.id).where(
+            Resgate.usuario_id.isnot(None), Resgate.data_resgate.isnot(None)
+        ).group_by(Resgate.usuario_id, Recompensa.casal_id, dia_resgate)),
+    ]
+    for tipo, pontos, contagem in (('tarefa', 'pontos_ganhos', 'tarefas'), ('resgate', 'pontos_gastos', 'resgates')):
+        consultas.append((pontos, contagem, db.select(
+            ItemArquivado.usuario_id, ItemArquivado.casal_id, dia_arquivo,
+            db.func.sum(ItemArquivado.pontos), db.func.count()
+        ).where(
+            ItemArquivado.tipo == tipo, ItemArquivado.usuario_id.isnot(None), ItemArquivado.data.isnot(None)
+        ).group_by(ItemArquivado.usuario_id, ItemArquivado.casal_id, dia_arquivo)))
+
+    linhas = {}
+    for coluna_pontos, coluna_contagem, consulta in consultas:
+        for usuario_id, casal_id, dia, soma, quantidade in db.session.execute(consulta):
+            linha = linhas.setdefault((usuario_id, dia), {
+                'usuario_id': usuario_id, 'casal_id': casal_id, 'dia': date.fromisoformat(dia)
+            })
+            linha[coluna_pontos] = linha.get(coluna_pontos, 0) + (soma or 0)
+            linha[coluna_contagem] = linha.get(coluna_contagem, 0) + quantidade
+
+    dias_com_tarefa = {}
+    for linha in linhas.values():
+        if linha.get('tarefas'):
+            dias_com_tarefa.setdefault(linha['usuario_id'], []).append(linha['dia'])
+    sequencias = []
+    for usuario_id, dias in dias_com_tarefa.items():
+        atual, recorde, ultimo_dia = calcular_sequencia(dias)
+        sequencias.append({'usuario_id': usuario_id, 'atual': atual, 'recorde': recorde, 'ultimo_dia': ultimo_dia})
+
+    db.session.execute(db.delete(EstatisticaDiaria))
+    db.session.execute(db.delete(Sequencia))
+    somar_estatisticas(list(linhas.values()))
+    if sequencias:
+        db.session.execute(db.insert(Sequencia), sequencias)
+    db.session.commit()
+    return len(linhas), len(sequencias)
+
+
+def chave_periodo(dia, agrupar):
+    if agrupar == 'semana':
+        return (dia - timedelta(days=dia.weekday())).isoformat()  # segunda-feira
+    if agrupar == 'mes':
+        return dia.strftime('%Y-%m')
+    return dia.isoformat()
+
+
+def estatisticas_casal(casal_id, inicio, fim, agrupar='semana'):
+    """Séries por usuário do casal entre inicio e fim (inclusive), lidas dos rollups"""
+    usuarios = Usuario.query.filter_by(casal_id=casal_id).order_by(Usuario.id).all()
+    ids = [u.id for u in usuarios]
+    sequencias = {s.usuario_id: s for s in Sequencia.query.filter(Sequencia.usuario_id.in_(ids))} if ids else {}
+    linhas = EstatisticaDiaria.query.filter(
+        EstatisticaDiaria.casal_id == casal_id,
+        EstatisticaDiaria.dia >= inicio,
+        EstatisticaDiaria.dia <= fim
+    ).order_by(EstatisticaDiaria.dia).all()
+
+    series = {usuario_id: {} for usuario_id in ids}
+    for linha in linhas:
+        serie = series.setdefault(linha.usuario_id, {})
+        periodo = chave_periodo(linha.dia, agrupar)
+        ponto = serie.setdefault(periodo, {'periodo': periodo, **{c: 0 for c in COLUNAS_ESTATISTICA}})
+        for coluna in COLUNAS_ESTATISTICA:
+            ponto[coluna] += getattr(linha, coluna)
+
+    ontem = date.today() - timedelta(days=1)
+    resultado = []
+    for usuario in usuarios:
+        sequencia = sequencias.get(usuario.id)
+        # A sequência só continua valendo se a última conclusão foi hoje ou ontem
+        ativa = sequencia and sequencia.ultimo_dia and sequencia.ultimo_dia >= ontem
+        resultado.append({
+            'id': usuario.id,
+            'nome': usuario.nome,
+            'sequencia': {
+                'atual': sequencia.atual if ativa else 0,
+                'recorde': sequencia.recorde if sequencia else 0
+            },
+            'serie': list(series[usuario.id].values())
+        })
+    return resultado
+
+
+@bp.route('/api/estatisticas')
+@login_required
+@casal_required
+def api_estatisticas():
+    """Pontos, tarefas e resgates por período para gráficos
+
+    Parâmetros: inicio/fim (AAAA-MM-DD, padrão: últimas 12 semanas) e
+    agrupar (dia, semana, mes).
+    """
+    agrupar = request.args.get('agrupar', 'semana')
+    if agrupar not in ('dia', 'semana', 'mes'):
+        return jsonify({'erro': 'agrupar_invalido'}), 400
+    try:
+        fim = date.fromisoformat(request.args['fim']) if request.args.get('fim') else date.today()
+        inicio = (date.fromisoformat(request.args['inicio']) if request.args.get('inicio')
+                  else fim - timedelta(weeks=12) + timedelta(days=1))
+    except ValueError:
+        return jsonify({'erro': 'data_invalida'}), 400
+    if inicio > fim or (fim - inicio).days > MAX_DIAS_ESTATISTICAS:
+        return jsonify({'erro': 'periodo_invalido'}), 400
+
+    return jsonify({
+        'inicio': inicio.isoformat(),
+        'fim': fim.isoformat(),
+        'agrupar': agrupar,
+        'usuarios': estatisticas_casal(casal_id_atual(), inicio, fim, agrupar)
+    })
+
+
+@bp.cli.command('estatisticas-recalcular')
+def comando_estatisticas_recalcular():
+    """Recalcula as estatísticas diárias e sequências a partir do histórico (inclui o arquivo)."""
+    dias, sequencias = map(sum, zip(*em_todos_os_shards(recalcular_estatisticas)))
+    click.echo(f'[OK] {dias} linhas diárias e {sequencias} sequências recalculadas')
+
+
+# =================================================================
+# EXPORTAÇÃO DE DADOS
+# =================================================================
+
+# Tudo é gerado em streaming: as consultas usam yield_per (cursor lido aos
+# poucos) e cada linha vira bytes assim que é lida, então a memória não
+# cresce com o tamanho do histórico. Itens arquivados entram junto, com
+# arquivada=true.
+
+EXPORTACAO_YIELD_PER = 500
+EXPORTACAO_BLOCO = 64 * 1024
+EXPORTACAO_PASTA = os.environ.get('EXPORTACAO_PASTA', 'exportacoes')
+TIPOS_CONTEUDO = {'csv': 'text/csv; charset=utf-8', 'jsonl': 'application/x-ndjson'}
+
+COLUNAS_EXPORTACAO = {
+    'tarefas': ['id', 'titulo', 'descricao', 'pontos', 'usuario_id', 'criado_por_id', 'concluida',
+                'recorrente', 'frequencia', 'foto', 'data_criacao', 'data_conclusao', 'prazo', 'arquivada'],
+    'recompensas': ['id', 'titulo', 'descricao', 'custo', 'custo_sugerido', 'usuario_id', 'criado_por_id',
+                    'aprovado_por_id', 'status', 'foto', 'ativa', 'data_criacao', 'data_aprovacao'],
+    'resgates': ['id', 'recompensa_id', 'titulo', 'usuario_id', 'custo', 'data_resgate', 'utilizado',
+                 'arquivada'],
+}
+
+
+def consultar_em_fluxo(consulta):
+    """Executa a consulta lendo o cursor em blocos de EXPORTACAO_YIELD_PER linhas"""
+    return db.session.execute(consulta.execution_options(yield_per=EXPORTACAO_YIELD_PER))
+
+
+def linhas_exportacao(casal_id, tipo):
+    """Gera dicionários (colunas de COLUNAS_EXPORTACAO[tipo]) com os dados do casal"""
+    if tipo == 'tarefas':
+        colunas = [getattr(Tarefa, c) for c in COLUNAS_EXPORTACAO['tarefas'][:-1]]
+        for linha in consultar_em_fluxo(
+            db.select(*colunas).where(Tarefa.casal_id == casal_id).order_by(Tarefa.id)
+        ):
+            yield {**linha._asdict(), 'arquivada': False}
+        for item_id, usuario_id, pontos, data, dados in consultar_em_fluxo(
+            db.select(ItemArquivado.item_id, ItemArquivado.usuario_id, ItemArquivado.pontos,
+                      ItemArquivado.data, ItemArquivado.dados)
+            .where(ItemArquivado.casal_id == casal_id, ItemArquivado.tipo == 'tarefa')
+            .order_by(ItemArquivado.id)
+        ):
+            payload = descompactar_payload(dados)
+            yield {
+                'id': item_id, 'titulo': payload.get('titulo'), 'descricao': payload.get('descricao'),
+                'pontos': pontos, 'usuario_id': usuario_id, 'criado_por_id': payload.get('criado_por_id'),
+                'concluida': True, 'recorrente': payload.get('recorrente'),
+                'frequencia': payload.get('frequencia'), 'foto': payload.get('foto'),
+                'data_criacao': datetime.fromisoformat(payload['data_criacao']) if payload.get('data_criacao') else None,
+                'data_conclusao': data,
+                'prazo': datetime.fromisoformat(payload['prazo']) if payload.get('prazo') else None,
+                'arquivada': True,
+            }
+    elif tipo == 'recompensas':
+        colunas = [getattr(Recompensa, c) for c in COLUNAS_EXPORTACAO['recompensas']]
+        for linha in consultar_em_fluxo(
+            db.select(*colunas).where(Recompensa.casal_id == casal_id).order_by(Recompensa.id)
+        ):
+            yield linha._asdict()
+    elif tipo == 'resgates':
+        for linha in consultar_em_fluxo(
+            db.select(Resgate.id, Resgate.recompensa_id, Recompensa.titulo, Resgate.usuario_id,
+                      Resgate.custo, Resgate.data_resgate, Resgate.utilizado)
+            .join(Recompensa, Resgate.recompensa_id == Recompensa.id)
+            .where(Recompensa.casal_id == casal_id).order_by(Resgate.id)
+        ):
+            yield {**linha._asdict(), 'arquivada': False}
+        for item_id, usuario_id, pontos, data, dados in consultar_em_fluxo(
+            db.select(ItemArquivado.item_id, ItemArquivado.usuario_id, ItemArquivado.pontos,
+                      ItemArquivado.data, ItemArquivado.dados)
+            .where(ItemArquivado.casal_id == casal_id, ItemArquivado.tipo == 'resgate')
+            .order_by(ItemArquivado.id)
+        ):
+            payload = descompactar_payload(dados)
+            yield {
+                'id': item_id, 'recompensa_id': payload.get('recompensa_id'), 'titulo': payload.get('titulo'),
+                'usuario_id': usuario_id, 'custo': pontos, 'data_resgate': data, 'utilizado': True,
+                'arquivada': True,
+            }
+    else:
+        raise ValueError(f'Tipo de exportação desconhecido: {tipo}')
+
+
+def serializar_valor(valor):
+    if isinstance(valor, datetime):
+        return valor.isoformat()
+    return valor
+
+
+def gerar_exportacao(casal_id, tipo, formato):
+    """Gera os bytes de um arquivo CSV ou JSONL em blocos de ~64 KB"""
+    if formato not in TIPOS_CONTEUDO:
+        raise ValueError(f'Formato de exportação desconhecido: {formato}')
+    colunas = COLUNAS_EXPORTACAO[tipo]
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    if formato == 'csv':
+        escritor.writerow(colunas)
+    for linha in linhas_exportacao(casal_id, tipo):
+        if formato == 'csv':
+            escritor.writerow([serializar_valor(linha[c]) for c in colunas])
+        else:
+            buffer.write(json.dumps({c: serializar_valor(linha[c]) for c in colunas}, ensure_ascii=False))
+            buffer.write('\n')
+        if buffer.tell() >= EXPORTACAO_BLOCO:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode('utf-8')
+
+
+def fotos_do_casal(casal_id):
+    """Caminhos (relativos a UPLOAD_FOLDER) das fotos de tarefas, recompensas e usuários do casal"""
+    vistas = set()
+    consultas = [
+        db.select(Tarefa.foto).where(Tarefa.casal_id == casal_id, Tarefa.foto.isnot(None)),
+        db.select(Recompensa.foto).where(Recompensa.casal_id == casal_id, Recompensa.foto.isnot(None)),
+        db.select(Usuario.foto).where(Usuario.casal_id == casal_id, Usuario.foto.isnot(None)),
+    ]
+    for consulta in consultas:
+        for (foto,) in consultar_em_fluxo(consulta):
+            if foto not in vistas:
+                vistas.add(foto)
+                yield foto
+    for (dados,) in consultar_em_fluxo(
+        db.select(ItemArquivado.dados).where(ItemArquivado.casal_id == casal_id, ItemArquivado.tipo == 'tarefa')
+    ):
+        foto = descompactar_payload(dados).get('foto')
+        if foto and foto not in vistas:
+            vistas.add(foto)
+            yield foto
+
+
+class SaidaFluxo:
+    """Arquivo só de escrita que acumula bytes até serem drenados (para zipfile em streaming)"""
+
+    def __init__(self):
+        self.partes = []
+
+    def write(self, dados):
+        self.partes.append(bytes(dados))
+        return len(dados)
+
+    def flush(self):
+        pass
+
+    def drenar(self):
+        partes, self.partes = self.partes, []
+        return partes
+
+
+def gerar_zip(casal_id, formato='jsonl', uploads=True):
+    """Gera um ZIP (em streaming) com tarefas, recompensas, resgates e as fotos do casal"""
+    saida = SaidaFluxo()
+    with zipfile.ZipFile(saida, 'w') as arquivo_zip:
+        for tipo in COLUNAS_EXPORTACAO:
+            info = zipfile.ZipInfo(f'{tipo}.{formato}', date_time=datetime.now().timetuple()[:6])
+            info.compress_type = zipfile.ZIP_DEFLATED
+            with arquivo_zip.open(info, 'w') as destino:
+                for pedaco in gerar_exportacao(casal_id, tipo, formato):
+                    destino.write(pedaco)
+                    yield from saida.drenar()
+            yield from saida.drenar()
+
+        if uploads:
+            pasta_uploads = os.path.realpath(current_app.config['UPLOAD_FOLDER'])
+            for foto in fotos_do_casal(casal_id):
+                caminho = os.path.realpath(os.path.join(pasta_uploads, foto))
+                if not caminho.startswith(pasta_uploads + os.sep) or not os.path.isfile(caminho):
+                    continue
+                # Imagens já são comprimidas: ZIP_STORED (padrão do ZipInfo)
+                info = zipfile.ZipInfo.from_file(caminho, f'uploads/{foto}')
+                with open(caminho, 'rb') as origem, arquivo_zip.open(info, 'w') as destino:
+                    while pedaco := origem.read(64 * 1024):
+                        destino.write(pedaco)
+                        yield from saida.drenar()
+                yield from saida.drenar()
+    yield from saida.drenar()
+
+
+@bp.route('/exportar/<tipo>.<formato>')
+@limiter.limit("10 per hour")
+@login_required
+@casal_required
+def exportar(tipo, formato):
+    """Baixa tarefas, recompensas ou resgates do casal em CSV ou JSONL"""
+    if tipo not in COLUNAS_EXPORTACAO or formato not in TIPOS_CONTEUDO:
+        return jsonify({'erro': 'exportacao_invalida'}), 404
+    resposta = current_app.response_class(
+        stream_with_context(gerar_exportacao(casal_id_atual(), tipo, formato)),
+        content_type=TIPOS_CONTEUDO[formato]
+    )
+    resposta.headers['Content-Disposition'] = f'attachment; filename="{tipo}.{formato}"'
+    return resposta
+
+
+@bp.route('/exportar.zip')
+@limiter.limit("5 per hour")
+@login_required
+@casal_required
+def exportar_zip():
+    """Baixa todos os dados e fotos do casal num ZIP (?formato=jsonl|csv)"""
+    formato = request.args.get('formato', 'jsonl')
+    if formato not in TIPOS_CONTEUDO:
+        return jsonify({'erro': 'formato_invalido'}), 400
+    resposta = current_app.response_class(
+        stream_with_context(gerar_zip(casal_id_atual(), formato)),
+        mimetype='application/zip'
+    )
+    resposta.headers['Content-Disposition'] = f'attachment; filename="nosso-app-{date.today().isoformat()}.zip"'
+    return resposta
+
+
+_app_exportacao = None
+
+
+def iniciar_processo_exportacao(config):
+    """Initializer do pool: cada processo monta o próprio app (e conexões)"""
+    global _app_exportacao
+    _app_exportacao = create_app(config)
+
+
+def exportar_casal_para_arquivo(casal_id, pasta, formato, uploads):
+    """Grava o ZIP de um casal em `pasta` (roda num processo do pool)"""
+    destino = os.path.join(pasta, f'casal-{casal_id}.zip')
+    with _app_exportacao.app_context():
+        indice = shard_do_casal(casal_id)
+        if indice < 0:
+            raise RuntimeError(f'Casal {casal_id} está mudando de shard; exporte depois')
+        rotear_shard(indice)
+        with open(destino + '.parcial', 'wb') as arquivo:
+            for pedaco in gerar_zip(casal_id, formato, uploads):
+                arquivo.write(pedaco)
+    os.replace(destino + '.parcial', destino)
+    return casal_id, os.path.getsize(destino)
+
+
+@bp.cli.command('exportar')
+@click.option('--casal', 'casais', multiple=True, type=int, help='Casal a exportar (repetível). Padrão: todos.')
+@click.option('--pasta', default=EXPORTACAO_PASTA, show_default=True, help='Pasta de destino dos ZIPs.')
+@click.option('--formato', type=click.Choice(['jsonl', 'csv']), default='jsonl', show_default=True)
+@click.option('--processos', default=os.cpu_count() or 1, show_default=True, help='Casais exportados em paralelo.')
+@click.option('--sem-uploads', is_flag=True, help='Não incluir as fotos.')
+def comando_exportar(casais, pasta, formato, processos, sem_uploads):
+    """Exporta um ZIP por casal (dados + fotos), em paralelo."""
+    from concurrent.futures import ProcessPoolExecutor
+
+    casais = list(casais) or db.session.scalars(db.select(Casal.id).order_by(Casal.id)).all()
+    db.session.remove()
+    os.makedirs(pasta, exist_ok=True)
+    config = {
+        'SQLALCHEMY_DATABASE_URI': current_app.config['SQLALCHEMY_DATABASE_URI'],
+        'SHARDS': total_shards(),
+        'UPLOAD_FOLDER': os.path.abspath(current_app.config['UPLOAD_FOLDER']),
+        'SECURITY_LOG_PATH': current_app.config['SECURITY_LOG_PATH'],
+    }
+    inicio = time.perf_counter()
+    total = 0
+    with ProcessPoolExecutor(max_workers=max(1, processos), initializer=iniciar_processo_exportacao,
+                             initargs=(config,)) as pool:
+        tarefas = [pool.submit(exportar_casal_para_arquivo, casal_id, pasta, formato, not sem_uploads)
+                   for casal_id in casais]
+        for futuro in tarefas:
+            casal_id, tamanho = futuro.result()
+            total += tamanho
+    click.echo(f'[OK] {len(casais)} casais exportados em {time.perf_counter() - inicio:.1f}s '
+               f'({total / 1024 / 1024:.1f} MB em {pasta})')
+
+
+# =================================================================
+# BUSCA (SQLITE FTS5)
+# =================================================================
+
+# Índice `busca` com títulos e descrições de tarefas e recompensas. É
+# mantido por triggers no próprio SQLite, então também acompanha os
+# INSERT/UPDATE/DELETE em lote feitos sem o ORM. rowid = id*2 (tarefa),
+# id*2+1 (recompensa) ou -ItemArquivado.id (tarefa arquivada, com o id
+# original em `item_id`; o SQLite pode reaproveitar o id da tarefa). A coluna `casal` guarda o token "c<id>" e restringe
+# a busca ao casal dentro do próprio índice. unicode61 com
+# remove_diacritics faz "louca" achar "louça"; não há stemming (o FTS5 não
+# traz um para português), mas a busca por prefixo cobre plurais e
+# variações comuns ("lav" acha "lavar", "lavagem").
+#
+# Desempenho: o FTS5 só consulta prefixos rápido (com salto no doclist)
+# nos tamanhos do índice `prefix`; um prefixo maior faz merge de todos os
+# termos que o começam, e bm25() conta cada termo no índice inteiro. Por
+# isso a consulta usa no máximo PREFIXO_BUSCA letras de cada termo e o
+# filtro exato e o ranking são feitos em Python sobre os itens do casal.
+# Só entram no ranking os MAX_CANDIDATOS_BUSCA itens mais recentes que casam
+# com os prefixos; quando o corte acontece a resposta vem com `truncado`.
+
+MAX_TERMOS_BUSCA = 8
+MAX_RESULTADOS_BUSCA = 50
+MAX_CANDIDATOS_BUSCA = 2000
+PREFIXO_BUSCA = 4
+
+DDL_BUSCA = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS busca USING fts5(
+        casal, titulo, descricao, item_id UNINDEXED,
+        tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3 4'
+    )""",
+]
+for _tabela, _deslocamento in (('tarefa', 0), ('recompensa', 1)):
+    _rowid_novo = f'new.id * 2 + {_deslocamento}'
+    DDL_BUSCA += [
+        f"""CREATE TRIGGER IF NOT EXISTS busca_{_tabela}_ai AFTER INSERT ON {_tabela} BEGIN
+            INSERT INTO busca (rowid, casal, titulo, descricao)
+            VALUES ({_rowid_novo}, 'c' || new.casal_id, new.titulo, coalesce(new.descricao, ''));
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS busca_{_tabela}_au AFTER UPDATE OF titulo, descricao, casal_id ON {_tabela} BEGIN
+            UPDATE busca SET casal = 'c' || new.casal_id, titulo = new.titulo,
+                             descricao = coalesce(new.descricao, '')
+            WHERE rowid = {_rowid_novo};
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS busca_{_tabela}_ad AFTER DELETE ON {_tabela} BEGIN
+            DELETE FROM busca WHERE rowid = old.id * 2 + {_deslocamento};
+        END""",
+    ]
+
+
+def indexar_tarefas_arquivadas(conexao, linhas):
+    """Recoloca no índice tarefas arquivadas: [(arquivo_id, item_id, casal_id, titulo, descricao)]"""
+    if linhas:
+        conexao.exec_driver_sql(
+            "INSERT OR REPLACE INTO busca (rowid, item_id, casal, titulo, descricao) "
+            "VALUES (-?, ?, 'c' || ?, ?, coalesce(?, ''))",
+            [tuple(linha) for linha in linhas]
+        )
+
+
+def reconstruir_indice_busca(conexao):
+    """Refaz o índice a partir de tarefa, recompensa e das tarefas arquivadas"""
+    conexao.exec_driver_sql("DELETE FROM busca")
+    for tabela, deslocamento in (('tarefa', 0), ('recompensa', 1)):
+        conexao.exec_driver_sql(
+            f"INSERT INTO busca (rowid, casal, titulo, descricao) "
+            f"SELECT id * 2 + {deslocamento}, 'c' || casal_id, titulo, coalesce(descricao, '') FROM {tabela}"
+        )
+    lote = []
+    resultado = conexao.execution_options(yield_per=1000).execute(
+        db.select(ItemArquivado.id, ItemArquivado.item_id, ItemArquivado.casal_id, ItemArquivado.dados)
+        .where(ItemArquivado.tipo == 'tarefa')
+    )
+    for arquivo_id, item_id, casal_id, dados in resultado:
+        payload = descompactar_payload(dados)
+        lote.append((arquivo_id, item_id, casal_id, payload.get('titulo'), payload.get('descricao')))
+        if len(lote) >= 1000:
+            indexar_tarefas_arquivadas(conexao, lote)
+            lote = []
+    indexar_tarefas_arquivadas(conexao, lote)
+    conexao.exec_driver_sql("INSERT INTO busca (busca) VALUES ('optimize')")
+    return conexao.exec_driver_sql("SELECT count(*) FROM busca").scalar()
+
+
+@db.event.listens_for(db.metadata, 'after_create')
+def criar_indice_busca(_metadata, conexao, **_kw):
+    """Cria o índice FTS5 e as triggers junto com as tabelas (create_all)"""
+    if conexao.dialect.name != 'sqlite':
+        return
+    existia = conexao.exec_driver_sql(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'busca'"
+    ).first()
+    for ddl in DDL_BUSCA:
+        conexao.exec_driver_sql(ddl)
+    if not existia:
+        reconstruir_indice_busca(conexao)
+
+
+def normalizar_busca(texto):
+    """Minúsculas e sem acentos, como o tokenizer unicode61 do índice"""
+    decomposto = unicodedata.normalize('NFKD', (texto or '').lower())
+    return ''.join(c for c in decomposto if not unicodedata.combining(c))
+
+
+def termos_busca(texto):
+    return re.findall(r'[^\W_]+', normalizar_busca(texto))[:MAX_TERMOS_BUSCA]
+
+
+def consulta_fts(casal_id, termos):
+    """Consulta FTS5 do casal com cada termo cortado em PREFIXO_BUSCA letras"""
+    prefixos = ' '.join(f'"{termo[:PREFIXO_BUSCA]}"*' for termo in termos)
+    return f'casal : "c{casal_id}" AND {{titulo descricao}} : ({prefixos})'
+
+
+def pontuar_busca(termos, titulo, descricao):
+    """Relevância: termo no título vale 3, na descrição 1; None se algum termo não aparece"""
+    palavras_titulo = termos_busca(titulo) if titulo else []
+    palavras_descricao = re.findall(r'[^\W_]+', normalizar_busca(descricao))
+    pontos = 0
+    for termo in termos:
+        if any(p.startswith(termo) for p in palavras_titulo):
+            pontos += 3
+        elif any(p.startswith(termo) for p in palavras_descricao):
+            pontos += 1
+        else:
+            return None
+    return pontos
+
+
+def buscar(casal_id, texto, tipo=None, limite=20, offset=0):
+    """Busca no índice do casal, ordenada por relevância e depois pelos mais recentes.
+
+    Retorna (resultados, truncado); truncado indica que havia mais candidatos
+    que MAX_CANDIDATOS_BUSCA e os mais antigos ficaram de fora.
+    """
+    termos = termos_busca(texto)
+    if not termos:
+        return [], False
+    filtro_tipo = {'tarefa': 'AND (rowid < 0 OR rowid % 2 = 0)', 'recompensa': 'AND rowid % 2 = 1'}.get(tipo, '')
+    candidatos = db.session.execute(db.text(f"""
+        SELECT rowid, item_id, titulo, descricao FROM busca
+        WHERE busca MATCH :consulta {filtro_tipo}
+        ORDER BY rowid DESC
+        LIMIT :maximo
+    """), {'consulta': consulta_fts(casal_id, termos), 'maximo': MAX_CANDIDATOS_BUSCA + 1}).all()
+    truncado = len(candidatos) > MAX_CANDIDATOS_BUSCA
+    candidatos = candidatos[:MAX_CANDIDATOS_BUSCA]
+
+    pontuados = []
+    for linha in candidatos:
+        pontos = pontuar_busca(termos, linha.titulo, linha.descricao)
+        if pontos is not None:
+            pontuados.append((pontos, linha))
+    pontuados.sort(key=lambda item: -item[0])  # estável: mantém os mais recentes primeiro
+    resultados = [{
+        'tipo': 'recompensa' if linha.rowid > 0 and linha.rowid % 2 else 'tarefa',
+        'id': linha.item_id if linha.rowid < 0 else linha.rowid // 2,
+        'titulo': linha.titulo,
+        'descricao': linha.descricao,
+        'arquivada': linha.rowid < 0,
+        'relevancia': pontos,
+    } for pontos, linha in pontuados[offset:offset + limite]]
+    return resultados, truncado
+
+
+@bp.route('/api/busca')
+@login_required
+@casal_required
+def api_busca():
+    """Busca tarefas e recompensas do casal (?q=texto&tipo=tarefa|recompensa&pagina=1)"""
+    texto = request.args.get('q', '')[:200]
+    tipo = request.args.get('tipo')
+    if tipo not in (None, 'tarefa', 'recompensa'):
+        return jsonify({'erro': 'tipo_invalido'}), 400
+    try:
+        limite = min(max(int(request.args.get('limite', 20)), 1), MAX_RESULTADOS_BUSCA)
+        pagina = max(int(request.args.get('pagina', 1)), 1)
+    except ValueError:
+        return jsonify({'erro': 'paginacao_invalida'}), 400
+    resultados, truncado = buscar(casal_id_atual(), texto, tipo, limite, (pagina - 1) * limite)
+    return jsonify({'q': texto, 'pagina': pagina, 'resultados': resultados, 'truncado': truncado})
+
+
+@bp.cli.command('busca-reconstruir')
+def comando_busca_reconstruir():
+    """Recria o índice de busca (FTS5) a partir das tabelas."""
+    inicio = time.perf_counter()
+    total = 0
+    for engine in engines_shards():
+        with engine.begin() as conexao:
+            for ddl in DDL_BUSCA:
+                conexao.exec_driver_sql(ddl)
+            total += reconstruir_indice_busca(conexao)
+    click.echo(f'[OK] {total} itens indexados em {time.perf_counter() - inicio:.1f}s')
+
+
+# =================================================================
+# ARQUIVAMENTO E COMPACTAÇÃO
+# =================================================================
+
+def compactar_payload(dados):
+    """Serializa um dicionário em JSON compactado com zlib"""
+    return zlib.compress(json.dumps(dados, default=str, separators=(',', ':')).encode('utf-8'))
+
+
+def descompactar_payload(blob):
+    """Inverso de compactar_payload"""
+    return json.loads(zlib.decompress(blob).decode('utf-8')) if blob else {}
+
+
+def somar_totais_arquivados(totais):
+    """Soma {usuario_id: {coluna: valor}} em TotalArquivado com um único upsert"""
+    if not totais:
+        return
+    linhas = [{
+        'usuario_id': usuario_id,
+        'pontos_ganhos': t.get('pontos_ganhos', 0),
+        'pontos_gastos': t.get('pontos_gastos', 0),
+        'tarefas': t.get('tarefas', 0),
+        'resgates': t.get('resgates', 0)
+    } for usuario_id, t in totais.items()]
+    stmt = sqlite_insert(TotalArquivado)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[TotalArquivado.usuario_id],
+        set_={
+            coluna: getattr(TotalArquivado, coluna) + getattr(stmt.excluded, coluna)
+            for coluna in ('pontos_ganhos', 'pontos_gastos', 'tarefas', 'resgates')
+        }
+    )
+    db.session.execute(stmt, linhas)
+
+
+def arquivar_tarefas_lote(limite_data, lote):
+    """Arquiva um lote de tarefas concluídas antes de limite_data. Retorna quantas foram movidas"""
+    tarefas = Tarefa.query.filter(
+        Tarefa.concluida == True,
+        Tarefa.data_conclusao < limite_data,
+        Tarefa.casal_id.not_in(casais_em_mudanca())
+    ).order_by(Tarefa.id).limit(lote).all()
+    if not tarefas:
+        return 0
+
+    arquivados = []
+    totais = {}
+    for tarefa in tarefas:
+        arquivados.append({
+            'tipo': 'tarefa',
+            'item_id': tarefa.id,
+            'casal_id': tarefa.casal_id,
+            'usuario_id': tarefa.usuario_id,
+            'pontos': tarefa.pontos or 0,
+            'data': tarefa.data_conclusao,
+            'dados': compactar_payload({
+                'titulo': tarefa.titulo,
+                'descricao': tarefa.descricao,
+                'criado_por_id': tarefa.criado_por_id,
+                'foto': tarefa.foto,
+                'recorrente': tarefa.recorrente,
+                'frequencia': tarefa.frequencia,
+                'data_criacao': tarefa.data_criacao,
+                'prazo': tarefa.prazo
+            })
+        })
+        if tarefa.usuario_id:
+            t = totais.setdefault(tarefa.usuario_id, {'pontos_ganhos': 0, 'tarefas': 0})
+            t['pontos_ganhos'] += tarefa.pontos or 0
+            t['tarefas'] += 1
+
+    arquivo_ids = db.session.scalars(
+        db.insert(ItemArquivado).returning(ItemArquivado.id, sort_by_parameter_order=True),
+        arquivados
+    ).all()
+    somar_totais_arquivados(totais)
+    db.session.execute(
+        db.delete(Tarefa).where(Tarefa.id.in_([t.id for t in tarefas])),
+        execution_options={'synchronize_session': False}
+    )
+    # A trigger tirou as tarefas do índice de busca; elas voltam como arquivadas
+    indexar_tarefas_arquivadas(db.session.connection(), [
+        (arquivo_id, t.id, t.casal_id, t.titulo, t.descricao) for arquivo_id, t in zip(arquivo_ids, tarefas)
+    ])
+    db.session.commit()
+    return len(tarefas)
+
+
+def arquivar_resgates_lote(limite_data, lote):
+    """Arquiva um lote de vales já utilizados resgatados antes de limite_data"""
+    resgates = db.session.query(Resgate, Recompensa).join(Recompensa).filter(
+        Resgate.utilizado == True,
+        Resgate.data_resgate < limite_data,
+        Recompensa.casal_id.not_in(casais_em_mudanca())
+    ).order_by(Resgate.id).limit(lote).all()
+    if not resgates:
+        return 0
+
+    arquivados = []
+    totais = {}
+    for resgate, recompensa in resgates:
+        arquivados.append({
+            'tipo': 'resgate',
+            'item_id': resgate.id,
+            'casal_id': recompensa.casal_id,
+            'usuario_id': resgate.usuario_id,
+            'pontos': resgate.custo or 0,
+            'data': resgate.data_resgate,
+            'dados': compactar_payload({
+                'recompensa_id': recompensa.id,
+                'titulo': recompensa.titulo
+            })
+        })
+        if resgate.usuario_id:
+            t = totais.setdefault(resgate.usuario_id, {'pontos_gastos': 0, 'resgates': 0})
+            t['pontos_gastos'] += resgate.custo or 0
+            t['resgates'] += 1
+
+    db.session.execute(db.insert(ItemArquivado), arquivados)
+    somar_totais_arquivados(totais)
+    db.session.execute(
+        db.delete(Resgate).where(Resgate.id.in_([r.id for r, _ in resgates])),
+        execution_options={'synchronize_session': False}
+    )
+    db.session.commit()
+    return len(resgates)
+
+
+def arquivar_historico(dias=90, lote=500, max_lotes=None):
+    """Move tarefas concluídas e vales utilizados mais antigos que `dias` para o arquivo.
+
+    Roda em lotes (uma transação por lote) para não segurar o lock de escrita.
+    """
+    limite_data = datetime.now() - timedelta(days=dias)
+    movidos = {'tarefas': 0, 'resgates': 0}
+    for chave, funcao in (('tarefas', arquivar_tarefas_lote), ('resgates', arquivar_resgates_lote)):
+        lotes = 0
+        while max_lotes is None or lotes < max_lotes:
+            n = funcao(limite_data, lote)
+            movidos[chave] += n
+            lotes += 1
+            if n < lote:
+                break
+    return movidos
+
+
+def compactar_banco(paginas=None, engine=None):
+    """Recupera espaço livre do arquivo SQLite.
+
+    Com auto_vacuum=INCREMENTAL roda incremental_vacuum (rápido, em passos);
+    na primeira execução converte o banco com um VACUUM completo.
+    """
+    db.session.close()  # VACUUM precisa que nenhuma transação fique aberta
+    with (engine or db.engine).connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        modo = conn.exec_driver_sql('PRAGMA auto_vacuum').scalar()
+        if modo != 2:
+            conn.exec_driver_sql('PRAGMA auto_vacuum = INCREMENTAL')
+            conn.exec_driver_sql('VACUUM')
+            return 'vacuum'
+        livres = conn.exec_driver_sql('PRAGMA freelist_count').scalar()
+        passos = livres if paginas is None else min(paginas, livres)
+        if passos:
+            conn.exec_driver_sql(f'PRAGMA incremental_vacuum({int(passos)})')
+        return f'incremental_vacuum({passos})'
+
+
+@bp.cli.command('arquivar')
+@click.option('--dias', default=90, show_default=True, help='Idade mínima (em dias) dos itens arquivados.')
+@click.option('--lote', default=500, show_default=True, help='Itens movidos por transação.')
+@click.option('--max-lotes', default=None, type=int, help='Limite de lotes por execução (incremental).')
+@click.option('--compactar/--sem-compactar', default=True, help='Recuperar espaço do arquivo SQLite no final.')
+def comando_arquivar(dias, lote, max_lotes, compactar):
+    """Arquiva histórico antigo e compacta o banco (agendar via cron)."""
+    por_shard = em_todos_os_shards(arquivar_historico, dias=dias, lote=lote, max_lotes=max_lotes)
+    click.echo(f"[OK] Arquivados: {sum(m['tarefas'] for m in por_shard)} tarefas, "
+               f"{sum(m['resgates'] for m in por_shard)} vales")
+    if compactar:
+        for engine in engines_shards():
+            click.echo(f"[OK] Compactação ({os.path.basename(engine.url.database)}): {compactar_banco(engine=engine)}")
+
+
+# =================================================================
+# BACKUP E RESTAURAÇÃO
+# =================================================================
+
+BACKUP_DIR = os.environ.get('BACKUP_DIR', 'backups')
+BACKUP_PREFIXO = 'casal_comercial-'
+
+
+def caminho_banco():
+    """Caminho do arquivo SQLite em uso pelo app"""
+    return db.engine.url.database
+
+
+def copiar_banco_online(origem, destino, paginas=256, pausa=0.05):
+    """Copia o banco com a API de backup online do SQLite.
+
+    Copia `paginas` por passo e dorme `pausa` segundos entre os passos.
+    A origem fica numa transação de leitura durante a cópia: com WAL isso
+    fixa um snapshot consistente (a cópia não recomeça a cada escrita) sem
+    impedir que os escritores continuem gravando.
+    """
+    fonte = sqlite3.connect(origem, timeout=30, isolation_level=None)
+    alvo = sqlite3.connect(destino)
+
+    def throttle(status, restantes, total):
+        if pausa and restantes:
+            time.sleep(pausa)
+
+    try:
+        fonte.execute('BEGIN')
+        fonte.execute('SELECT count(*) FROM sqlite_master').fetchone()
+        fonte.backup(alvo, pages=paginas, progress=throttle)
+        fonte.execute('COMMIT')
+    finally:
+        alvo.close()
+        fonte.close()
+
+
+def verificar_banco(caminho, obrigatorias=('casal', 'usuario', 'tarefa', 'recompensa', 'resgate')):
+    """Roda integrity_check e confere se as tabelas do app existem"""
+    conn = sqlite3.connect(f'file:{caminho}?mode=ro', uri=True)
+    try:
+        resultado = conn.execute('PRAGMA integrity_check').fetchone()[0]
+        if resultado != 'ok':
+            return False, resultado
+        tabelas = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    except sqlite3.DatabaseError as e:
+        return False, str(e)
+    finally:
+        conn.close()
+    faltando = set(obrigatorias) - tabelas
+    if faltando:
+        return False, f"tabelas ausentes: {', '.join(sorted(faltando))}"
+    return True, 'ok'
+
+
+def sincronizar_uploads(origem, destino):
+    """Copia para `destino` apenas os arquivos novos ou alterados de `origem`"""
+    copiados = 0
+    for raiz, _, arquivos in os.walk(origem):
+        for nome in arquivos:
+            caminho_origem = os.path.join(raiz, nome)
+            caminho_destino = os.path.join(destino, os.path.relpath(caminho_origem, origem))
+            estado = os.stat(caminho_origem)
+            if os.path.exists(caminho_destino):
+                atual = os.stat(caminho_destino)
+                if atual.st_size == estado.st_size and atual.st_mtime >= estado.st_mtime:
+                    continue
+            os.makedirs(os.path.dirname(caminho_destino), exist_ok=True)
+            shutil.copy2(caminho_origem, caminho_destino)
+            copiados += 1
+    return copiados
+
+
+def listar_backups(pasta=BACKUP_DIR):
+    """Snapshots existentes, do mais antigo para o mais novo"""
+    if not os.path.isdir(pasta):
+        return []
+    return sorted(
+        os.path.join(pasta, nome) for nome in os.listdir(pasta)
+        if nome.startswith(BACKUP_PREFIXO) and nome.endswith('.db.gz') and '.shard' not in nome
+    )
+
+
+def arquivo_shard(arquivo, indice):
+    """Snapshot do shard `indice` que acompanha `arquivo` (o do banco principal)"""
+    return f"{arquivo[:-len('.db.gz')]}.shard{indice}.db.gz"
+
+
+def shards_do_backup(arquivo):
+    """Snapshots de shards gravados junto com `arquivo`"""
+    return sorted(glob.glob(glob.escape(arquivo[:-len('.db.gz')]) + '.shard*.db.gz'))
+
+
+def criar_backup(pasta=BACKUP_DIR, manter=48, paginas=256, pausa=0.05, uploads=True):
+    """Gera um snapshot compactado e verificado do banco e sincroniza os uploads"""
+    os.makedirs(pasta, exist_ok=True)
+    nome = f"{BACKUP_PREFIXO}{datetime.now().strftime('%Y%m%d-%H%M%S')}.db.gz"
+    destino = os.path.join(pasta, nome)
+
+    # Com shards, um arquivo por banco; o principal por último, então um
+    # snapshot listado sempre tem os shards completos
+    with tempfile.TemporaryDirectory(dir=pasta) as tmp:
+        for indice, engine in reversed(list(enumerate(engines_shards()))):
+            snapshot = os.path.join(tmp, f'snapshot{indice}.db')
+            copiar_banco_online(engine.url.database, snapshot, paginas=paginas, pausa=pausa)
+            ok, detalhe = verificar_banco(snapshot, *([TABELAS_ID_GLOBAL] if indice else []))
+            if not ok:
+                raise RuntimeError(f'Snapshot inválido: {detalhe}')
+            alvo = arquivo_shard(destino, indice) if indice else destino
+            with open(snapshot, 'rb') as entrada, gzip.open(alvo + '.parcial', 'wb', compresslevel=6) as saida:
+                shutil.copyfileobj(entrada, saida, 1024 * 1024)
+            os.replace(alvo + '.parcial', alvo)
+            os.remove(snapshot)
+
+    copiados = 0
+    if uploads:
+        copiados = sincronizar_uploads(current_app.config['UPLOAD_FOLDER'], os.path.join(pasta, 'uploads'))
+
+    # Rotação: mantém só os `manter` snapshots mais recentes
+    removidos = 0
+    for antigo in listar_backups(pasta)[:-manter] if manter else []:
+        for shard in shards_do_backup(antigo):
+            os.remove(shard)
+        os.remove(antigo)
+        removidos += 1
+
+    return {'arquivo': destino, 'uploads_copiados': copiados, 'removidos': removidos}
+
+
+def descompactar_backup(arquivo, destino):
+    """Descompacta um snapshot .db.gz para `destino`"""
+    with gzip.open(arquivo, 'rb') as entrada, open(destino, 'wb') as saida:
+        shutil.copyfileobj(entrada, saida, 1024 * 1024)
+
+
+def verificar_backup(arquivo):
+    """Descompacta o snapshot numa pasta temporária e verifica sua integridade"""
+    with tempfile.TemporaryDirectory() as tmp:
+        caminho = os.path.join(tmp, 'verificar.db')
+        try:
+            descompactar_backup(arquivo, caminho)
+        except (OSError, EOFError) as e:
+            return False, f'arquivo corrompido: {e}'
+        ok, detalhe = verificar_banco(caminho)
+        for shard in shards_do_backup(arquivo):
+            if not ok:
+                break
+            try:
+                descompactar_backup(shard, caminho)
+            except (OSError, EOFError) as e:
+                return False, f'{os.path.basename(shard)} corrompido: {e}'
+            ok, detalhe = verificar_banco(caminho, TABELAS_ID_GLOBAL)
+        return ok, detalhe
+
+
+def restaurar_backup(arquivo, pasta=BACKUP_DIR, uploads=True):
+    """Restaura um snapshot sobre o banco atual (pare os workers antes)"""
+    engines = engines_shards()
+    with tempfile.TemporaryDirectory() as tmp:
+        caminhos = []
+        for indice, engine in enumerate(engines):
+            origem = arquivo_shard(arquivo, indice) if indice else arquivo
+            if not os.path.exists(origem):
+                raise RuntimeError(f'Backup sem o shard {indice}: {origem}')
+            caminho = os.path.join(tmp, f'restaurar{indice}.db')
+            descompactar_backup(origem, caminho)
+            ok, detalhe = verificar_banco(caminho, *([TABELAS_ID_GLOBAL] if indice else []))
+            if not ok:
+                raise RuntimeError(f'Backup inválido: {detalhe}')
+            caminhos.append(caminho)
+        db.session.remove()
+        for engine, caminho in zip(engines, caminhos):
+            engine.dispose()
+            copiar_banco_online(caminho, engine.url.database, paginas=-1, pausa=0)
+
+    if uploads and os.path.isdir(os.path.join(pasta, 'uploads')):
+        sincronizar_uploads(os.path.join(pasta, 'uploads'), current_app.config['UPLOAD_FOLDER'])
+
+
+@bp.cli.command('backup')
+@click.option('--pasta', default=BACKUP_DIR, show_default=True, help='Pasta de destino dos snapshots.')
+@click.option('--manter', default=48, show_default=True, help='Quantos snapshots manter (0 = todos).')
+@click.option('--paginas', default=256, show_default=True, help='Páginas copiadas por passo.')
+@click.option('--pausa', default=0.05, show_default=True, help='Pausa entre passos, em segundos.')
+@click.option('--sem-uploads', is_flag=True, help='Não sincronizar a pasta de uploads.')
+def comando_backup(pasta, manter, paginas, pausa, sem_uploads):
+    """Gera um snapshot online do banco (seguro com o app rodando)."""
+    try:
+        resultado = criar_backup(pasta=pasta, manter=manter, paginas=paginas, pausa=pausa,
+                                 uploads=not sem_uploads)
+    except (RuntimeError, OSError, sqlite3.Error) as e:
+        raise click.ClickException(f'Backup falhou: {e}')
+    click.echo(f"[OK] Backup: {resultado['arquivo']} "
+               f"({resultado['uploads_copiados']} uploads copiados, {resultado['removidos']} antigos removidos)")
+
+
+@bp.cli.command('backup-verificar')
+@click.argument('arquivo', required=False)
+@click.option('--pasta', default=BACKUP_DIR, show_default=True)
+def comando_backup_verificar(arquivo, pasta):
+    """Verifica um snapshot (padrão: o mais recente)."""
+    arquivo = arquivo or (listar_backups(pasta) or [None])[-1]
+    if not arquivo:
+        raise click.ClickException('Nenhum backup encontrado.')
+    ok, detalhe = verificar_backup(arquivo)
+    if not ok:
+        raise click.ClickException(f'{arquivo}: {detalhe}')
+    click.echo(f'[OK] {arquivo}: íntegro')
+
+
+@bp.cli.command('backup-restaurar')
+@click.argument('arquivo')
+@click.option('--pasta', default=BACKUP_DIR, show_default=True, help='Pasta com a cópia dos uploads.')
+@click.confirmation_option(prompt='Isso substitui o banco atual. Continuar?')
+def comando_backup_restaurar(arquivo, pasta):
+    """Restaura um snapshot sobre o banco atual."""
+    try:
+        restaurar_backup(arquivo, pasta=pasta)
+    except (RuntimeError, OSError, EOFError, sqlite3.Error) as e:
+        raise click.ClickException(f'Restauração falhou: {e}')
+    click.echo(f'[OK] Banco restaurado de {arquivo}')
+
+
+# =================================================================
+# ANALYTICS (BANCO SEPARADO)
+# =================================================================
+
+# As métricas do painel de operação são lidas de um SQLite separado
+# (ANALYTICS_DATABASE_PATH), alimentado por `flask analytics-sincronizar`
+# via cron. A sincronização lê o banco principal em lotes curtos, pela
+# marca d'água (data, id) de cada fonte, e nunca segura transação longa;
+# o endpoint /admin/analytics só abre o arquivo de analytics.
+
+ANALYTICS_LOTE = 2000
+ANALYTICS_ATRASO_S = 60
+
+ESQUEMA_ANALYTICS = """
+CREATE TABLE IF NOT EXISTS marca (fonte TEXT PRIMARY KEY, data TEXT, id INTEGER);
+CREATE TABLE IF NOT EXISTS casal (casal_id INTEGER PRIMARY KEY, criado TEXT);
+CREATE TABLE IF NOT EXISTS conclusao (
+    tarefa_id INTEGER PRIMARY KEY, casal_id INTEGER, usuario_id INTEGER, pontos INTEGER, dia TEXT
+);
+CREATE INDEX IF NOT EXISTS ix_conclusao_dia ON conclusao (dia);
+CREATE TABLE IF NOT EXISTS resgate (
+    resgate_id INTEGER PRIMARY KEY, casal_id INTEGER, usuario_id INTEGER, custo INTEGER, dia TEXT
+);
+CREATE INDEX IF NOT EXISTS ix_resgate_dia ON resgate (dia);
+CREATE TABLE IF NOT EXISTS avaliacao (
+    recompensa_id INTEGER PRIMARY KEY, casal_id INTEGER, status TEXT, custo INTEGER,
+    dia TEXT, latencia_s REAL
+);
+CREATE INDEX IF NOT EXISTS ix_avaliacao_status_custo ON avaliacao (status, custo);
+CREATE INDEX IF NOT EXISTS ix_avaliacao_latencia ON avaliacao (latencia_s);
+CREATE TABLE IF NOT EXISTS atividade (casal_id INTEGER PRIMARY KEY, ultimo_dia TEXT);
+CREATE INDEX IF NOT EXISTS ix_atividade_ultimo_dia ON atividade (ultimo_dia);
+CREATE TABLE IF NOT EXISTS diario (dia TEXT PRIMARY KEY, conclusoes INTEGER, pontos INTEGER, resgates INTEGER);
+CREATE TABLE IF NOT EXISTS resumo (chave TEXT PRIMARY KEY, valor TEXT);
+"""
+
+
+def caminho_analytics():
+    """Caminho do banco de analytics (relativo à pasta instance, como o principal)"""
+    caminho = current_app.config['ANALYTICS_DATABASE_PATH']
+    if not os.path.isabs(caminho):
+        caminho = os.path.join(current_app.instance_path, caminho)
+    return caminho
+
+
+def conectar_analytics(somente_leitura=False):
+    caminho = caminho_analytics()
+    if somente_leitura:
+        return sqlite3.connect(f'file:{caminho}?mode=ro', uri=True)
+    os.makedirs(os.path.dirname(caminho), exist_ok=True)
+    conexao = sqlite3.connect(caminho)
+    conexao.execute('PRAGMA journal_mode=WAL')
+    conexao.executescript(ESQUEMA_ANALYTICS)
+    return conexao
+
+
+def lotes_desde_marca(destino, fonte, consulta, coluna_chave, coluna_data=None):
+    """Percorre `consulta` em lotes a partir da marca d'água salva para `fonte`.
+
+    A ordem é (coluna_data, coluna_chave), ou só coluna_chave para fontes
+    append-only. As consultas devem rotular as colunas de ordem como `data`
+    e `chave`. Cada lote é lido numa transação curta no banco principal (não
+    bloqueia escritores) e a marca avança junto com os dados gravados.
+    """
+    marca = destino.execute('SELECT data, id FROM marca WHERE fonte = ?', (fonte,)).fetchone()
+    if coluna_data is not None:
+        # Folga para transações que calcularam a data mas ainda não gravaram
+        consulta = consulta.where(
+            coluna_data.isnot(None),
+            coluna_data <= datetime.now() - timedelta(seconds=ANALYTICS_ATRASO_S)
+        )
+        ordem = (coluna_data, coluna_chave)
+    else:
+        ordem = (coluna_chave,)
+    while True:
+        filtro = consulta
+        if marca and coluna_data is not None:
+            filtro = filtro.where(db.tuple_(*ordem) > (datetime.fromisoformat(marca[0]), marca[1]))
+        elif marca:
+            filtro = filtro.where(coluna_chave > marca[1])
+        linhas = db.session.execute(filtro.order_by(*ordem).limit(ANALYTICS_LOTE)).all()
+        db.session.rollback()  # encerra a leitura no banco principal
+        if not linhas:
+            return
+        yield linhas
+        ultima = linhas[-1]
+        marca = (ultima.data.isoformat() if coluna_data is not None else None, ultima.chave)
+        destino.execute('INSERT OR REPLACE INTO marca (fonte, data, id) VALUES (?, ?, ?)', (fonte, *marca))
+        destino.commit()
+
+
+def sincronizar_shard_analytics(destino, sufixo, contagem, dias):
+    """Copia tarefas, resgates e avaliações do shard atual (parte de sincronizar_analytics)"""
+    # Itens arquivados mantêm o id original e entram na mesma tabela (sem
+    # duplicar os que já tinham sido copiados antes do arquivamento). O
+    # arquivo é append-only, então a marca é o id da linha arquivada.
+    arquivados = db.select(
+        ItemArquivado.item_id.label('id'), ItemArquivado.casal_id, ItemArquivado.usuario_id,
+        ItemArquivado.pontos.label('valor'), ItemArquivado.data, ItemArquivado.id.label('chave')
+    ).where(ItemArquivado.data.isnot(None))
+    fontes = [
+        ('tarefa', 'conclusao', db.select(
+            Tarefa.id, Tarefa.casal_id, Tarefa.usuario_id, Tarefa.pontos.label('valor'),
+            Tarefa.data_conclusao.label('data'), Tarefa.id.label('chave')
+        ).where(Tarefa.concluida == True), Tarefa.id, Tarefa.data_conclusao),
+        ('tarefa_arquivada', 'conclusao', arquivados.where(ItemArquivado.tipo == 'tarefa'),
+         ItemArquivado.id, None),
+        ('resgate', 'resgate', db.select(
+            Resgate.id, Recompensa.casal_id, Resgate.usuario_id, Resgate.custo.label('valor'),
+            Resgate.data_resgate.label('data'), Resgate.id.label('chave')
+        ).join(Recompensa, Resgate.recompensa_id == Recompensa.id), Resgate.id, Resgate.data_resgate),
+        ('resgate_arquivado', 'resgate', arquivados.where(ItemArquivado.tipo == 'resgate'),
+         ItemArquivado.id, None),
+    ]
+    for fonte, tabela, consulta, coluna_chave, coluna_data in fontes:
+        for linhas in lotes_desde_marca(destino, fonte + sufixo, consulta, coluna_chave, coluna_data):
+            registros = [(l.id, l.casal_id, l.usuario_id, l.valor or 0, l.data.date().isoformat())
+                         for l in linhas]
+            destino.executemany(f'INSERT OR REPLACE INTO {tabela} VALUES (?, ?, ?, ?, ?)', registros)
+            destino.executemany(
+                'INSERT INTO atividade VALUES (?, ?) ON CONFLICT (casal_id) '
+                'DO UPDATE SET ultimo_dia = max(ultimo_dia, excluded.ultimo_dia)',
+                [(r[1], r[4]) for r in registros]
+            )
+            dias.update(r[4] for r in registros)
+            contagem[fonte] = contagem.get(fonte, 0) + len(linhas)
+
+    for linhas in lotes_desde_marca(destino, 'avaliacao' + sufixo, db.select(
+        Recompensa.id.label('chave'), Recompensa.casal_id, Recompensa.status, Recompensa.custo,
+        Recompensa.data_criacao, Recompensa.data_aprovacao.label('data')
+    ).where(Recompensa.status.in_(['aprovada', 'rejeitada'])), Recompensa.id, Recompensa.data_aprovacao):
+        destino.executemany('INSERT OR REPLACE INTO avaliacao VALUES (?, ?, ?, ?, ?, ?)', [(
+            l.chave, l.casal_id, l.status, l.custo, l.data.date().isoformat(),
+            (l.data - l.data_criacao).total_seconds() if l.data_criacao else None
+        ) for l in linhas])
+        contagem['avaliacoes'] = contagem.get('avaliacoes', 0) + len(linhas)
+
+
+def sincronizar_analytics():
+    """Copia as mudanças novas do banco principal para o de analytics. Retorna contagens por fonte"""
+    destino = conectar_analytics()
+    contagem = {}
+    dias = set()
+    try:
+        for linhas in lotes_desde_marca(destino, 'casal', db.select(
+            Casal.id.label('chave'), Casal.data_criacao
+        ), Casal.id):
+            destino.executemany('INSERT OR REPLACE INTO casal VALUES (?, ?)', [
+                (l.chave, l.data_criacao.isoformat() if l.data_criacao else None) for l in linhas
+            ])
+            contagem['casais'] = contagem.get('casais', 0) + len(linhas)
+
+        # Cada shard tem as próprias marcas d'água (fonte@N a partir do shard 1)
+        for indice in range(total_shards()):
+            with no_shard(indice):
+                sincronizar_shard_analytics(destino, f'@{indice}' if indice else '', contagem, dias)
+
+        # Recalcula o agregado diário só dos dias que receberam dados
+        dias = sorted(dias)
+        for i in range(0, len(dias), 500):
+            trecho = dias[i:i + 500]
+            destino.execute(f"""
+                INSERT OR REPLACE INTO diario (dia, conclusoes, pontos, resgates)
+                SELECT d.value,
+                       (SELECT count(*) FROM conclusao c WHERE c.dia = d.value),
+                       (SELECT coalesce(sum(pontos), 0) FROM conclusao c WHERE c.dia = d.value),
+                       (SELECT count(*) FROM resgate r WHERE r.dia = d.value)
+                FROM json_each(?) d
+            """, (json.dumps(trecho),))
+        if contagem:
+            atualizar_resumo(destino)
+        destino.commit()
+    finally:
+        destino.close()
+    return contagem
+
+
+def percentis(conexao, tabela, coluna, filtro='1', qs=(0.5, 0.9, 0.99)):
+    """Percentis via índice: um OFFSET por quantil, sem carregar a coluna inteira"""
+    total = conexao.execute(f'SELECT count(*) FROM {tabela} WHERE {filtro} AND {coluna} IS NOT NULL').fetchone()[0]
+    resultado = {'n': total}
+    for q in qs:
+        valor = None
+        if total:
+            valor = conexao.execute(
+                f'SELECT {coluna} FROM {tabela} WHERE {filtro} AND {coluna} IS NOT NULL '
+                f'ORDER BY {coluna} LIMIT 1 OFFSET ?', (min(total - 1, int(total * q)),)
+            ).fetchone()[0]
+        resultado[f'p{int(q * 100)}'] = valor
+    return resultado
+
+
+def atualizar_resumo(conexao):
+    """Pré-calcula as distribuições (custo e latência) lidas pelo painel"""
+    faixas = conexao.execute("""
+        SELECT CASE WHEN custo < 25 THEN '0-24' WHEN custo < 50 THEN '25-49'
+                    WHEN custo < 100 THEN '50-99' WHEN custo < 200 THEN '100-199'
+                    ELSE '200+' END AS faixa, count(*)
+        FROM avaliacao WHERE status = 'aprovada' GROUP BY faixa
+    """).fetchall()
+    latencia = percentis(conexao, 'avaliacao', 'latencia_s')
+    for chave in ('p50', 'p90', 'p99'):
+        if latencia[chave] is not None:
+            latencia[chave] = round(latencia[chave] / 3600, 2)
+    resumo = {
+        'casais_total': conexao.execute('SELECT count(*) FROM casal').fetchone()[0],
+        'custo_recompensas': {
+            **percentis(conexao, 'avaliacao', 'custo', "status = 'aprovada'"),
+            'faixas': dict(faixas),
+        },
+        'latencia_aprovacao_horas': latencia,
+        'atualizado_em': datetime.now().isoformat(timespec='seconds'),
+    }
+    conexao.executemany('INSERT OR REPLACE INTO resumo VALUES (?, ?)',
+                        [(chave, json.dumps(valor)) for chave, valor in resumo.items()])
+
+
+def metricas_analytics(dias=30):
+    """Métricas globais lidas só do banco de analytics"""
+    conexao = conectar_analytics(somente_leitura=True)
+    try:
+        hoje = date.today()
+        inicio = (hoje - timedelta(days=dias - 1)).isoformat()
+        semana = (hoje - timedelta(days=6)).isoformat()
+        metricas = {chave: json.loads(valor) for chave, valor in conexao.execute('SELECT chave, valor FROM resumo')}
+        metricas['casais_ativos'] = {
+            '7d': conexao.execute('SELECT count(*) FROM atividade WHERE ultimo_dia >= ?', (semana,)).fetchone()[0],
+            f'{dias}d': conexao.execute('SELECT count(*) FROM atividade WHERE ultimo_dia >= ?', (inicio,)).fetchone()[0],
+        }
+        metricas['conclusoes_por_dia'] = [
+            {'dia': dia, 'conclusoes': conclusoes, 'pontos': pontos, 'resgates': resgates}
+            for dia, conclusoes, pontos, resgates in conexao.execute(
+                'SELECT dia, conclusoes, pontos, resgates FROM diario WHERE dia >= ? ORDER BY dia', (inicio,)
+            )
+        ]
+        metricas['marcas'] = {fonte: data or id for fonte, data, id in conexao.execute('SELECT fonte, data, id FROM marca')}
+        return metricas
+    finally:
+        conexao.close()
+
+
+@bp.route('/admin/analytics')
+def admin_analytics():
+    """Painel de operação (JSON). Requer o header X-Admin-Token = ADMIN_TOKEN"""
+    esperado = current_app.config.get('ADMIN_TOKEN')
+    recebido = request.headers.get('X-Admin-Token', '')
+    if not esperado or not hmac.compare_digest(recebido, esperado):
+        return jsonify({'erro': 'nao_autorizado'}), 404
+    try:
+        dias = min(max(int(request.args.get('dias', 30)), 1), 366)
+    except ValueError:
+        return jsonify({'erro': 'dias_invalido'}), 400
+    if not os.path.exists(caminho_analytics()):
+        return jsonify({'erro': 'analytics_nao_sincronizado'}), 503
+    return jsonify(metricas_analytics(dias))
+
+
+@bp.cli.command('analytics-sincronizar')
+@click.option('--do-zero', is_flag=True, help='Apaga o banco de analytics e recarrega tudo.')
+def comando_analytics_sincronizar(do_zero):
+    """Copia as mudanças recentes para o banco de analytics (rodar via cron)."""
+    if do_zero:
+        for sufixo in ('', '-wal', '-shm'):
+            if os.path.exists(caminho_analytics() + sufixo):
+                os.remove(caminho_analytics() + sufixo)
+    inicio = time.perf_counter()
+    contagem = sincronizar_analytics()
+    resumo = ', '.join(f'{fonte}: {n}' for fonte, n in contagem.items()) or 'nada novo'
+    click.echo(f'[OK] Analytics sincronizado em {time.perf_counter() - inicio:.1f}s ({resumo})')
+
+
+# =================================================================
+# SHARDS (DADOS DOS CASAIS EM VÁRIOS BANCOS)
+# =================================================================
+
+# Com SHARDS = N > 1 (DATABASE_SHARDS no ambiente) os dados de cada casal
+# (tarefas, recompensas, resgates, arquivo, estatísticas, notificações,
+# auditoria...) ficam em um de N arquivos SQLite, cada um com a própria
+# trava de escrita. O shard 0 é o banco principal, que também é o
+# diretório: só ele tem `casal`, `usuario` e `token_renovacao`. Os shards
+# extras (`<banco>-shard1.db`, ...) anexam o principal como `diretorio` em
+# cada conexão, então consultas que juntam com usuario/casal continuam
+# funcionando sem mudança.
+#
+# As views não sabem de nada: rotear_request() aponta a sessão para o
+# shard do casal logado e SessaoRoteada.get_bind() faz o resto. Ids de
+# tarefa/recompensa/resgate são globais (contador do shard * SHARD_PASSO
+# + índice do shard), então um casal muda de shard sem renumerar links,
+# fotos, eventos ou o arquivo. Jobs que varrem todos os casais rodam uma
+# vez por shard (em_todos_os_shards).
+#
+# Com SHARDS = 1 (padrão) nada disso é ativado.
+
+SHARD_PASSO = 64  # máximo de shards
+SHARD_MUDANCA_ESPERA_S = 2  # requests já roteados para o shard antigo terminam nesse tempo
+TABELAS_DIRETORIO = {'casal', 'usuario', 'token_renovacao'}
+TABELAS_ID_GLOBAL = {'tarefa', 'recompensa', 'resgate'}
+
+SQL_RESERVAR_IDS = "UPDATE contador_id SET valor = valor + ? WHERE nome = 'global' RETURNING valor"
+
+
+def total_shards():
+    return current_app.config['SHARDS']
+
+
+def caminho_shard(caminho_principal, indice):
+    """Arquivo do shard `indice`, ao lado do banco principal"""
+    base, extensao = os.path.splitext(caminho_principal)
+    return f'{base}-shard{indice}{extensao or ".db"}'
+
+
+def configurar_shards(app):
+    """Um bind do Flask-SQLAlchemy por shard extra (antes do db.init_app)"""
+    total = app.config['SHARDS']
+    if total <= 1:
+        return
+    if total > SHARD_PASSO:
+        raise ValueError(f'SHARDS deve ser no máximo {SHARD_PASSO}')
+    principal = make_url(app.config['SQLALCHEMY_DATABASE_URI']).database
+    if not principal or principal == ':memory:':
+        raise ValueError('SHARDS > 1 precisa de um banco SQLite em arquivo')
+    binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+    for indice in range(1, total):
+        binds.setdefault(f'shard{indice}', f'sqlite:///{caminho_shard(principal, indice)}')
+    app.config['SQLALCHEMY_BINDS'] = binds
+
+
+def preparar_conexao_shard(indice, diretorio):
+    """Listener de connect: anexa o diretório e marca o índice do shard na conexão"""
+    def preparar(conexao, registro):
+        if indice:
+            conexao.execute('ATTACH DATABASE ? AS diretorio', (diretorio,))
+        registro.info['shard'] = indice
+    return preparar
+
+
+def ligar_shards(app):
+    """Registra preparar_conexao_shard nas engines de todos os shards"""
+    if app.config['SHARDS'] <= 1:
+        return
+    with app.app_context():
+        diretorio = db.engine.url.database
+        for indice, engine in enumerate(engines_shards()):
+            db.event.listen(engine, 'connect', preparar_conexao_shard(indice, diretorio))
+
+
+def engines_shards():
+    """Engines na ordem dos índices (só o banco principal sem sharding)"""
+    return [db.engine] + [db.engines[f'shard{indice}'] for indice in range(1, total_shards())]
+
+
+def novos_ids(conexao, quantidade):
+    """Reserva ids globais no shard da conexão ([None, ...] sem sharding)"""
+    indice = conexao.info.get('shard')
+    if indice is None:
+        return [None] * quantidade
+    fim = conexao.exec_driver_sql(SQL_RESERVAR_IDS, (quantidade,)).scalar_one()
+    return [(fim - quantidade + i + 1) * SHARD_PASSO + indice for i in range(quantidade)]
+
+
+def atribuir_id_global(_mapper, conexao, alvo):
+    """before_insert de Tarefa, Recompensa e Resgate"""
+    if alvo.id is None:
+        alvo.id = novos_ids(conexao, 1)[0]
+
+
+for _modelo in (Tarefa, Recompensa, Resgate):
+    db.event.listen(_modelo, 'before_insert', atribuir_id_global)
+
+
+def atribuir_ids_globais(linhas):
+    """O mesmo que atribuir_id_global para as linhas de um INSERT em lote"""
+    for linha, id_global in zip(linhas, novos_ids(db.session.connection(), len(linhas))):
+        if id_global is not None:
+            linha['id'] = id_global
+    return linhas
+
+
+def shard_do_casal(casal_id):
+    """Índice do shard com os dados do casal (negativo durante uma mudança)"""
+    if casal_id is None or total_shards() <= 1:
+        return 0
+    return db.session.execute(
+        db.select(Casal.shard).where(Casal.id == casal_id), bind_arguments={'bind': db.engine}
+    ).scalar() or 0
+
+
+def escolher_shard(chave):
+    """Shard de um casal novo a partir de um id conhecido antes de gravar (None sem sharding)"""
+    return chave % total_shards() if total_shards() > 1 else None
+
+
+def casais_em_mudanca():
+    """Subconsulta dos casais mudando de shard: os jobs em lote não gravam nos dados deles"""
+    return db.select(Casal.id).where(Casal.shard < 0)
+
+
+class GravacaoForaDoShard(RuntimeError):
+    """Troca de shard com gravações ainda não confirmadas na sessão"""
+
+
+@db.event.listens_for(db.orm.Session, 'after_flush')
+def marcar_gravacao_flush(sessao, _contexto):
+    sessao.info['gravou'] = True
+
+
+@db.event.listens_for(db.orm.Session, 'do_orm_execute')
+def marcar_gravacao_execute(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        orm_execute_state.session.info['gravou'] = True
+
+
+@db.event.listens_for(db.orm.Session, 'after_transaction_end')
+def limpar_marca_gravacao(sessao, transacao):
+    if transacao.parent is None:
+        sessao.info.pop('gravou', None)
+
+
+def rotear_shard(indice):
+    """Aponta a sessão para o shard `indice`.
+
+    Nunca confirma nada por conta própria: um commit implícito separaria a
+    mudança do seu evento de auditoria. Com gravações pendentes levanta
+    GravacaoForaDoShard; escolha o shard antes da primeira gravação.
+    """
+    if (db.session.info.get('shard') or 0) == indice:
+        return
+    sessao = db.session
+    if sessao.new or sessao.dirty or sessao.deleted or sessao.info.get('gravou') or sessao.info.get('eventos'):
+        raise GravacaoForaDoShard(f'troca para o shard {indice} com gravações pendentes na sessão')
+    db.session.rollback()  # só houve leituras: encerra a transação do shard anterior
+    db.session.info['shard'] = indice
+
+
+@contextmanager
+def no_shard(indice):
+    """Roda o bloco com a sessão no shard `indice` e depois volta ao anterior"""
+    anterior = db.session.info.get('shard') or 0
+    rotear_shard(indice)
+    try:
+        yield
+    except BaseException:
+        db.session.rollback()
+        raise
+    finally:
+        rotear_shard(anterior)
+
+
+def em_todos_os_shards(funcao, *args, **kwargs):
+    """Chama `funcao` uma vez em cada shard; devolve a lista de resultados"""
+    resultados = []
+    for indice in range(total_shards()):
+        with no_shard(indice):
+            resultados.append(funcao(*args, **kwargs))
+    return resultados
+
+
+@bp.before_app_request
+def rotear_request():
+    """Manda as consultas do request para o shard do casal logado"""
+    if total_shards() <= 1 or request.blueprint != 'comercial' or request.endpoint == 'comercial.avatar':
+        return None  # avatares são públicos: sem sessão, sem Vary: Cookie
+    indice = shard_do_casal(casal_id_atual())
+    if indice < 0:
+        mensagem = 'Estamos reorganizando os dados do casal; tente de novo em alguns segundos.'
+        corpo = jsonify({'erro': mensagem}) if request.path.startswith('/api/') else mensagem
+        return corpo, 503, {'Retry-After': str(SHARD_MUDANCA_ESPERA_S * 2)}
+    rotear_shard(indice)
+    return None
+
+
+def preparar_shards():
+    """Cria as tabelas dos casais nos shards extras e os contadores de id"""
+    tabelas = [t for t in db.metadata.sorted_tables if t.name not in TABELAS_DIRETORIO]
+    for engine in engines_shards()[1:]:
+        db.metadata.create_all(engine, tables=tabelas)
+        adicionar_colunas_novas(engine)
+    # Os ids globais começam acima de tudo o que já existe no banco principal
+    with db.engine.connect() as conexao:
+        maior = max(conexao.execute(db.select(db.func.max(coluna))).scalar() or 0 for coluna in (
+            Tarefa.id, Recompensa.id, Resgate.id, ItemArquivado.item_id))
+    for engine in engines_shards():
+        with engine.begin() as conexao:
+            conexao.execute(sqlite_insert(ContadorId).values(
+                nome='global', valor=maior // SHARD_PASSO + 1).on_conflict_do_nothing())
+
+
+# Tabelas com dados de um casal, na ordem de cópia (a remoção é na ordem
+# inversa). Só tarefa/recompensa/resgate mantêm o id; nas outras ele é local.
+def tabelas_do_casal():
+    return [modelo.__table__ for modelo in (
+        Tarefa, Recompensa, Resgate, ItemArquivado, TotalArquivado, EstatisticaDiaria, Sequencia,
+        ModeloTarefa, Notificacao, Evento, SequenciaEvento, LoteEventos,
+    )]
+
+
+def filtro_do_casal(tabela, casal_id, usuario_ids):
+    if tabela.name == 'resgate':
+        return tabela.c.recompensa_id.in_(db.select(Recompensa.id).where(Recompensa.casal_id == casal_id))
+    if 'casal_id' in tabela.c:
+        return tabela.c.casal_id == casal_id
+    return tabela.c.usuario_id.in_(usuario_ids)
+
+
+def apagar_dados_casal(conexao, casal_id, usuario_ids):
+    """Remove os dados do casal de um shard (e as tarefas arquivadas da busca)"""
+    conexao.exec_driver_sql(
+        "DELETE FROM busca WHERE rowid IN "
+        "(SELECT -id FROM item_arquivado WHERE casal_id = ? AND tipo = 'tarefa')", (casal_id,)
+    )
+    for tabela in reversed(tabelas_do_casal()):
+        conexao.execute(db.delete(tabela).where(filtro_do_casal(tabela, casal_id, usuario_ids)))
+
+
+def mover_casal(casal_id, destino, espera=SHARD_MUDANCA_ESPERA_S):
+    """Muda os dados de um casal para o shard `destino`; devolve as linhas copiadas.
+
+    O casal fica marcado como em mudança (shard = -1 - origem; os requests
+    recebem 503 e arquivamento, lembretes e compactação de eventos pulam o
+    casal) enquanto a cópia roda, então dá para repetir o comando se ele
+    for interrompido, ou cancelar a mudança pedindo o shard de origem.
+    """
+    shard = shard_do_casal(casal_id)
+    origem = -1 - shard if shard < 0 else shard
+    if origem == destino:
+        if shard < 0:
+            db.session.execute(db.update(Casal).where(Casal.id == casal_id).values(shard=origem))
+            db.session.commit()
+        return 0
+    usuario_ids = db.session.scalars(db.select(Usuario.id).where(Usuario.casal_id == casal_id)).all()
+    db.session.execute(db.update(Casal).where(Casal.id == casal_id).values(shard=-1 - origem))
+    db.session.commit()
+    time.sleep(espera)
+
+    engines = engines_shards()
+    copiadas = 0
+    with engines[origem].connect() as leitura, engines[destino].begin() as escrita:
+        apagar_dados_casal(escrita, casal_id, usuario_ids)  # sobra de uma mudança interrompida
+        maior_id = 0
+        for tabela in tabelas_do_casal():
+            linhas = [dict(linha) for linha in leitura.execute(
+                db.select(tabela).where(filtro_do_casal(tabela, casal_id, usuario_ids))).mappings()]
+            if not linhas:
+                continue
+            if tabela.name in TABELAS_ID_GLOBAL:
+                maior_id = max(maior_id, max(linha['id'] for linha in linhas))
+            elif 'id' in tabela.c:
+                for linha in linhas:
+                    del linha['id']
+            escrita.execute(db.insert(tabela), linhas)
+            copiadas += len(linhas)
+        # Ids novos no destino continuam maiores que os copiados
+        escrita.execute(db.update(ContadorId).where(ContadorId.nome == 'global')
+                        .values(valor=db.func.max(ContadorId.valor, maior_id // SHARD_PASSO)))
+        indexar_tarefas_arquivadas(escrita, [
+            (arquivo_id, item_id, casal_id, payload.get('titulo'), payload.get('descricao'))
+            for arquivo_id, item_id, payload in (
+                (linha.id, linha.item_id, descompactar_payload(linha.dados)) for linha in escrita.execute(
+                    db.select(ItemArquivado.id, ItemArquivado.item_id, ItemArquivado.dados)
+                    .where(ItemArquivado.casal_id == casal_id, ItemArquivado.tipo == 'tarefa')))
+        ])
+
+    db.session.execute(db.update(Casal).where(Casal.id == casal_id).values(shard=destino))
+    db.session.commit()
+    with engines[origem].begin() as conexao:
+        apagar_dados_casal(conexao, casal_id, usuario_ids)
+    return copiadas
+
+
+def plano_rebalanceamento(max_mudancas=None):
+    """[(casal_id, origem, destino)] até os shards diferirem em no máximo um casal"""
+    por_shard = {indice: [] for indice in range(total_shards())}
+    for casal_id, shard in db.session.execute(db.select(Casal.id, Casal.shard).order_by(Casal.id)):
+        if (shard or 0) in por_shard:
+            por_shard[shard or 0].append(casal_id)
+    plano = []
+    while max_mudancas is None or len(plano) < max_mudancas:
+        cheio = max(por_shard, key=lambda indice: len(por_shard[indice]))
+        vazio = min(por_shard, key=lambda indice: len(por_shard[indice]))
+        if len(por_shard[cheio]) - len(por_shard[vazio]) <= 1:
+            break
+        # Os casais mais novos costumam ter menos dados para copiar
+        casal_id = por_shard[cheio].pop()
+        por_shard[vazio].append(casal_id)
+        plano.append((casal_id, cheio, vazio))
+    return plano
+
+
+def reparar_eventos_vinculo(simular=False):
+    """Reemite casal_criado/parceiro_entrou que faltam no shard; devolve quantos.
+
+    O vínculo fica no diretório e o evento no shard: com WAL uma queda no
+    commit pode gravar só um dos arquivos. Casais cujo começo do histórico
+    já saiu pela retenção dos eventos ficam de fora (não dá para saber).
+    """
+    def reparar_shard(indice):
+        casais = db.select(Casal.id).where(db.func.coalesce(Casal.shard, 0) == indice)
+        registrados = set(db.session.execute(
+            db.select(Evento.casal_id, Evento.tipo, Evento.usuario_id)
+            .where(Evento.casal_id.in_(casais), Evento.tipo.in_(('casal_criado', 'parceiro_entrou')))
+        ).all())
+        for casal_id, bloco in db.session.execute(
+            db.select(LoteEventos.casal_id, LoteEventos.dados).where(LoteEventos.casal_id.in_(casais))
+        ):
+            registrados.update((casal_id, linha[2], linha[1]) for linha in descompactar_payload(bloco))
+        ultimos = dict(db.session.execute(
+            db.select(SequenciaEvento.casal_id, SequenciaEvento.ultimo).where(SequenciaEvento.casal_id.in_(casais))
+        ).all())
+        com_inicio = set(db.session.scalars(
+            db.select(Evento.casal_id).where(Evento.casal_id.in_(casais), Evento.seq == 1)
+            .union(db.select(LoteEventos.casal_id).where(LoteEventos.casal_id.in_(casais),
+                                                         LoteEventos.seq_inicio == 1))
+        ))
+
+        faltando = 0
+        for casal in db.session.execute(
+            db.select(Casal.id, Casal.parceiro_a_id, Casal.parceiro_b_id).where(Casal.id.in_(casais))
+        ):
+            if ultimos.get(casal.id) and casal.id not in com_inicio:
+                continue
+            for tipo, membro in (('casal_criado', casal.parceiro_a_id), ('parceiro_entrou', casal.parceiro_b_id)):
+                if membro is not None and (casal.id, tipo, membro) not in registrados:
+                    faltando += 1
+                    if not simular:
+                        registrar_evento(tipo, casal.id, membro, casal.id, reparado=True)
+        db.session.commit()
+        return faltando
+
+    faltando = 0
+    for indice in range(total_shards()):
+        with no_shard(indice):
+            faltando += reparar_shard(indice)
+    return faltando
+
+
+@bp.cli.command('mover-casal')
+@click.argument('casal_id', type=int)
+@click.argument('destino', type=int)
+@click.option('--espera', type=float, default=SHARD_MUDANCA_ESPERA_S, show_default=True,
+              help='Segundos entre bloquear o casal e copiar os dados.')
+def comando_mover_casal(casal_id, destino, espera):
+    """Muda os dados de um casal para outro shard."""
+    if not 0 <= destino < total_shards():
+        raise click.ClickException(f'Shard inválido: use 0 a {total_shards() - 1} (SHARDS={total_shards()}).')
+    if db.session.get(Casal, casal_id) is None:
+        raise click.ClickException(f'Casal {casal_id} não existe.')
+    inicio = time.perf_counter()
+    copiadas = mover_casal(casal_id, destino, espera)
+    click.echo(f'[OK] Casal {casal_id} no shard {destino} ({copiadas} linhas copiadas '
+               f'em {time.perf_counter() - inicio:.1f}s)')
+
+
+@bp.cli.command('shards-rebalancear')
+@click.option('--max-mudancas', type=int, default=None, help='Limite de casais movidos nesta execução.')
+@click.option('--simular', is_flag=True, help='Só mostra o plano.')
+@click.option('--espera', type=float, default=SHARD_MUDANCA_ESPERA_S, show_default=True)
+def comando_shards_rebalancear(max_mudancas, simular, espera):
+    """Distribui os casais entre os shards (ex.: depois de aumentar SHARDS)."""
+    plano = plano_rebalanceamento(max_mudancas)
+    for casal_id, origem, destino in plano:
+        click.echo(f'casal {casal_id}: shard {origem} -> {destino}')
+        if not simular:
+            mover_casal(casal_id, destino, espera)
+    click.echo(f"[OK] {len(plano)} casais {'a mover' if simular else 'movidos'}")
+    reparados = reparar_eventos_vinculo(simular)
+    if reparados:
+        click.echo(f"[OK] {reparados} eventos de vínculo {'faltando' if simular else 'reemitidos'}")
+
+
+# =================================================================
+# TEMPLATES PRÉ-COMPILADOS
+# =================================================================
+
+# O Jinja compila cada template no primeiro uso, então depois de um deploy
+# o primeiro acesso a cada página em cada worker pagava a compilação. O
+# código compilado vai para um cache em disco (TEMPLATE_CACHE_DIR; vazio
+# usa uma pasta privada em /tmp), reaproveitado por todos os workers e
+# reinícios, e aquecer_templates() carrega tudo no boot: com preload_app
+# os workers já nascem com os templates na memória. Valores fixos usados
+# pelos templates (rótulos de frequência) ficam aqui, e não como literais
+# recriados a cada render.
+
+ROTULOS_FREQUENCIA = {'diaria': 'Diaria', 'semanal': 'Semanal', 'quinzenal': 'Quinzenal', 'mensal': 'Mensal'}
+
+
+@bp.app_template_filter('rotulo_frequencia')
+def rotulo_frequencia(frequencia):
+    """'semanal' -> 'Semanal'; frequência desconhecida -> 'Recorrente'"""
+    return ROTULOS_FREQUENCIA.get(frequencia, 'Recorrente')
+
+
+def configurar_templates(app):
+    """Liga o cache de bytecode do Jinja (TEMPLATE_BYTECODE_CACHE=0 desliga)"""
+    if app.config['TEMPLATE_BYTECODE_CACHE']:
+        # Pasta padrão do Jinja: criada com permissão só do usuário, que é
+        # quem pode gravar bytecode que o app vai executar
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(app.config['TEMPLATE_CACHE_DIR'] or None)
+
+
+def aquecer_templates(app):
+    """Compila (ou lê do cache em disco) todos os templates; devolve quantos.
+
+    Roda nos hooks do gunicorn antes do primeiro request. Mesmo junto com
+    requests não precisa de trava: o cache de templates do Jinja tem a sua, e
+    o FileSystemBytecodeCache grava num temporário e renomeia.
+    """
+    nomes = [nome for nome in app.jinja_env.list_templates() if nome.endswith('.html')]
+    for nome in nomes:
+        app.jinja_env.get_template(nome)
+    return len(nomes)
+
+
+@bp.cli.command('templates-aquecer')
+def comando_templates_aquecer():
+    """Pré-compila os templates no cache em disco (passo de build/deploy)."""
+    inicio = time.perf_counter()
+    total = aquecer_templates(current_app)
+    click.echo(f'[OK] {total} templates compilados em {(time.perf_counter() - inicio) * 1000:.0f} ms')
+
+
+# =================================================================
+# COMPRESSÃO DE RESPOSTAS E ESTÁTICOS VERSIONADOS
+# =================================================================
+
+# O público usa o app principalmente no celular, em rede lenta. Toda
+# resposta de texto a partir de COMPRESSAO_MIN_BYTES sai com brotli (se o
+# pacote `brotli` estiver instalado) ou gzip, conforme o Accept-Encoding.
+# Respostas em streaming (exportações) são compactadas pedaço a pedaço,
+# sem juntar o corpo na memória; arquivos estáticos são compactados uma vez
+# e ficam em memória. O HTML renderizado perde comentários e recuos
+# (MINIFICAR_HTML) e o CSS comum das páginas fica em static/css/, com o
+# hash do conteúdo na URL (url_estatico) e cache de um ano.
+#
+# BREACH: numa resposta compactada que traz um segredo e também texto
+# vindo do usuário, o tamanho do corpo deixa um atacante adivinhar o
+# segredo byte a byte. Por isso respostas que renderizaram o token CSRF
+# (csrf_token() grava o token em `g`) saem sem compressão.
+
+COMPRESSAO_MIN_BYTES = 512
+TIPOS_COMPACTAVEIS = {
+    'text/html', 'text/css', 'text/plain', 'text/csv', 'text/javascript', 'application/javascript',
+    'application/json', 'application/x-ndjson', 'image/svg+xml',
+}
+GZIP_NIVEL = 6
+BROTLI_NIVEL = 5  # por request; os estáticos (compactados uma vez) usam o nível máximo
+CACHE_ESTATICO_S = 365 * 24 * 3600
+MAX_ESTATICOS_COMPACTADOS = 256
+
+_RE_PRESERVAR_HTML = re.compile(r'(<(?:pre|textarea)\b.*?</(?:pre|textarea)>)', re.S | re.I)
+_RE_COMENTARIO_HTML = re.compile(r'<!--(?!\[if).*?-->', re.S)
+_RE_RECUO_HTML = re.compile(r'\n\s+')
+
+
+def minificar_html(html):
+    """Remove comentários, recuos e linhas em branco (fora de <pre>/<textarea>).
+
+    As quebras de linha ficam: o espaço renderizado entre elementos não muda
+    e comentários `//` em scripts inline continuam válidos.
+    """
+    partes = _RE_PRESERVAR_HTML.split(html)
+    for i in range(0, len(partes), 2):
+        partes[i] = _RE_RECUO_HTML.sub('\n', _RE_COMENTARIO_HTML.sub('', partes[i]))
+    return ''.join(partes)
+
+
+def escolher_codificacao():
+    """'br', 'gzip' ou None, conforme o Accept-Encoding do request"""
+    aceitas = request.accept_encodings
+    if brotli is not None and aceitas['br']:
+        return 'br'
+    if aceitas['gzip']:
+        return 'gzip'
+    return None
+
+
+def compactar(dados, codificacao, maximo=False):
+    if codificacao == 'br':
+        return brotli.compress(dados, quality=11 if maximo else BROTLI_NIVEL)
+    return gzip.compress(dados, compresslevel=9 if maximo else GZIP_NIVEL, mtime=0)
+
+
+def compactar_fluxo(pedacos, codificacao):
+    """Compacta um corpo em streaming; cada pedaço é enviado assim que chega (flush)"""
+    try:
+        if codificacao == 'br':
+            compressor = brotli.Compressor(quality=BROTLI_NIVEL)
+            for pedaco in pedacos:
+                yield compressor.process(pedaco.encode() if isinstance(pedaco, str) else pedaco) + compressor.flush()
+            yield compressor.finish()
+        else:
+            compressor = zlib.compressobj(GZIP_NIVEL, zlib.DEFLATED, 31)  # 31: formato gzip
+            for pedaco in pedacos:
+                yield (compressor.compress(pedaco.encode() if isinstance(pedaco, str) else pedaco)
+                       + compressor.flush(zlib.Z_SYNC_FLUSH))
+            yield compressor.flush()
+    finally:
+        if hasattr(pedacos, 'close'):
+            pedacos.close()
+
+
+trava_estaticos_compactados = threading.Lock()
+
+
+def estatico_compactado(response, codificacao):
+    """Corpo compactado de um arquivo (send_file), em cache por caminho, ETag e codificação.
+
+    A compactação roda fora da trava (duas threads podem compactar o mesmo
+    arquivo uma vez cada); a trava só mantém o limite do cache exato.
+    """
+    cache = current_app.extensions['estaticos_compactados']
+    chave = (request.path, response.get_etag()[0], codificacao)
+    corpo = cache.get(chave)
+    if corpo is None:
+        response.direct_passthrough = False
+        corpo = compactar(response.get_data(), codificacao, maximo=True)
+        with trava_estaticos_compactados:
+            if len(cache) >= MAX_ESTATICOS_COMPACTADOS:
+                cache.clear()
+            cache[chave] = corpo
+    elif hasattr(response.response, 'close'):
+        response.response.close()  # o arquivo aberto pelo send_file não será lido
+    return corpo
+
+
+@bp.app_template_global()
+def url_estatico(nome):
+    """URL de um arquivo de static/ com o hash do conteúdo (?v=...), para cache longo"""
+    versoes = current_app.extensions['estaticos_versoes']
+    versao = versoes.get(nome)
+    if versao is None or current_app.debug:
+        with open(os.path.join(current_app.static_folder, nome), 'rb') as arquivo:
+            versao = versoes[nome] = hashlib.sha256(arquivo.read()).hexdigest()[:12]
+    return url_for('static', filename=nome, v=versao)
+
+
+@bp.after_app_request
+def otimizar_resposta(response):
+    """Cache longo para estáticos versionados, HTML minificado e compressão"""
+    if request.endpoint == 'static' and request.args.get('v'):
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = CACHE_ESTATICO_S
+        response.cache_control.immutable = True
+
+    if (response.mimetype not in TIPOS_COMPACTAVEIS or response.status_code < 200
+            or response.status_code in (204, 206, 304) or 'Content-Encoding' in response.headers):
+        return response
+    response.vary.add('Accept-Encoding')
+    arquivo = response.direct_passthrough
+    streaming = response.is_streamed and not arquivo
+
+    if (response.mimetype == 'text/html' and current_app.config['MINIFICAR_HTML']
+            and not arquivo and not streaming):
+        response.set_data(minificar_html(response.get_data(as_text=True)))
+
+    codificacao = escolher_codificacao()
+    if codificacao is None or current_app.config['WTF_CSRF_FIELD_NAME'] in g:
+        return response
+    if streaming:
+        response.response = compactar_fluxo(response.response, codificacao)
+        response.headers.pop('Content-Length', None)
+    elif arquivo:
+        if (response.content_length or 0) < COMPRESSAO_MIN_BYTES:
+            return response
+        etag, _fraca = response.get_etag()
+        response.set_data(estatico_compactado(response, codificacao))
+        if etag:
+            response.set_etag(etag, weak=True)  # o corpo mudou; a versão continua a mesma
+    else:
+        dados = response.get_data()
+        if len(dados) < COMPRESSAO_MIN_BYTES:
+            return response
+        response.set_data(compactar(dados, codificacao))
+    response.headers['Content-Encoding'] = codificacao
+    return response
+
+
+# =================================================================
+# LOG DE SEGURANÇA
+# =================================================================
+
+# O request só enfileira o registro (FilaLog, put_nowait numa fila
+# limitada); uma thread QueueListener por processo formata o JSON e
+# escreve no arquivo. Se a fila lotar (ataque), o registro é descartado e
+# contado em vez de segurar o request. Vários workers escrevem no mesmo
+# arquivo em modo append; quem passa do limite rotaciona sob flock e os
+# demais percebem a troca de inode e reabrem (WatchedFileHandler).
+
+LOG_FILA_MAX = 10000
+
+
+class FormatadorJSON(logging.Formatter):
+    """Uma linha JSON por registro: ts, nivel, evento + campos de `dados`"""
+
+    def format(self, record):
+        linha = {
+            'ts': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'nivel': record.levelname,
+            'evento': record.getMessage(),
+            'pid': record.process,
+        }
+        linha.update(getattr(record, 'dados', None) or {})
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            linha['erro'] = record.exc_text
+        return json.dumps(linha, ensure_ascii=False, default=str)
+
+
+class ArquivoLogRotativo(WatchedFileHandler):
+    """Arquivo compartilhado por vários processos, com rotação por tamanho sob flock"""
+
+    def __init__(self, caminho, max_bytes, backups):
+        super().__init__(caminho, encoding='utf-8')
+        self.max_bytes = max_bytes
+        self.backups = backups
+
+    def emit(self, record):
+        try:
+            if self.stream and os.fstat(self.stream.fileno()).st_size >= self.max_bytes:
+                self.rotacionar()
+        except OSError:
+            pass
+        super().emit(record)  # reabre o arquivo se outro processo o rotacionou
+
+    def rotacionar(self):
+        with open(self.baseFilename + '.lock', 'a') as trava:
+            if fcntl:
+                fcntl.flock(trava, fcntl.LOCK_EX)
+            # Outro processo pode ter rotacionado enquanto esperávamos a trava
+            try:
+                if os.stat(self.baseFilename).st_size < self.max_bytes:
+                    return
+            except FileNotFoundError:
+                return
+            for i in range(self.backups - 1, 0, -1):
+                origem = f'{self.baseFilename}.{i}'
+                if os.path.exists(origem):
+                    os.replace(origem, f'{self.baseFilename}.{i + 1}')
+            os.replace(self.baseFilename, self.baseFilename + '.1')
+
+
+class FilaLog(QueueHandler):
+    """QueueHandler que nunca bloqueia e sobe o QueueListener em cada processo (pós-fork)"""
+
+    def __init__(self, destino):
+        super().__init__(queue.Queue(maxsize=LOG_FILA_MAX))
+        self.destino = destino
+        self.ouvinte = None
+        self.pid = None
+        self.descartados = 0
+        self.trava = threading.Lock()
+
+    def garantir_ouvinte(self):
+        # Threads não sobrevivem ao fork do gunicorn: cada worker sobe a sua
+        if self.pid != os.getpid():
+            with self.trava:
+                if self.pid != os.getpid():
+                    self.queue = queue.Queue(maxsize=LOG_FILA_MAX)
+                    self.ouvinte = QueueListener(self.queue, self.destino)
+                    self.ouvinte.start()
+                    self.pid = os.getpid()
+
+    def prepare(self, record):
+        # O prepare padrão cola o traceback na mensagem e apaga exc_info; aqui
+        # ele segue pronto em exc_text para o FormatadorJSON gravar em `erro`
+        record = copy.copy(record)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.msg, record.args, record.exc_info = record.getMessage(), None, None
+        return record
+
+    def enqueue(self, record):
+        self.garantir_ouvinte()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.descartados += 1
+
+    def parar(self):
+        """Esvazia a fila no arquivo (atexit)"""
+        if self.ouvinte and self.pid == os.getpid():
+            ouvinte, self.ouvinte, self.pid = self.ouvinte, None, None
+            try:
+                ouvinte.stop()
+            except queue.Full:
+                pass
+
+
+def log_seguranca(evento, nivel=logging.WARNING, **dados):
+    """Registra um evento de segurança com IP, rota e usuário do request atual"""
+    if has_request_context():
+        dados = {
+            'ip': get_remote_address(),
+            'metodo': request.method,
+            'rota': request.path,
+            'usuario_id': session.get('usuario_id'),
+            'ua': (request.user_agent.string or '')[:200],
+            **dados,
+        }
+    app_logger.log(nivel, evento, extra={'dados': dados})
+
+
+# =================================================================
+# INICIALIZAÇÃO
+# =================================================================
+
+def configurar_logging(app):
+    """Configura o log de segurança em SECURITY_LOG_PATH (relativo à pasta instance).
+
+    O logger é do processo: um app com outro caminho (ex.: nos testes)
+    troca o destino em vez de escrever no arquivo do anterior.
+    """
+    caminho = app.config['SECURITY_LOG_PATH']
+    if not os.path.isabs(caminho):
+        caminho = os.path.join(app.instance_path, caminho)
+    caminho = os.path.abspath(caminho)
+    for fila in [h for h in app_logger.handlers if isinstance(h, FilaLog)]:
+        if fila.destino.baseFilename == caminho:
+            return
+        app_logger.removeHandler(fila)
+        fila.parar()
+        fila.destino.close()
+    os.makedirs(os.path.dirname(caminho), exist_ok=True)
+    arquivo = ArquivoLogRotativo(caminho, max_bytes=1048576, backups=5)
+    arquivo.setFormatter(FormatadorJSON())
+    fila = FilaLog(arquivo)
+    fila.setLevel(logging.WARNING)
+    app_logger.addHandler(fila)
+    app_logger.setLevel(logging.WARNING)
+    app_logger.propagate = False
+    atexit.register(fila.parar)
+
+
+def create_app(config=None):
+    """Application factory: cria e configura uma instância do app.
+
+    `config` sobrescreve qualquer chave antes das extensões serem ligadas
+    (ex.: banco temporário em testes).
+    """
+    app = Flask(__name__)
+    # Security: Generate a strong random secret key in production
+    # Use: python -c "import secrets; print(secrets.token_hex(32))"
+    app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'casal-comercial-2024-secreto-dev-only')
+    app.config['WTF_CSRF_ENABLED'] = True
+    app.config['WTF_CSRF_TIME_LIMIT'] = 3600  # 1 hour
+
+    # Session Security
+    app.config['SESSION_COOKIE_SECURE'] = False  # Set to True in production with HTTPS
+    app.config['SESSION_COOKIE_HTTPONLY'] = True  # Prevents XSS access to session cookie
+    app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'  # CSRF protection
+    app.config['PERMANENT_SESSION_LIFETIME'] = 3600  # 1 hour session timeout
+
+    # RATELIMIT_ENABLED=0 só para testes de carga locais
+    app.config['RATELIMIT_ENABLED'] = os.environ.get('RATELIMIT_ENABLED', '1') == '1'
+
+    # Database configuration - use persistent storage on Render
+    # Render persists /opt/render/project/src/data/ directory
+    db_path = os.environ.get('DATABASE_PATH', 'casal_comercial.db')
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{db_path}'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['UPLOAD_FOLDER'] = 'uploads_comercial'
+    app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max
+
+    # Limites das fotos enviadas (ver ler_cabecalho_imagem)
+    app.config['IMAGEM_MAX_LADO'] = IMAGEM_MAX_LADO
+    app.config['IMAGEM_MAX_PIXELS'] = IMAGEM_MAX_PIXELS
+    app.config['IMAGEM_MAX_QUADROS'] = IMAGEM_MAX_QUADROS
+
+    # Tokens da API (clientes JSON/SPA)
+    app.config['API_TOKEN_ACESSO_SEGUNDOS'] = 15 * 60
+    app.config['API_TOKEN_RENOVACAO_DIAS'] = 30
+
+    # Painel de operação: banco de analytics separado e token de acesso
+    app.config['ANALYTICS_DATABASE_PATH'] = os.environ.get('ANALYTICS_DATABASE_PATH', 'casal_analytics.db')
+    app.config['ADMIN_TOKEN'] = os.environ.get('ADMIN_TOKEN')
+
+    # Log de segurança em JSON (ver seção LOG DE SEGURANÇA)
+    app.config['SECURITY_LOG_PATH'] = os.environ.get('SECURITY_LOG_PATH', 'logs/security.log')
+
+    # Número de bancos com os dados dos casais (ver seção SHARDS)
+    app.config['SHARDS'] = int(os.environ.get('DATABASE_SHARDS', 1))
+
+    # Origem de uma CDN na frente de /avatares (ex.: https://cdn.exemplo.com); vazio = mesmo host
+    app.config['CDN_URL'] = os.environ.get('CDN_URL', '').rstrip('/')
+
+    # Remove recuos e comentários do HTML renderizado (MINIFICAR_HTML=0 desliga)
+    app.config['MINIFICAR_HTML'] = os.environ.get('MINIFICAR_HTML', '1') == '1'
+
+    # Cache em disco dos templates compilados (ver seção TEMPLATES PRÉ-COMPILADOS)
+    app.config['TEMPLATE_BYTECODE_CACHE'] = os.environ.get('TEMPLATE_BYTECODE_CACHE', '1') == '1'
+    app.config['TEMPLATE_CACHE_DIR'] = os.environ.get('TEMPLATE_CACHE_DIR')
+
+    if config:
+        app.config.update(config)
+
+    # Guarda contra lazy loads: ligada por padrão quando TESTING=True
+    app.config.setdefault('BLOQUEAR_LAZY_LOAD', app.testing)
+
+    configurar_shards(app)
+
+    configurar_logging(app)
+
+    configurar_templates(app)
+
+    # Initialize CSRF protection (a checagem roda em proteger_csrf, que
+    # dispensa requests autenticados por token Bearer)
+    app.config['WTF_CSRF_CHECK_DEFAULT'] = False
+    csrf.init_app(app)
+
+    # Initialize Rate Limiter (anti-brute force)
+    limiter.init_app(app)
+
+    # Initialize Security Headers
+    talisman.init_app(app,
+        force_https=False,  # Set to True in production with HTTPS
+        strict_transport_security=False,  # Enable in production
+        content_security_policy={
+            'default-src': "'self'",
+            'script-src': ["'self'", "'unsafe-inline'"],  # Allow inline for now
+            'style-src': ["'self'", "'unsafe-inline'", "https://fonts.googleapis.com"],
+            'font-src': ["'self'", "https://fonts.gstatic.com"],
+            'img-src': ["'self'", "data:", "blob:"] + ([app.config['CDN_URL']] if app.config['CDN_URL'] else []),
+            'connect-src': "'self'",
+        },
+        referrer_policy='strict-origin-when-cross-origin',
+        feature_policy={
+            'geolocation': "'none'",
+            'microphone': "'none'",
+            'camera': "'self'",
+        }
+    )
+
+    db.init_app(app)
+    ligar_shards(app)
+    app.extensions['sugestoes'] = IndiceSugestoes()
+    app.extensions['estaticos_versoes'] = {}
+    app.extensions['estaticos_compactados'] = {}
+    app.register_blueprint(bp)
+
+    # Configura os mappers agora (e não no primeiro request); com
+    # preload_app isso acontece uma vez só, no master do gunicorn
+    db.orm.configure_mappers()
+
+    return app
+
+
+_app_padrao = None
+
+
+def __getattr__(nome):
+    """Cria o app padrão só quando `app_comercial.app` é acessado.
+
+    Mantém `gunicorn app_comercial:app` e `flask --app app_comercial`
+    funcionando sem efeitos colaterais no import do módulo.
+    """
+    global _app_padrao
+    if nome == 'app':
+        if _app_padrao is None:
+            _app_padrao = create_app()
+        return _app_padrao
+    raise AttributeError(f"module {__name__!r} has no attribute {nome!r}")
+
+
+# Colunas criadas depois que a tabela já existia em produção. O create_all
+# não altera tabelas existentes, então o init-db as acrescenta aqui.
+COLUNAS_ADICIONADAS = [
+    Tarefa.__table__.c.prazo,
+    Casal.__table__.c.shard,
+    Casal.__table__.c.parceiro_a_id,
+    Casal.__table__.c.parceiro_b_id,
+]
+
+
+def adicionar_colunas_novas(engine=None):
+    """ALTER TABLE ADD COLUMN (e índices) para as COLUNAS_ADICIONADAS que faltam"""
+    with (engine or db.engine).begin() as conexao:
+        for coluna in COLUNAS_ADICIONADAS:
+            tabela = coluna.table
+            # main.: nos shards o diretório anexado também tem tabelas
+            existentes = {linha[1] for linha in conexao.exec_driver_sql(f'PRAGMA main.table_info({tabela.name})')}
+            if not existentes or coluna.name in existentes:
+                continue
+            tipo = coluna.type.compile(dialect=conexao.dialect)
+            conexao.exec_driver_sql(f'ALTER TABLE main.{tabela.name} ADD COLUMN {coluna.name} {tipo}')
+            for indice in tabela.indexes:
+                if coluna.name in indice.columns:
+                    indice.create(conexao, checkfirst=True)
+
+
+def preencher_membros_casais():
+    """Preenche parceiro_a_id/parceiro_b_id dos casais criados antes dessas colunas.
+
+    O mais antigo vira A e o seguinte B. Casais com mais de 2 membros (da
+    corrida antiga no entrar-casal) ficam com os dois primeiros. Retorna
+    (casais preenchidos, [(casal_id, membros)] dos que têm mais de 2).
+    """
+    with db.engine.begin() as conexao:
+        preenchidos = conexao.exec_driver_sql('''
+            UPDATE casal SET
+                parceiro_a_id = (SELECT MIN(id) FROM usuario WHERE casal_id = casal.id),
+                parceiro_b_id = (SELECT id FROM usuario WHERE casal_id = casal.id ORDER BY id LIMIT 1 OFFSET 1)
+            WHERE parceiro_a_id IS NULL
+              AND EXISTS (SELECT 1 FROM usuario WHERE casal_id = casal.id)
+        ''').rowcount
+        excedentes = conexao.exec_driver_sql(
+            'SELECT casal_id, COUNT(*) FROM usuario WHERE casal_id IS NOT NULL '
+            'GROUP BY casal_id HAVING COUNT(*) > 2'
+        ).all()
+    return preenchidos, excedentes
+
+
+def init_db():
+    """Inicializa o banco de dados (requer app context); retorna o de preencher_membros_casais"""
+    # Só o bind padrão: os shards são criados em preparar_shards, e db.metadatas
+    # guarda os binds de qualquer app criado antes no mesmo processo
+    db.create_all(bind_key=None)
+    adicionar_colunas_novas()
+    membros = preencher_membros_casais()
+    if total_shards() > 1:
+        preparar_shards()
+    return membros
+
+
+@bp.cli.command('init-db')
+def comando_init_db():
+    """Cria as tabelas que ainda não existem no banco."""
+    preenchidos, excedentes = init_db()
+    if preenchidos:
+        click.echo(f"[OK] Membros preenchidos em {preenchidos} casais")
+    for casal_id, total in excedentes:
+        click.echo(f"[AVISO] Casal {casal_id} tem {total} membros; só os dois primeiros contam como parceiros")
+    click.echo("[OK] Banco de dados criado com sucesso!")
+
+
+if __name__ == '__main__':
+    # Configurar encoding UTF-8 para Windows
+    if sys.platform == 'win32':
+        sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
+        sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8')
+
+    app = create_app()
+    with app.app_context():
+        init_db()
     app.run(debug=True, host='0.0.0.0', port=5001)
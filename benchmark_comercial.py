@@ -0,0 +1,839 @@
+"""
+=================================================================
+📊 Benchmark - Nosso App
+=================================================================
+Teste de carga local contra um servidor já rodando.
+
+Uso:
+    export DATABASE_PATH=/tmp/bench.db
+    python benchmark_comercial.py semear --tarefas 50
+    gunicorn app_comercial:app            # em outro terminal, mesmo DATABASE_PATH
+    python benchmark_comercial.py carga --url http://127.0.0.1:8000 \\
+        --concorrencia 32 --duracao 15 --lentos 8
+
+`semear` cria um casal com tarefas e grava o cookie de sessão em
+.bench_cookie; `carga` dispara GETs autenticados em paralelo enquanto
+`--lentos` clientes enviam uploads em ritmo de rede móvel.
+
+    python benchmark_comercial.py partida --orcamento-ms 800
+
+`partida` mede, num interpretador novo, o import do módulo, o
+create_app() e o primeiro request; falha se passar do orçamento ou se o
+import criar arquivos.
+
+    python benchmark_comercial.py busca --linhas 1000000 --casais 10000
+
+`busca` monta um banco temporário com N tarefas e compara a busca FTS5
+(por casal, com prefixo) com um LIKE '%termo%' equivalente.
+
+    python benchmark_comercial.py log --processos 4 --registros 20000
+
+`log` faz vários processos escreverem no mesmo log de segurança, com o
+RotatingFileHandler antigo e com a fila + rotação com trava, e compara a
+latência por registro e as linhas perdidas ou corrompidas.
+
+    python benchmark_comercial.py shards --shards 4 --processos 4 --duracao 10
+
+`shards` grava tarefas (um commit por tarefa) de vários processos ao mesmo
+tempo, primeiro com um banco só e depois com N shards, e compara os
+commits/s. Com shards cada processo escreve em um arquivo diferente, então
+o ganho aparece quando há núcleos livres para os processos.
+
+    python benchmark_comercial.py paginas --tarefas 50
+
+`paginas` renderiza as páginas do app num banco temporário e mostra os
+bytes de cada uma: HTML original, minificado, com gzip e com brotli (se
+instalado), mais as folhas de estilo comuns, baixadas uma vez e depois
+servidas do cache do navegador.
+
+    python benchmark_comercial.py templates --rodadas 5
+
+`templates` mede, num interpretador novo, o primeiro render de cada página
+em três situações: sem cache (compila tudo), com o cache de bytecode em
+disco já preenchido e depois do aquecimento do boot (aquecer_templates).
+
+    python benchmark_comercial.py imagens --mutacoes 20000 --pasta /tmp/corpus
+
+`imagens` monta um corpus de imagens válidas (JPEG, PNG, GIF, WebP), bombas
+de descompressão (dimensões enormes em arquivos minúsculos) e arquivos
+disfarçados, mais N mutações aleatórias delas, e passa tudo pelo
+ler_cabecalho_imagem: falha se algo levantar outra exceção que não
+ImagemInvalida, se uma bomba passar ou se uma válida for recusada. Mostra
+os bytes lidos e o tempo por arquivo. Com --pasta grava o corpus em disco
+(para fuzzers externos); --fotos acrescenta fotos reais ao corpus.
+=================================================================
+"""
+
+import argparse
+import http.client
+import json
+import os
+import shutil
+import subprocess
+import statistics
+import sys
+import threading
+import time
+from urllib.parse import urlsplit
+
+ARQUIVO_COOKIE = '.bench_cookie'
+PAGINAS = ['/dashboard', '/tarefas', '/historico/conclusoes', '/historico/resgates', '/loja']
+
+
+def semear(args):
+    """Cria um casal de teste e salva um cookie de sessão válido"""
+    from flask import session
+    from flask_wtf.csrf import generate_csrf
+    from app_comercial import create_app, db, init_db, Usuario, Casal, Tarefa
+
+    app = create_app()
+    with app.app_context():
+        init_db()
+        casal = Casal(codigo=Casal.gerar_codigo())
+        db.session.add(casal)
+        db.session.flush()
+        usuarios = []
+        for nome in ('Bench A', 'Bench B'):
+            usuario = Usuario(
+                nome=nome,
+                username=f"{nome.replace(' ', '_').lower()}_{casal.id}",
+                email=f"{nome.replace(' ', '').lower()}{casal.id}@bench.local",
+                senha_hash='-',
+                casal_id=casal.id
+            )
+            db.session.add(usuario)
+            usuarios.append(usuario)
+        db.session.flush()
+        a, b = usuarios
+        casal.parceiro_a_id, casal.parceiro_b_id = a.id, b.id
+        db.session.execute(db.insert(Tarefa), [{
+            'titulo': f'Tarefa {i}',
+            'descricao': 'Criada pelo benchmark',
+            'pontos': 10,
+            'casal_id': casal.id,
+            'usuario_id': a.id if i % 2 else b.id,
+            'criado_por_id': b.id if i % 2 else a.id,
+            'concluida': i % 3 == 0
+        } for i in range(args.tarefas)])
+        db.session.commit()
+
+        casal_id = casal.id
+        usuario_id = a.id
+
+    # Sessão assinada com o token CSRF, para os POSTs passarem pela validação
+    with app.test_request_context():
+        session['usuario_id'] = usuario_id
+        token = generate_csrf()
+        serializer = app.session_interface.get_signing_serializer(app)
+        cookie = f"session={serializer.dumps(dict(session))}"
+
+    with open(ARQUIVO_COOKIE, 'w') as f:
+        f.write(f'{cookie}\n{token}\n')
+    print(f'[OK] Casal {casal_id} com {args.tarefas} tarefas; cookie em {ARQUIVO_COOKIE}')
+
+
+def conectar(url):
+    partes = urlsplit(url)
+    return http.client.HTTPConnection(partes.hostname, partes.port or 80, timeout=120)
+
+
+def cliente_rapido(url, cookie, fim, latencias, erros):
+    """Faz GETs em sequência numa conexão keep-alive até o fim do teste"""
+    conn = conectar(url)
+    i = 0
+    while not fim.is_set():
+        caminho = PAGINAS[i % len(PAGINAS)]
+        i += 1
+        inicio = time.perf_counter()
+        try:
+            conn.request('GET', caminho, headers={'Cookie': cookie})
+            resposta = conn.getresponse()
+            resposta.read()
+            if resposta.status != 200:
+                erros.append(resposta.status)
+                continue
+        except (OSError, http.client.HTTPException) as e:
+            erros.append(type(e).__name__)
+            conn.close()
+            conn = conectar(url)
+            continue
+        latencias.append(time.perf_counter() - inicio)
+    conn.close()
+
+
+def cliente_lento(url, cookie, token, fim, tamanho, velocidade):
+    """Envia um upload multipart em pedaços, simulando uma rede móvel lenta"""
+    fronteira = 'benchfronteira'
+    cabecalho = (f'--{fronteira}\r\nContent-Disposition: form-data; name="csrf_token"\r\n\r\n{token}\r\n'
+                 f'--{fronteira}\r\nContent-Disposition: form-data; name="titulo"\r\n\r\nBench\r\n'
+                 f'--{fronteira}\r\nContent-Disposition: form-data; name="foto"; '
+                 f'filename="foto.jpg"\r\nContent-Type: image/jpeg\r\n\r\n').encode()
+    rodape = f'\r\n--{fronteira}--\r\n'.encode()
+    corpo = cabecalho + b'\xff\xd8\xff' + b'0' * (tamanho - 3) + rodape
+    pedaco = max(1, velocidade // 10)
+    while not fim.is_set():
+        conn = conectar(url)
+        try:
+            conn.putrequest('POST', '/recompensa/sugerir')
+            conn.putheader('Cookie', cookie)
+            conn.putheader('Content-Type', f'multipart/form-data; boundary={fronteira}')
+            conn.putheader('Content-Length', str(len(corpo)))
+            conn.endheaders()
+            for i in range(0, len(corpo), pedaco):
+                if fim.is_set():
+                    break
+                conn.send(corpo[i:i + pedaco])
+                time.sleep(0.1)
+            else:
+                conn.getresponse().read()
+        except (OSError, http.client.HTTPException):
+            pass
+        finally:
+            conn.close()
+
+
+def carga(args):
+    """Mede vazão e latência dos GETs com clientes lentos em paralelo"""
+    with open(args.cookie) as f:
+        cookie, token = f.read().split()
+
+    fim = threading.Event()
+    latencias, erros = [], []
+    threads = [threading.Thread(target=cliente_lento, args=(args.url, cookie, token, fim, args.tamanho_upload, args.velocidade))
+               for _ in range(args.lentos)]
+    threads += [threading.Thread(target=cliente_rapido, args=(args.url, cookie, fim, latencias, erros))
+                for _ in range(args.concorrencia)]
+    for t in threads:
+        t.daemon = True
+        t.start()
+    time.sleep(args.duracao)
+    fim.set()
+    for t in threads:
+        t.join(timeout=5)
+
+    if not latencias:
+        print(f'Nenhuma resposta 200 ({len(erros)} erros)')
+        return 1
+    latencias.sort()
+    p = lambda q: latencias[min(len(latencias) - 1, int(len(latencias) * q))] * 1000
+    print(f'requisições: {len(latencias)}  erros: {len(erros)}')
+    print(f'vazão: {len(latencias) / args.duracao:.1f} req/s')
+    print(f'latência ms: p50 {p(0.5):.1f}  p95 {p(0.95):.1f}  p99 {p(0.99):.1f}  '
+          f'média {statistics.mean(latencias) * 1000:.1f}')
+    return 0
+
+
+# Executado num interpretador novo, dentro de uma pasta vazia
+SCRIPT_PARTIDA = """
+import json, os, sys, time
+t0 = time.perf_counter()
+import app_comercial
+t1 = time.perf_counter()
+criados_no_import = sorted(os.listdir('.'))
+app = app_comercial.create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite://'})
+t2 = time.perf_counter()
+resposta = app.test_client().get('/login')
+t3 = time.perf_counter()
+print(json.dumps({
+    'import_ms': (t1 - t0) * 1000,
+    'create_app_ms': (t2 - t1) * 1000,
+    'primeiro_request_ms': (t3 - t2) * 1000,
+    'status': resposta.status_code,
+    'criados_no_import': criados_no_import,
+}))
+"""
+
+
+# Executado num interpretador novo: primeiro e segundo render de cada página
+SCRIPT_TEMPLATES = """
+import json, os, sys, time
+import app_comercial as m
+modo, cache = sys.argv[1], sys.argv[2]
+app = m.create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.abspath('templates.db'),
+                    'RATELIMIT_ENABLED': False, 'TEMPLATE_BYTECODE_CACHE': modo != 'sem_cache', 'TEMPLATE_CACHE_DIR': cache})
+with app.app_context():
+    m.init_db()
+    casal = m.Casal(codigo=m.Casal.gerar_codigo())
+    m.db.session.add(casal)
+    m.db.session.flush()
+    a, b = (m.Usuario(nome=n, username=n.lower(), email=n.lower() + '@bench.local', senha_hash='-',
+                      casal_id=casal.id) for n in ('Ana', 'Beto'))
+    m.db.session.add_all([a, b])
+    m.db.session.flush()
+    casal.parceiro_a_id, casal.parceiro_b_id = a.id, b.id
+    for i in range(30):
+        m.db.session.add(m.Tarefa(titulo=f'Tarefa {i}', pontos=10, casal_id=casal.id, usuario_id=a.id,
+                                  criado_por_id=b.id, recorrente=i % 2 == 0, frequencia='semanal'))
+    m.db.session.commit()
+    usuario_id = a.id
+cliente = app.test_client()
+with cliente.session_transaction() as sessao:
+    sessao['usuario_id'] = usuario_id
+aquecimento = 0
+if modo == 'aquecido':
+    inicio = time.perf_counter()
+    m.aquecer_templates(app)
+    aquecimento = (time.perf_counter() - inicio) * 1000
+tempos = {}
+for caminho in PAGINAS:
+    medidas = []
+    for _ in range(2):
+        inicio = time.perf_counter()
+        assert cliente.get(caminho).status_code == 200, caminho
+        medidas.append((time.perf_counter() - inicio) * 1000)
+    tempos[caminho] = medidas
+print(json.dumps({'aquecimento_ms': aquecimento, 'tempos': tempos}))
+"""
+
+
+def templates(args):
+    """Primeiro render das páginas: sem cache x bytecode em disco x aquecido no boot"""
+    import tempfile
+
+    raiz = os.path.dirname(os.path.abspath(__file__))
+    ambiente = dict(os.environ, PYTHONPATH=raiz, PYTHONDONTWRITEBYTECODE='1')
+    script = f'PAGINAS = {PAGINAS!r}\n' + SCRIPT_TEMPLATES
+    with tempfile.TemporaryDirectory() as cache:
+        # Preenche o cache em disco, como o `flask templates-aquecer` do deploy
+        with tempfile.TemporaryDirectory() as pasta:
+            subprocess.run([sys.executable, '-c', script, 'bytecode', cache], cwd=pasta, env=ambiente,
+                           capture_output=True, check=True)
+        for modo in ('sem_cache', 'bytecode', 'aquecido'):
+            rodadas = []
+            for _ in range(args.rodadas):
+                with tempfile.TemporaryDirectory() as pasta:
+                    saida = subprocess.run([sys.executable, '-c', script, modo, cache], cwd=pasta,
+                                           env=ambiente, capture_output=True, text=True, check=True)
+                    rodadas.append(json.loads(saida.stdout.strip().splitlines()[-1]))
+            primeiro = statistics.median(sum(t[0] for t in r['tempos'].values()) for r in rodadas)
+            segundo = statistics.median(sum(t[1] for t in r['tempos'].values()) for r in rodadas)
+            aquecimento = statistics.median(r['aquecimento_ms'] for r in rodadas)
+            print(f'{modo:<10} 1º render das {len(PAGINAS)} páginas: {primeiro:6.1f} ms  '
+                  f'2º render: {segundo:6.1f} ms  aquecimento no boot: {aquecimento:5.1f} ms')
+    return 0
+
+
+def partida(args):
+    """Mede import, create_app e primeiro request (mediana de N rodadas)"""
+    import tempfile
+
+    raiz = os.path.dirname(os.path.abspath(__file__))
+    rodadas = []
+    for _ in range(args.rodadas):
+        with tempfile.TemporaryDirectory() as pasta:
+            ambiente = dict(os.environ, PYTHONPATH=raiz, PYTHONDONTWRITEBYTECODE='1',
+                            SECURITY_LOG_PATH=os.path.join(pasta, 'logs', 'security.log'))
+            saida = subprocess.run([sys.executable, '-c', SCRIPT_PARTIDA], cwd=pasta, env=ambiente,
+                                   capture_output=True, text=True, check=True)
+            rodadas.append(json.loads(saida.stdout.strip().splitlines()[-1]))
+
+    mediana = {chave: statistics.median(r[chave] for r in rodadas)
+               for chave in ('import_ms', 'create_app_ms', 'primeiro_request_ms')}
+    total = sum(mediana.values())
+    for chave, valor in mediana.items():
+        print(f'{chave}: {valor:.1f}')
+    print(f'total_ms: {total:.1f} (orçamento {args.orcamento_ms})')
+
+    criados = rodadas[-1]['criados_no_import']
+    if criados:
+        print(f'ERRO: o import criou {criados}')
+        return 1
+    if rodadas[-1]['status'] != 200:
+        print(f"ERRO: primeiro request retornou {rodadas[-1]['status']}")
+        return 1
+    if total > args.orcamento_ms:
+        print('ERRO: acima do orçamento')
+        return 1
+    return 0
+
+
+PALAVRAS = ('lavar louça roupa passear cachorro gato regar plantas limpar banheiro cozinha '
+            'fazer compras mercado jantar almoço café pagar contas arrumar cama trocar lençóis '
+            'aspirar sala tirar lixo reciclável lavagem carro consertar torneira chuveiro '
+            'preparar marmita buscar crianças escola farmácia remédio organizar armário '
+            'passar ferro varrer quintal janela geladeira fogão micro-ondas maçã pão feijão').split()
+
+
+def medir(funcao, repeticoes):
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        funcao()
+        tempos.append((time.perf_counter() - inicio) * 1000)
+    tempos.sort()
+    return tempos[len(tempos) // 2], tempos[int(len(tempos) * 0.95)]
+
+
+def busca(args):
+    """Compara busca FTS5 com LIKE num banco temporário de N tarefas"""
+    import random
+    import tempfile
+    from datetime import datetime
+    from app_comercial import create_app, db, init_db, buscar, Tarefa
+
+    pasta = tempfile.mkdtemp()
+    app = create_app({'SQLALCHEMY_DATABASE_URI': f"sqlite:///{os.path.join(pasta, 'busca.db')}"})
+    aleatorio = random.Random(42)
+    with app.app_context():
+        init_db()
+        inicio = time.perf_counter()
+        agora = datetime.now()
+        for base in range(0, args.linhas, 10000):
+            db.session.execute(db.insert(Tarefa), [{
+                'titulo': ' '.join(aleatorio.sample(PALAVRAS, 3)).capitalize(),
+                'descricao': ' '.join(aleatorio.sample(PALAVRAS, 8)),
+                'pontos': 10,
+                'casal_id': aleatorio.randrange(1, args.casais + 1),
+                'data_criacao': agora,
+            } for _ in range(min(10000, args.linhas - base))])
+            db.session.commit()
+        duracao = time.perf_counter() - inicio
+        print(f'inserção com triggers: {args.linhas / duracao:.0f} linhas/s '
+              f'({os.path.getsize(os.path.join(pasta, "busca.db")) / 1024 / 1024:.0f} MB)')
+
+        termos = ['louca', 'lav', 'cachorro pass', 'maca', 'contas pagar', 'ferr']
+        casais = [aleatorio.randrange(1, args.casais + 1) for _ in range(args.consultas)]
+
+        def consultar_fts():
+            for casal_id in casais:
+                buscar(casal_id, aleatorio.choice(termos))
+
+        def consultar_like():
+            for casal_id in casais:
+                termo = f'%{aleatorio.choice(termos).split()[0]}%'
+                db.session.execute(db.select(Tarefa.id).where(
+                    Tarefa.casal_id == casal_id,
+                    db.or_(Tarefa.titulo.like(termo), Tarefa.descricao.like(termo))
+                ).limit(20)).all()
+
+        for nome, funcao in (('FTS5', consultar_fts), ('LIKE', consultar_like)):
+            p50, p95 = medir(funcao, 5)
+            print(f'{nome}: {args.consultas} consultas -> p50 {p50 / args.consultas:.2f} ms/consulta '
+                  f'(p95 do lote {p95:.0f} ms)')
+
+        inicio = time.perf_counter()
+        with db.engine.begin() as conexao:
+            from app_comercial import reconstruir_indice_busca
+            reconstruir_indice_busca(conexao)
+        print(f'reconstrução do índice: {time.perf_counter() - inicio:.1f}s')
+    shutil.rmtree(pasta, ignore_errors=True)
+    return 0
+
+
+def escrever_log(modo, caminho, registros, max_bytes, saida):
+    """Processo filho do benchmark `log`"""
+    import logging
+    from logging.handlers import RotatingFileHandler
+    from app_comercial import ArquivoLogRotativo, FilaLog, FormatadorJSON
+
+    if modo == 'sincrono':
+        handler = RotatingFileHandler(caminho, maxBytes=max_bytes, backupCount=1000, encoding='utf-8')
+        handler.setFormatter(FormatadorJSON())
+    else:
+        arquivo = ArquivoLogRotativo(caminho, max_bytes=max_bytes, backups=1000)
+        arquivo.setFormatter(FormatadorJSON())
+        handler = FilaLog(arquivo)
+    logging.raiseExceptions = False  # o handler antigo falha na rotação concorrente; só contamos as perdas
+    logger = logging.getLogger(f'bench-{modo}')
+    logger.propagate = False
+    logger.addHandler(handler)
+
+    tempos = []
+    dados = {'ip': '203.0.113.7', 'metodo': 'POST', 'rota': '/login', 'usuario_id': None,
+             'ua': 'Mozilla/5.0 (X11; Linux x86_64) bench', 'username': 'ana', 'motivo': 'senha_incorreta'}
+    for i in range(registros):
+        inicio = time.perf_counter()
+        logger.warning('login_falhou', extra={'dados': {**dados, 'i': i}})
+        tempos.append((time.perf_counter() - inicio) * 1e6)
+    if modo == 'fila':
+        handler.parar()
+    tempos.sort()
+    saida.put((tempos[len(tempos) // 2], tempos[int(len(tempos) * 0.99)],
+               getattr(handler, 'descartados', 0)))
+
+
+def log(args):
+    """Latência por registro e integridade do log com vários processos escrevendo"""
+    import glob
+    import multiprocessing
+    import tempfile
+
+    for modo in ('sincrono', 'fila'):
+        pasta = tempfile.mkdtemp()
+        caminho = os.path.join(pasta, 'security.log')
+        saida = multiprocessing.Queue()
+        processos = [
+            multiprocessing.Process(target=escrever_log,
+                                    args=(modo, caminho, args.registros, args.max_bytes, saida))
+            for _ in range(args.processos)
+        ]
+        for processo in processos:
+            processo.start()
+        resultados = [saida.get() for _ in processos]
+        for processo in processos:
+            processo.join()
+
+        validas = corrompidas = 0
+        for arquivo in glob.glob(caminho + '*'):
+            if arquivo.endswith('.lock'):
+                continue
+            with open(arquivo, encoding='utf-8', errors='replace') as entrada:
+                for linha in entrada:
+                    try:
+                        json.loads(linha)
+                        validas += 1
+                    except ValueError:
+                        corrompidas += 1
+        esperadas = args.processos * args.registros
+        descartadas = sum(r[2] for r in resultados)
+        print(f'{modo}: p50 {statistics.median(r[0] for r in resultados):.1f} us, '
+              f'p99 {max(r[1] for r in resultados):.1f} us por registro | '
+              f'{validas}/{esperadas} linhas válidas, {corrompidas} corrompidas, '
+              f'{esperadas - validas - descartadas} perdidas, {descartadas} descartadas pela fila')
+        shutil.rmtree(pasta, ignore_errors=True)
+    return 0
+
+
+def escrever_tarefas(config, casal_ids, duracao, saida):
+    """Processo filho do benchmark `shards`: um commit por tarefa até o prazo"""
+    from app_comercial import create_app, db, rotear_shard, shard_do_casal, Tarefa
+
+    app = create_app(config)
+    tempos = []
+    with app.app_context():
+        shards = {casal_id: shard_do_casal(casal_id) for casal_id in casal_ids}
+        fim = time.perf_counter() + duracao
+        i = 0
+        while time.perf_counter() < fim:
+            casal_id = casal_ids[i % len(casal_ids)]
+            i += 1
+            inicio = time.perf_counter()
+            rotear_shard(shards[casal_id])
+            db.session.add(Tarefa(titulo=f'Tarefa {i}', pontos=10, casal_id=casal_id))
+            db.session.commit()
+            tempos.append((time.perf_counter() - inicio) * 1000)
+    tempos.sort()
+    saida.put((len(tempos), tempos[int(len(tempos) * 0.99)] if tempos else 0))
+
+
+def shards(args):
+    """Commits/s de escritas concorrentes com 1 banco e com N shards"""
+    import multiprocessing
+    import tempfile
+    from app_comercial import create_app, db, init_db, escolher_shard, Casal
+
+    for total in sorted({1, args.shards}):
+        pasta = tempfile.mkdtemp()
+        config = {'SQLALCHEMY_DATABASE_URI': f"sqlite:///{os.path.join(pasta, 'shards.db')}",
+                  'SHARDS': total, 'RATELIMIT_ENABLED': False}
+        app = create_app(config)
+        with app.app_context():
+            init_db()
+            casais = [Casal(codigo=f'B{i:05d}') for i in range(args.processos * total)]
+            db.session.add_all(casais)
+            db.session.flush()
+            for casal in casais:
+                casal.shard = escolher_shard(casal.id)
+            db.session.commit()
+            # Cada processo fica com os casais de um shard (com 1 shard, todos no mesmo arquivo)
+            grupos = [[c.id for c in casais if (c.shard or 0) == p % total] for p in range(args.processos)]
+            db.engine.dispose()
+
+        saida = multiprocessing.Queue()
+        processos = [multiprocessing.Process(target=escrever_tarefas, args=(config, grupo, args.duracao, saida))
+                     for grupo in grupos]
+        for processo in processos:
+            processo.start()
+        resultados = [saida.get() for _ in processos]
+        for processo in processos:
+            processo.join()
+        commits = sum(r[0] for r in resultados)
+        print(f'{total} shard(s), {args.processos} processos: {commits / args.duracao:.0f} commits/s, '
+              f'p99 {max(r[1] for r in resultados):.1f} ms por commit')
+        shutil.rmtree(pasta, ignore_errors=True)
+    return 0
+
+
+def paginas(args):
+    """Bytes por página: original x minificado x gzip x brotli"""
+    import re
+    import tempfile
+    from app_comercial import create_app, db, init_db, brotli, Casal, Tarefa, Usuario
+
+    pasta = tempfile.mkdtemp()
+    app = create_app({'SQLALCHEMY_DATABASE_URI': f"sqlite:///{os.path.join(pasta, 'paginas.db')}",
+                      'RATELIMIT_ENABLED': False})
+    with app.app_context():
+        init_db()
+        casal = Casal(codigo=Casal.gerar_codigo())
+        db.session.add(casal)
+        db.session.flush()
+        a, b = (Usuario(nome=nome, username=nome.lower(), email=f'{nome.lower()}@bench.local',
+                        senha_hash='-', casal_id=casal.id) for nome in ('Ana', 'Beto'))
+        db.session.add_all([a, b])
+        db.session.flush()
+        casal.parceiro_a_id, casal.parceiro_b_id = a.id, b.id
+        for i in range(args.tarefas):
+            db.session.add(Tarefa(titulo=f'Tarefa {i}', descricao='Criada pelo benchmark', pontos=10,
+                                  casal_id=casal.id, usuario_id=(a if i % 2 else b).id,
+                                  criado_por_id=(b if i % 2 else a).id, concluida=i % 3 == 0))
+        db.session.commit()
+        usuario_id = a.id
+
+    cliente = app.test_client()
+    with cliente.session_transaction() as sessao:
+        sessao['usuario_id'] = usuario_id
+    codificacoes = ['gzip'] + (['br'] if brotli is not None else [])
+
+    def baixar(caminho, codificacao=None):
+        resposta = cliente.get(caminho, headers={'Accept-Encoding': codificacao} if codificacao else {})
+        return resposta.get_data()
+
+    print(f"{'página':<24}{'original':>10}{'minificado':>12}" + ''.join(f'{c:>10}' for c in codificacoes))
+    folhas = set()
+    for caminho in PAGINAS + ['/aprovacoes', '/login']:
+        app.config['MINIFICAR_HTML'] = False
+        original = baixar(caminho)
+        app.config['MINIFICAR_HTML'] = True
+        minificado = baixar(caminho)
+        folhas.update(re.findall(rb'href="(/static/[^"]+\.css\?v=[^"]+)"', minificado))
+        print(f'{caminho:<24}{len(original):>10}{len(minificado):>12}'
+              + ''.join(f'{len(baixar(caminho, c)):>10}' for c in codificacoes))
+    for folha in sorted(folhas):
+        folha = folha.decode()
+        print(f"{folha.split('?')[0]:<24}{len(baixar(folha)):>10}{'':>12}"
+              + ''.join(f'{len(baixar(folha, c)):>10}' for c in codificacoes)
+              + '  (uma vez; depois cache de 1 ano)')
+    shutil.rmtree(pasta, ignore_errors=True)
+    return 0
+
+
+def corpus_imagens():
+    """{nome: (bytes, deve_passar)} com arquivos gerados sem depender do Pillow"""
+    import struct
+    import zlib
+
+    def png(largura, altura, idat=True):
+        def chunk(tipo, dados):
+            return struct.pack('>I', len(dados)) + tipo + dados + struct.pack('>I', zlib.crc32(tipo + dados))
+        linhas = (b'\x00' + b'\xff\x80\x00' * largura) * altura if idat else b''
+        return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', largura, altura, 8, 2, 0, 0, 0))
+                + chunk(b'IDAT', zlib.compress(linhas)) + chunk(b'IEND', b''))
+
+    def jpeg(largura, altura, app1=0):
+        segmento = lambda marcador, dados: b'\xff' + marcador + struct.pack('>H', len(dados) + 2) + dados
+        return (b'\xff\xd8' + segmento(b'\xe0', b'JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00')
+                + (segmento(b'\xe1', b'Exif\x00\x00' + b'\x00' * app1) if app1 else b'')
+                + segmento(b'\xdb', b'\x00' + bytes(range(1, 65)))
+                + b'\xff\xff' + segmento(b'\xc0', struct.pack('>BHHB', 8, altura, largura, 1) + b'\x01\x11\x00')
+                + segmento(b'\xda', b'\x01\x01\x00\x00\x3f\x00') + b'\x00' * 64 + b'\xff\xd9')
+
+    def gif(largura, altura, quadros=1, tela=None):
+        tela = tela or (largura, altura)
+        quadro = (b'!\xf9\x04\x04\x0a\x00\x00\x00' + b',' + struct.pack('<HHHHB', 0, 0, largura, altura, 0)
+                  + b'\x02\x02\x44\x01\x00')
+        return (b'GIF89a' + struct.pack('<HHBBB', *tela, 0x80, 0, 0) + b'\x00\x00\x00\xff\xff\xff'
+                + quadro * quadros + b';')
+
+    def webp(tipo, largura, altura):
+        if tipo == b'VP8 ':
+            dados = b'\x50\x02\x00\x9d\x01\x2a' + struct.pack('<HH', largura, altura) + b'\x00' * 8
+        elif tipo == b'VP8L':
+            dados = b'\x2f' + ((largura - 1) | (altura - 1) << 14).to_bytes(4, 'little') + b'\x00' * 8
+        else:
+            dados = (b'\x10\x00\x00\x00' + (largura - 1).to_bytes(3, 'little')
+                     + (altura - 1).to_bytes(3, 'little'))
+        corpo = b'WEBP' + tipo + struct.pack('<I', len(dados)) + dados
+        return b'RIFF' + struct.pack('<I', len(corpo)) + corpo
+
+    return {
+        'valida.png': (png(64, 48), True),
+        'valida.jpg': (jpeg(4032, 3024), True),
+        'valida-exif.jpg': (jpeg(1920, 1080, app1=60000), True),
+        'valida.gif': (gif(32, 32), True),
+        'animada.gif': (gif(32, 32, quadros=50), True),
+        'valida-vp8.webp': (webp(b'VP8 ', 800, 600), True),
+        'valida-vp8l.webp': (webp(b'VP8L', 800, 600), True),
+        'valida-vp8x.webp': (webp(b'VP8X', 800, 600), True),
+        'bomba.png': (png(100000, 100000, idat=False), False),
+        'bomba-pixels.png': (png(11000, 11000, idat=False), False),
+        'bomba.jpg': (jpeg(65500, 65500), False),
+        'bomba-tela.gif': (gif(1, 1, tela=(65535, 65535)), False),
+        'bomba-quadro.gif': (gif(60000, 60000), False),
+        'bomba-quadros.gif': (gif(32, 32, quadros=5000), False),
+        'bomba.webp': (webp(b'VP8X', 16384, 16384), False),
+        'zero.png': (png(0, 10, idat=False), False),
+        'riff.wav': (b'RIFF\x24\x00\x00\x00WAVEfmt ' + b'\x00' * 28, False),
+        'heic.heic': (b'\x00\x00\x00 ftypheic' + b'\x00' * 24, False),
+        'texto.png': (b'<?php echo 1; ?>' * 4, False),
+        'so-magica.jpg': (b'\xff\xd8\xff', False),
+        'preenchimento.jpg': (b'\xff\xd8' + b'\xff' * 100000, False),
+        'vazio.gif': (b'', False),
+    }
+
+
+class FluxoContado:
+    """BytesIO que soma os bytes lidos (para conferir que só os cabeçalhos são lidos)"""
+
+    def __init__(self, dados):
+        import io
+        self.fluxo = io.BytesIO(dados)
+        self.lidos = 0
+
+    def read(self, n=-1):
+        dados = self.fluxo.read(n)
+        self.lidos += len(dados)
+        return dados
+
+    def seek(self, *args):
+        return self.fluxo.seek(*args)
+
+    def tell(self):
+        return self.fluxo.tell()
+
+
+def mutar_imagem(aleatorio, dados):
+    """Troca, apaga, insere e corta bytes (de preferência nos cabeçalhos) de uma amostra"""
+    dados = bytearray(dados)
+    for _ in range(aleatorio.randint(1, 8)):
+        posicao = aleatorio.randrange(min(len(dados), 64) or 1) if aleatorio.random() < 0.7 \
+            else aleatorio.randrange(len(dados) or 1)
+        operacao = aleatorio.random()
+        if operacao < 0.5 and dados:
+            dados[posicao] = aleatorio.randrange(256)
+        elif operacao < 0.7:
+            del dados[posicao:posicao + aleatorio.randint(1, 16)]
+        elif operacao < 0.9:
+            dados[posicao:posicao] = bytes(aleatorio.randrange(256) for _ in range(aleatorio.randint(1, 16)))
+        else:
+            del dados[posicao:]
+    return bytes(dados)
+
+
+def imagens(args):
+    """Fuzz + benchmark do validador de imagens (ler_cabecalho_imagem)"""
+    import random
+    from app_comercial import ImagemInvalida, ler_cabecalho_imagem
+
+    corpus = corpus_imagens()
+    if args.fotos:
+        for nome in sorted(os.listdir(args.fotos)):
+            with open(os.path.join(args.fotos, nome), 'rb') as arquivo:
+                corpus[f'foto-{nome}'] = (arquivo.read(), True)
+    if args.pasta:
+        os.makedirs(args.pasta, exist_ok=True)
+        for nome, (dados, _passa) in corpus.items():
+            with open(os.path.join(args.pasta, nome), 'wb') as arquivo:
+                arquivo.write(dados)
+
+    def validar(dados):
+        fluxo = FluxoContado(dados)
+        try:
+            resultado = ler_cabecalho_imagem(fluxo)
+        except ImagemInvalida:
+            resultado = None
+        if fluxo.tell() != 0:
+            raise AssertionError('ponteiro não voltou ao início')
+        return resultado, fluxo.lidos
+
+    falhas = 0
+    print(f"{'arquivo':<22}{'bytes':>9}{'lidos':>8}{'µs':>8}  resultado")
+    for nome, (dados, deve_passar) in corpus.items():
+        resultado, lidos = validar(dados)
+        inicio = time.perf_counter()
+        for _ in range(args.repeticoes):
+            validar(dados)
+        micros = (time.perf_counter() - inicio) / args.repeticoes * 1e6
+        ok = (resultado is not None) == deve_passar
+        falhas += not ok
+        print(f"{nome:<22}{len(dados):>9}{lidos:>8}{micros:>8.1f}  "
+              f"{resultado or 'recusada'}{'' if ok else '  <-- ERRADO'}")
+
+    # Mutações: troca, apaga, insere e corta bytes das amostras
+    aleatorio = random.Random(args.semente)
+    sementes = [dados for dados, _passa in corpus.values() if 0 < len(dados) <= 200000]
+    aceitas = 0
+    inicio = time.perf_counter()
+    for i in range(args.mutacoes):
+        dados = mutar_imagem(aleatorio, aleatorio.choice(sementes))
+        try:
+            resultado, _lidos = validar(dados)
+        except Exception as erro:  # qualquer coisa além de ImagemInvalida é bug
+            falhas += 1
+            print(f'mutação {i}: {type(erro).__name__}: {erro} (entrada {dados[:32]!r}...)')
+            continue
+        if resultado:
+            aceitas += 1
+            _formato, largura, altura = resultado
+            if largura * altura > 50_000_000:
+                falhas += 1
+                print(f'mutação {i}: aceitou {largura}x{altura}')
+    duracao = time.perf_counter() - inicio
+    print(f'{args.mutacoes} mutações em {duracao:.1f}s ({duracao / max(args.mutacoes, 1) * 1e6:.0f} µs cada), '
+          f'{aceitas} ainda válidas, {falhas} falhas')
+    return 1 if falhas else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark do Nosso App')
+    sub = parser.add_subparsers(dest='comando', required=True)
+
+    p_semear = sub.add_parser('semear', help='Cria dados de teste (usa DATABASE_PATH)')
+    p_semear.add_argument('--tarefas', type=int, default=50)
+    p_semear.set_defaults(func=semear)
+
+    p_carga = sub.add_parser('carga', help='Teste de carga contra um servidor rodando')
+    p_carga.add_argument('--url', default='http://127.0.0.1:8000')
+    p_carga.add_argument('--cookie', default=ARQUIVO_COOKIE)
+    p_carga.add_argument('--concorrencia', type=int, default=16)
+    p_carga.add_argument('--duracao', type=float, default=10)
+    p_carga.add_argument('--lentos', type=int, default=0, help='Clientes enviando uploads lentos')
+    p_carga.add_argument('--tamanho-upload', type=int, default=2 * 1024 * 1024)
+    p_carga.add_argument('--velocidade', type=int, default=256 * 1024, help='Bytes/s de cada cliente lento')
+    p_carga.set_defaults(func=carga)
+
+    p_partida = sub.add_parser('partida', help='Tempo de import/boot/primeiro request')
+    p_partida.add_argument('--rodadas', type=int, default=5)
+    p_partida.add_argument('--orcamento-ms', type=float, default=1000)
+    p_partida.set_defaults(func=partida)
+
+    p_templates = sub.add_parser('templates', help='1º render: sem cache x bytecode x aquecido')
+    p_templates.add_argument('--rodadas', type=int, default=5)
+    p_templates.set_defaults(func=templates)
+
+    p_imagens = sub.add_parser('imagens', help='Fuzz + benchmark do validador de imagens')
+    p_imagens.add_argument('--mutacoes', type=int, default=20000)
+    p_imagens.add_argument('--repeticoes', type=int, default=200)
+    p_imagens.add_argument('--semente', type=int, default=42)
+    p_imagens.add_argument('--pasta', help='Grava o corpus nesta pasta')
+    p_imagens.add_argument('--fotos', help='Pasta com fotos reais para incluir no corpus')
+    p_imagens.set_defaults(func=imagens)
+
+    p_busca = sub.add_parser('busca', help='FTS5 x LIKE num banco temporário')
+    p_busca.add_argument('--linhas', type=int, default=1000000)
+    p_busca.add_argument('--casais', type=int, default=10000)
+    p_busca.add_argument('--consultas', type=int, default=50)
+    p_busca.set_defaults(func=busca)
+
+    p_log = sub.add_parser('log', help='Log de segurança com vários processos')
+    p_log.add_argument('--processos', type=int, default=4)
+    p_log.add_argument('--registros', type=int, default=20000)
+    p_log.add_argument('--max-bytes', type=int, default=1048576)
+    p_log.set_defaults(func=log)
+
+    p_shards = sub.add_parser('shards', help='Escritas concorrentes com 1 banco x N shards')
+    p_shards.add_argument('--shards', type=int, default=4)
+    p_shards.add_argument('--processos', type=int, default=4)
+    p_shards.add_argument('--duracao', type=float, default=10)
+    p_shards.set_defaults(func=shards)
+
+    p_paginas = sub.add_parser('paginas', help='Tamanho das páginas com minificação e compressão')
+    p_paginas.add_argument('--tarefas', type=int, default=50)
+    p_paginas.set_defaults(func=paginas)
+
+    args = parser.parse_args()
+    return args.func(args) or 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,78 @@
+"""
+=================================================================
+⚙️ Configuração do Gunicorn - Nosso App
+=================================================================
+Carregado automaticamente por `gunicorn app_comercial:app`.
+Todos os valores podem ser sobrescritos por variáveis de ambiente.
+
+Modos de worker (GUNICORN_WORKER_CLASS):
+- gthread (padrão): threads por worker; uploads lentos ocupam só uma thread
+- sync: um request por worker (comportamento antigo)
+- gevent: greenlets; requer `pip install gevent`
+=================================================================
+"""
+
+import multiprocessing
+import os
+
+bind = os.environ.get('GUNICORN_BIND', f"0.0.0.0:{os.environ.get('PORT', '8000')}")
+
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+
+# Plano free do Render: 512 MB -> 2 workers é o limite seguro de memória
+workers = int(os.environ.get('WEB_CONCURRENCY', min(2, multiprocessing.cpu_count())))
+
+# gthread: threads por worker. Com sync precisa ser 1, senão o gunicorn
+# troca silenciosamente para gthread.
+threads = int(os.environ.get('GUNICORN_THREADS', 8 if worker_class == 'gthread' else 1))
+
+# gevent: conexões simultâneas por worker
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 200))
+
+# Uploads de até 16 MB em redes móveis lentas precisam de folga
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+
+# Recicla workers periodicamente (limita crescimento de memória)
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 100))
+
+# preload compartilha o código importado entre workers (copy-on-write).
+# Com gevent o monkey patch precisa acontecer antes do import do app,
+# então o preload fica desligado nesse modo.
+preload_app = os.environ.get(
+    'GUNICORN_PRELOAD', '0' if worker_class == 'gevent' else '1'
+) == '1'
+
+accesslog = os.environ.get('GUNICORN_ACCESSLOG', '-')
+errorlog = '-'
+loglevel = os.environ.get('GUNICORN_LOGLEVEL', 'info')
+
+
+def post_fork(server, worker):
+    """Descarta conexões SQLite herdadas do processo master (preload_app)"""
+    if not preload_app:
+        return
+    from app_comercial import app, db
+    with app.app_context():
+        for engine in db.engines.values():  # banco principal e shards
+            engine.dispose(close=False)
+
+
+def when_ready(server):
+    """Carrega o índice de sugestões e os templates no master; os workers os herdam prontos"""
+    if not preload_app:
+        return
+    from app_comercial import app, aquecer_templates, indice_sugestoes
+    with app.app_context():
+        indice_sugestoes()
+    aquecer_templates(app)
+
+
+def post_worker_init(worker):
+    """Sem preload_app cada worker carrega os templates (do cache em disco) antes do 1º request"""
+    if preload_app:
+        return
+    from app_comercial import app, aquecer_templates
+    aquecer_templates(app)
@@ -0,0 +1,187 @@
+"""
+Fixtures dos testes de integração.
+
+Cada teste recebe um app novo (create_app) com bancos SQLite temporários
+próprios, então os testes rodam isolados e em paralelo:
+
+    pip install -r requirements-dev.txt
+    pytest -n auto
+
+Os bancos são arquivos (e não :memory:) para que requests simultâneos, em
+threads, usem conexões diferentes como em produção.
+"""
+
+import itertools
+import os
+import threading
+from contextlib import contextmanager
+
+import pytest
+
+from app_comercial import (Casal, Recompensa, Tarefa, Usuario, create_app, db, escolher_shard, init_db,
+                           rotear_shard)
+
+
+@pytest.fixture(scope='session', autouse=True)
+def pasta_de_trabalho(tmp_path_factory):
+    """Roda a sessão numa pasta temporária: nada com caminho relativo cai na árvore do repo"""
+    anterior = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp('trabalho'))
+    yield
+    os.chdir(anterior)
+
+
+def config_de_teste(tmp_path, **extras):
+    """Config com banco, analytics, log de segurança e uploads dentro de `tmp_path`"""
+    return {
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'app.db'}",
+        'ANALYTICS_DATABASE_PATH': str(tmp_path / 'analytics.db'),
+        'SECURITY_LOG_PATH': str(tmp_path / 'logs' / 'security.log'),
+        'UPLOAD_FOLDER': str(tmp_path / 'uploads'),
+        'SHARDS': 1,
+        'TESTING': True,
+        'WTF_CSRF_ENABLED': False,
+        'RATELIMIT_ENABLED': False,
+        'TEMPLATE_BYTECODE_CACHE': False,
+        'BLOQUEAR_LAZY_LOAD': True,
+        **extras,
+    }
+
+
+@contextmanager
+def app_pronto(config):
+    """create_app + init_db, com o app context ativo dentro do bloco"""
+    app = create_app(config)
+    with app.app_context():
+        init_db()
+        yield app
+        db.session.remove()
+        for engine in db.engines.values():
+            engine.dispose()
+
+
+@pytest.fixture
+def app(tmp_path):
+    """App com banco, analytics e uploads só deste teste; o app context fica ativo no teste"""
+    with app_pronto(config_de_teste(tmp_path)) as app:
+        yield app
+
+
+class Fabrica:
+    """Cria usuários, casais, tarefas e recompensas direto no banco do teste.
+
+    Os objetos devolvidos pertencem à sessão do teste; depois de um request,
+    use `db.session.expire_all()` (ou `recarregar`) antes de conferir valores.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.numeros = itertools.count(1)
+
+    def usuario(self, nome=None, senha='segredo'):
+        import bcrypt
+        numero = next(self.numeros)
+        usuario = Usuario(
+            nome=nome or f'Pessoa {numero}',
+            username=f'pessoa{numero}',
+            email=f'pessoa{numero}@teste.local',
+            senha_hash=bcrypt.hashpw(senha.encode(), bcrypt.gensalt(rounds=4)).decode(),
+        )
+        db.session.add(usuario)
+        db.session.commit()
+        return usuario
+
+    def casal(self, completo=True):
+        """(casal, a, b); com completo=False o casal só tem o membro A e b é None.
+
+        Com shards, a sessão do teste passa a apontar para o shard do casal
+        (como num request dele), então crie os casais de um teste em sequência.
+        """
+        a = self.usuario()
+        b = self.usuario() if completo else None
+        casal = Casal(codigo=Casal.gerar_codigo(), shard=escolher_shard(a.id))
+        db.session.add(casal)
+        db.session.flush()
+        casal.parceiro_a_id, a.casal_id = a.id, casal.id
+        if b:
+            casal.parceiro_b_id, b.casal_id = b.id, casal.id
+        db.session.commit()
+        rotear_shard(casal.shard or 0)
+        return casal, a, b
+
+    def tarefa(self, casal, para, de, pontos=10, concluida=False, **campos):
+        tarefa = Tarefa(titulo=campos.pop('titulo', f'Tarefa {next(self.numeros)}'), pontos=pontos,
+                        casal_id=casal.id, usuario_id=para.id, criado_por_id=de.id,
+                        concluida=concluida, **campos)
+        db.session.add(tarefa)
+        db.session.commit()
+        return tarefa
+
+    def pontos(self, casal, usuario, pontos):
+        """Dá pontos ao usuário com uma tarefa já concluída"""
+        parceiro = db.session.get(Usuario, casal.id_parceiro(usuario.id)) or usuario
+        return self.tarefa(casal, usuario, parceiro, pontos=pontos, concluida=True)
+
+    def recompensa(self, casal, para, de, custo=50, status='aprovada', **campos):
+        recompensa = Recompensa(titulo=campos.pop('titulo', f'Recompensa {next(self.numeros)}'),
+                                custo=custo, custo_sugerido=custo, casal_id=casal.id,
+                                usuario_id=para.id, criado_por_id=para.id,
+                                aprovado_por_id=de.id if status == 'aprovada' else None,
+                                status=status, **campos)
+        db.session.add(recompensa)
+        db.session.commit()
+        return recompensa
+
+
+@pytest.fixture
+def fabrica(app):
+    return Fabrica(app)
+
+
+@pytest.fixture
+def cliente(app):
+    """cliente(usuario) -> test client já logado como o usuário (None = anônimo)"""
+    def criar(usuario=None):
+        cliente = app.test_client()
+        if usuario is not None:
+            with cliente.session_transaction() as sessao:
+                sessao['usuario_id'] = usuario.id
+        return cliente
+    return criar
+
+
+@pytest.fixture
+def simultaneos():
+    """simultaneos(funcoes) -> resultados, com todas as funções liberadas no mesmo instante.
+
+    As funções rodam fora do app context do teste: leia ids e códigos dos
+    objetos antes, na thread principal.
+    """
+    def rodar(funcoes):
+        barreira = threading.Barrier(len(funcoes))
+        resultados = [None] * len(funcoes)
+        erros = []
+
+        def executar(indice, funcao):
+            barreira.wait()
+            try:
+                resultados[indice] = funcao()
+            except Exception as erro:  # reportado na thread principal
+                erros.append(erro)
+
+        threads = [threading.Thread(target=executar, args=item) for item in enumerate(funcoes)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if erros:
+            raise erros[0]
+        return resultados
+    return rodar
+
+
+def recarregar(objeto):
+    """Relê o objeto do banco (depois de requests feitos por outras sessões)"""
+    db.session.expire_all()
+    return db.session.get(type(objeto), objeto.id)
+
@@ -0,0 +1,61 @@
+"""Analytics: sincronização incremental para o banco separado e painel /admin/analytics."""
+
+from datetime import datetime, timedelta
+
+from app_comercial import Resgate, db
+
+ADMIN = {'X-Admin-Token': 'token-do-admin'}
+
+
+def sincronizar(app, *args):
+    resultado = app.test_cli_runner().invoke(args=['analytics-sincronizar', *args])
+    assert resultado.exit_code == 0, resultado.output
+    return resultado.output
+
+
+def test_sincroniza_e_mostra_metricas(app, fabrica):
+    app.config['ADMIN_TOKEN'] = 'token-do-admin'
+    casal, a, b = fabrica.casal()
+    ontem = datetime.now() - timedelta(days=1)
+    for pontos in (10, 30):
+        fabrica.tarefa(casal, para=a, de=b, pontos=pontos, concluida=True, data_conclusao=ontem)
+    fabrica.tarefa(casal, para=a, de=b, pontos=99)  # pendente: fica de fora
+    recompensa = fabrica.recompensa(casal, para=a, de=b, custo=40, data_criacao=ontem - timedelta(hours=2),
+                                    data_aprovacao=ontem)
+    db.session.add(Resgate(usuario_id=a.id, recompensa_id=recompensa.id, custo=40, data_resgate=ontem))
+    db.session.commit()
+
+    saida = sincronizar(app)
+    assert 'casais: 1, tarefa: 2, resgate: 1, avaliacoes: 1' in saida
+    assert 'nada novo' in sincronizar(app)  # a marca d'água avançou
+
+    metricas = app.test_client().get('/admin/analytics', headers=ADMIN).get_json()
+    assert metricas['casais_total'] == 1
+    assert metricas['casais_ativos']['7d'] == 1
+    assert metricas['conclusoes_por_dia'] == [
+        {'dia': ontem.date().isoformat(), 'conclusoes': 2, 'pontos': 40, 'resgates': 1}
+    ]
+    assert metricas['custo_recompensas']['faixas'] == {'25-49': 1}
+    assert metricas['latencia_aprovacao_horas']['p50'] == 2.0
+
+
+def test_conclusoes_recentes_esperam_a_folga(app, fabrica):
+    app.config['ADMIN_TOKEN'] = 'token-do-admin'
+    casal, a, b = fabrica.casal()
+    fabrica.tarefa(casal, para=a, de=b, pontos=10, concluida=True, data_conclusao=datetime.now())
+
+    assert 'tarefa' not in sincronizar(app)
+    metricas = app.test_client().get('/admin/analytics', headers=ADMIN).get_json()
+    assert metricas['conclusoes_por_dia'] == []
+    assert metricas['casais_total'] == 1
+
+
+def test_painel_exige_token_e_sincronizacao(app):
+    painel = app.test_client()
+
+    assert painel.get('/admin/analytics', headers=ADMIN).status_code == 404  # ADMIN_TOKEN não configurado
+    app.config['ADMIN_TOKEN'] = 'token-do-admin'
+    assert painel.get('/admin/analytics', headers={'X-Admin-Token': 'errado'}).status_code == 404
+    resposta = painel.get('/admin/analytics', headers=ADMIN)
+    assert (resposta.status_code, resposta.get_json()) == (503, {'erro': 'analytics_nao_sincronizado'})
+    assert painel.get('/admin/analytics?dias=x', headers=ADMIN).status_code == 400
@@ -0,0 +1,42 @@
+"""Arquivamento do histórico: saldos e estatísticas não mudam."""
+
+from datetime import datetime, timedelta
+
+from app_comercial import ItemArquivado, Resgate, Tarefa, Usuario, db, recalcular_estatisticas
+
+
+def test_arquivar_mantem_saldos_e_estatisticas(app, fabrica, cliente):
+    casal, a, b = fabrica.casal()
+    antigo = datetime.now() - timedelta(days=200)
+    for pontos in (30, 20):
+        fabrica.tarefa(casal, para=a, de=b, pontos=pontos, concluida=True, data_conclusao=antigo)
+    fabrica.tarefa(casal, para=b, de=a, pontos=5, concluida=True, data_conclusao=datetime.now())
+    recompensa = fabrica.recompensa(casal, para=a, de=b, custo=15)
+    db.session.add(Resgate(usuario_id=a.id, recompensa_id=recompensa.id, custo=15,
+                           data_resgate=antigo, utilizado=True))
+    db.session.commit()
+    recalcular_estatisticas()
+    navegador = cliente(a)
+    estatisticas = navegador.get('/api/estatisticas?agrupar=mes').get_json()
+    assert (a.saldo, b.saldo) == (35, 5)
+    ids = (a.id, b.id)  # o comando fecha a sessão compartilhada com o teste
+
+    resultado = app.test_cli_runner().invoke(args=['arquivar', '--dias', '90', '--lote', '1'])
+
+    assert resultado.exit_code == 0, resultado.output
+    assert '[OK] Arquivados: 2 tarefas, 1 vales' in resultado.output
+    assert Tarefa.query.count() == 1 and Resgate.query.count() == 0
+    assert ItemArquivado.query.count() == 3
+    assert [db.session.get(Usuario, id).saldo for id in ids] == [35, 5]
+    assert navegador.get('/api/estatisticas?agrupar=mes').get_json() == estatisticas
+
+
+def test_arquivar_sem_itens_antigos_nao_mexe_em_nada(app, fabrica):
+    casal, a, b = fabrica.casal()
+    fabrica.tarefa(casal, para=a, de=b, pontos=10, concluida=True, data_conclusao=datetime.now())
+
+    resultado = app.test_cli_runner().invoke(args=['arquivar', '--sem-compactar'])
+
+    assert resultado.exit_code == 0, resultado.output
+    assert resultado.output == '[OK] Arquivados: 0 tarefas, 0 vales\n'
+    assert Tarefa.query.count() == 1 and ItemArquivado.query.count() == 0
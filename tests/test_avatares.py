@@ -0,0 +1,76 @@
+"""Avatares: recorte quadrado nos tamanhos fixos, nome pelo hash e limpeza dos antigos."""
+
+import io
+import os
+
+from PIL import Image
+
+from app_comercial import AVATAR_LADOS
+
+from conftest import recarregar
+
+
+def imagem_png(largura, altura, cor):
+    saida = io.BytesIO()
+    Image.new('RGB', (largura, altura), cor).save(saida, 'PNG')
+    return saida.getvalue()
+
+
+def enviar(navegador, dados, nome='foto.png'):
+    return navegador.post('/perfil/foto', data={'foto': (io.BytesIO(dados), nome)},
+                          content_type='multipart/form-data', follow_redirects=True)
+
+
+def recortes(app, foto):
+    pasta = os.path.join(app.config['UPLOAD_FOLDER'], 'perfis')
+    base = os.path.basename(foto).rsplit('-', 1)[0]
+    return [os.path.join(pasta, f'{base}-{lado}.webp') for lado in AVATAR_LADOS]
+
+
+def test_foto_vira_recortes_quadrados_com_cache_imutavel(app, fabrica, cliente):
+    _casal, a, b = fabrica.casal()
+    dados = imagem_png(400, 200, 'red')
+
+    assert 'Foto atualizada!' in enviar(cliente(a), dados).get_data(as_text=True)
+
+    foto = recarregar(a).foto
+    assert foto.startswith('perfis/') and foto.endswith('-256.webp')
+    for lado, caminho in zip(AVATAR_LADOS, recortes(app, foto)):
+        with Image.open(caminho) as recorte:
+            assert (recorte.format, recorte.size) == ('WEBP', (lado, lado))
+    resposta = cliente().get(f"/avatares/{os.path.basename(recortes(app, foto)[0])}")
+    assert resposta.mimetype == 'image/webp'
+    assert {'public', 'immutable', 'max-age=31536000'} <= set(resposta.headers['Cache-Control'].split(', '))
+    # O mesmo arquivo, enviado por outra pessoa, reaproveita os mesmos recortes
+    enviar(cliente(b), dados)
+    assert recarregar(b).foto == foto
+
+
+def test_trocar_e_remover_apagam_so_recortes_sem_uso(app, fabrica, cliente):
+    _casal, a, b = fabrica.casal()
+    navegador = cliente(a)
+    vermelha = imagem_png(300, 300, 'red')
+    enviar(navegador, vermelha)
+    enviar(cliente(b), vermelha)
+    compartilhada = recarregar(a).foto
+
+    enviar(navegador, imagem_png(300, 300, 'blue'))
+    azul = recarregar(a).foto
+    assert azul != compartilhada
+    assert all(os.path.exists(c) for c in recortes(app, compartilhada))  # b ainda usa
+
+    navegador.post('/perfil/foto/remover')
+    assert recarregar(a).foto is None
+    assert not any(os.path.exists(c) for c in recortes(app, azul))
+
+
+def test_arquivo_invalido_mantem_a_foto_atual(app, fabrica, cliente):
+    _casal, a, _b = fabrica.casal()
+    navegador = cliente(a)
+    enviar(navegador, imagem_png(100, 100, 'green'))
+    foto = recarregar(a).foto
+
+    for dados, nome in ((b'isto nao e uma imagem', 'foto.png'), (imagem_png(100, 100, 'blue'), 'foto.exe')):
+        assert 'Foto atualizada!' not in enviar(navegador, dados, nome).get_data(as_text=True)
+    assert recarregar(a).foto == foto
+    assert cliente().get('/avatares/nao-existe-64.webp').status_code == 404
@@ -0,0 +1,44 @@
+"""Backup online, verificação e restauração pelos comandos da CLI."""
+
+import shutil
+
+from app_comercial import Tarefa, db, listar_backups
+
+
+def test_backup_verificar_e_restaurar(app, fabrica, tmp_path):
+    casal, a, b = fabrica.casal()
+    fabrica.tarefa(casal, para=a, de=b, titulo='Antes do backup')
+    pasta = tmp_path / 'backups'
+    cli = app.test_cli_runner()
+
+    resultado = cli.invoke(args=['backup', '--pasta', str(pasta), '--pausa', '0'])
+    assert resultado.exit_code == 0, resultado.output
+    [arquivo] = listar_backups(str(pasta))
+    assert cli.invoke(args=['backup-verificar', '--pasta', str(pasta)]).exit_code == 0
+
+    # Uma cópia corrompida não passa na verificação
+    corrompido = str(tmp_path / 'corrompido.db.gz')
+    shutil.copy(arquivo, corrompido)
+    with open(corrompido, 'r+b') as f:
+        f.truncate(f.seek(0, 2) // 2)
+    resultado = cli.invoke(args=['backup-verificar', corrompido])
+    assert resultado.exit_code == 1
+    assert 'arquivo corrompido' in resultado.output
+
+    # Dados perdidos depois do backup voltam com a restauração
+    db.session.execute(db.delete(Tarefa))
+    db.session.commit()
+    resultado = cli.invoke(args=['backup-restaurar', arquivo, '--pasta', str(pasta), '--yes'])
+    assert resultado.exit_code == 0, resultado.output
+    assert [t.titulo for t in Tarefa.query] == ['Antes do backup']
+
+
+def test_erros_saem_com_codigo_diferente_de_zero(app, tmp_path):
+    cli = app.test_cli_runner()
+
+    resultado = cli.invoke(args=['backup-verificar', '--pasta', str(tmp_path / 'vazia')])
+    assert (resultado.exit_code, resultado.output) == (1, 'Error: Nenhum backup encontrado.\n')
+
+    resultado = cli.invoke(args=['backup-restaurar', str(tmp_path / 'nao-existe.db.gz'), '--yes'])
+    assert resultado.exit_code == 1
+    assert 'Restauração falhou' in resultado.output
@@ -0,0 +1,68 @@
+"""Busca FTS5: escopo do casal, prefixos, acentos e corte de candidatos."""
+
+import app_comercial
+
+
+def buscar(api, q, **params):
+    return api.get('/api/busca', query_string={'q': q, **params}).get_json()
+
+
+def titulos(resposta):
+    return [item['titulo'] for item in resposta['resultados']]
+
+
+def test_busca_so_ve_itens_do_proprio_casal(fabrica, cliente):
+    casal, a, b = fabrica.casal()
+    fabrica.tarefa(casal, a, b, titulo='Lavar a louça')
+    outro, c, d = fabrica.casal()
+    fabrica.tarefa(outro, c, d, titulo='Lavar o carro')
+    fabrica.recompensa(outro, c, d, titulo='Lavagem do carro')
+
+    assert titulos(buscar(cliente(a), 'lavar')) == ['Lavar a louça']
+    assert sorted(titulos(buscar(cliente(c), 'lav'))) == ['Lavagem do carro', 'Lavar o carro']
+
+
+def test_prefixo_termo_inteiro_e_acentos(fabrica, cliente):
+    casal, a, b = fabrica.casal()
+    fabrica.tarefa(casal, a, b, titulo='Lavar a louça', descricao='Depois do jantar')
+    fabrica.tarefa(casal, a, b, titulo='Lavanderia')
+    fabrica.tarefa(casal, a, b, titulo='Passear', descricao='Lavar o cachorro')
+    api = cliente(a)
+
+    # Título pesa mais que descrição; prefixo acha "lavanderia"
+    assert titulos(buscar(api, 'lav')) == ['Lavanderia', 'Lavar a louça', 'Passear']
+    # Termo inteiro: "lavar" não casa com "lavanderia", apesar do prefixo de 4 letras no índice
+    assert titulos(buscar(api, 'lavar')) == ['Lavar a louça', 'Passear']
+    # Todos os termos precisam aparecer
+    assert titulos(buscar(api, 'lavar jantar')) == ['Lavar a louça']
+    # Acentos são ignorados dos dois lados
+    assert titulos(buscar(api, 'louca')) == titulos(buscar(api, 'LOUÇA')) == ['Lavar a louça']
+    assert buscar(api, 'limpar')['resultados'] == []
+    assert buscar(api, '!!!')['resultados'] == []
+
+
+def test_tipo_e_paginacao(fabrica, cliente):
+    casal, a, b = fabrica.casal()
+    for numero in range(3):
+        fabrica.tarefa(casal, a, b, titulo=f'Cozinhar {numero}')
+    fabrica.recompensa(casal, a, b, titulo='Cozinhar junto')
+    api = cliente(a)
+
+    assert titulos(buscar(api, 'cozinhar', tipo='recompensa')) == ['Cozinhar junto']
+    assert titulos(buscar(api, 'cozinhar', tipo='tarefa', limite=2, pagina=2)) == ['Cozinhar 0']
+    assert cliente(a).get('/api/busca?q=x&tipo=outro').status_code == 400
+
+
+def test_sinaliza_quando_candidatos_sao_cortados(fabrica, cliente, monkeypatch):
+    casal, a, b = fabrica.casal()
+    for numero in range(4):
+        fabrica.tarefa(casal, a, b, titulo=f'Regar {numero}')
+    api = cliente(a)
+
+    assert buscar(api, 'regar')['truncado'] is False
+    monkeypatch.setattr(app_comercial, 'MAX_CANDIDATOS_BUSCA', 3)
+    resposta = buscar(api, 'regar')
+    assert resposta['truncado'] is True
+    assert titulos(resposta) == ['Regar 3', 'Regar 2', 'Regar 1']
+    pagina_vazia = buscar(api, 'regar', pagina=5)
+    assert (pagina_vazia['resultados'], pagina_vazia['truncado']) == ([], True)
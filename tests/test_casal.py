@@ -0,0 +1,81 @@
+"""Criação e vínculo de casais, inclusive pedidos simultâneos no /entrar-casal."""
+
+from app_comercial import Casal, Usuario, db, preencher_membros_casais
+
+from conftest import recarregar
+
+
+def test_criar_e_entrar_no_casal(fabrica, cliente):
+    a, b = fabrica.usuario(), fabrica.usuario()
+
+    assert cliente(a).post('/criar-casal').status_code == 302
+    casal = Casal.query.one()
+    assert recarregar(a).casal_id == casal.id
+
+    cliente(b).post('/entrar-casal', data={'codigo': casal.codigo.lower()})
+    casal = recarregar(casal)
+    assert (casal.parceiro_a_id, casal.parceiro_b_id) == (a.id, b.id)
+    assert recarregar(b).casal_id == casal.id
+    assert casal.esta_completo()
+
+
+def test_casal_completo_recusa_terceiro(fabrica, cliente):
+    casal, _, _ = fabrica.casal()
+    intruso = fabrica.usuario()
+
+    resposta = cliente(intruso).post('/entrar-casal', data={'codigo': casal.codigo}, follow_redirects=True)
+    assert 'já está completo' in resposta.get_data(as_text=True)
+    assert recarregar(intruso).casal_id is None
+    assert Usuario.query.filter_by(casal_id=casal.id).count() == 2
+
+
+def test_entradas_simultaneas_ocupam_uma_vaga(fabrica, cliente, simultaneos):
+    casal, _, _ = fabrica.casal(completo=False)
+    candidatos = [fabrica.usuario() for _ in range(6)]
+    dados = {'codigo': casal.codigo}
+    clientes = [cliente(usuario) for usuario in candidatos]
+
+    simultaneos([lambda c=c: c.post('/entrar-casal', data=dados) for c in clientes])
+
+    db.session.expire_all()
+    assert Usuario.query.filter_by(casal_id=casal.id).count() == 2
+    casal = recarregar(casal)
+    assert casal.parceiro_b_id in {usuario.id for usuario in candidatos}
+    assert recarregar(db.session.get(Usuario, casal.parceiro_b_id)).casal_id == casal.id
+
+
+def test_mesmo_usuario_em_dois_casais_ao_mesmo_tempo(fabrica, cliente, simultaneos):
+    primeiro, _, _ = fabrica.casal(completo=False)
+    segundo, _, _ = fabrica.casal(completo=False)
+    usuario = fabrica.usuario()
+    pedidos = [(cliente(usuario), {'codigo': casal.codigo}) for casal in (primeiro, segundo)]
+
+    simultaneos([lambda c=c, dados=dados: c.post('/entrar-casal', data=dados) for c, dados in pedidos])
+
+    usuario = recarregar(usuario)
+    vagas = [recarregar(casal).parceiro_b_id for casal in (primeiro, segundo)]
+    assert usuario.casal_id in (primeiro.id, segundo.id)
+    assert vagas.count(usuario.id) == 1
+
+
+def test_preencher_membros_de_casais_antigos(fabrica):
+    casal, a, b = fabrica.casal()
+    casal.parceiro_a_id = casal.parceiro_b_id = None
+    db.session.commit()
+
+    assert preencher_membros_casais() == (1, [])
+
+    casal = recarregar(casal)
+    assert (casal.parceiro_a_id, casal.parceiro_b_id) == (a.id, b.id)
+
+
+def test_init_db_pela_cli_relata_casais_preenchidos(app, fabrica):
+    casal, _a, _b = fabrica.casal()
+    casal.parceiro_a_id = casal.parceiro_b_id = None
+    db.session.commit()
+
+    resultado = app.test_cli_runner().invoke(args=['init-db'])
+
+    assert resultado.exit_code == 0, resultado.output
+    assert resultado.output == ('[OK] Membros preenchidos em 1 casais\n'
+                                '[OK] Banco de dados criado com sucesso!\n')
@@ -0,0 +1,59 @@
+"""Compressão das respostas: tamanho mínimo, Vary, streaming e BREACH."""
+
+import gzip
+
+GZIP = {'Accept-Encoding': 'gzip'}
+
+
+def test_pagina_grande_sai_compactada_e_pequena_nao(fabrica, cliente):
+    casal, a, b = fabrica.casal()
+    for numero in range(20):
+        fabrica.tarefa(casal, para=a, de=b, titulo=f'Tarefa longa número {numero}')
+    navegador = cliente(a)
+
+    pagina = navegador.get('/tarefas', headers=GZIP)
+    assert pagina.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in pagina.headers['Vary']
+    assert 'Tarefa longa número 19' in gzip.decompress(pagina.data).decode()
+
+    pequena = navegador.get('/api/eventos', headers=GZIP)
+    assert len(pequena.data) < 512 and 'Content-Encoding' not in pequena.headers
+    assert 'Accept-Encoding' in pequena.headers['Vary']
+
+    sem_aceitar = navegador.get('/tarefas')
+    assert 'Content-Encoding' not in sem_aceitar.headers
+    assert 'Tarefa longa número 19' in sem_aceitar.get_data(as_text=True)
+
+
+def test_streaming_compacta_sem_content_length(fabrica, cliente):
+    casal, a, b = fabrica.casal()
+    for numero in range(30):
+        fabrica.tarefa(casal, para=a, de=b, titulo=f'Exportada {numero}')
+
+    resposta = cliente(a).get('/exportar/tarefas.csv', headers=GZIP)
+
+    assert resposta.headers['Content-Encoding'] == 'gzip'
+    assert 'Content-Length' not in resposta.headers
+    linhas = gzip.decompress(resposta.data).decode().splitlines()
+    assert len(linhas) == 31 and 'Exportada 29' in linhas[-1]
+
+
+def test_resposta_ja_codificada_passa_intacta(app):
+    corpo = gzip.compress(b'x' * 4096)
+    app.add_url_rule('/teste-codificada', 'teste_codificada',
+                     lambda: (corpo, {'Content-Type': 'text/plain', 'Content-Encoding': 'gzip'}))
+
+    resposta = app.test_client().get('/teste-codificada', headers=GZIP)
+
+    assert resposta.data == corpo
+    assert resposta.headers['Content-Encoding'] == 'gzip'
+
+
+def test_pagina_com_token_csrf_nao_e_compactada(fabrica, cliente):
+    _casal, a, _b = fabrica.casal()
+
+    pagina = cliente(a).get('/perfil', headers=GZIP)
+
+    assert pagina.status_code == 200 and len(pagina.data) >= 512
+    assert 'Content-Encoding' not in pagina.headers
+    assert 'name="csrf_token"' in pagina.get_data(as_text=True)
@@ -0,0 +1,54 @@
+"""Estatísticas diárias e sequências somadas na conclusão e no resgate."""
+
+from datetime import date
+
+from app_comercial import EstatisticaDiaria, Sequencia, Tarefa, db, recalcular_estatisticas
+
+from conftest import recarregar
+
+
+def test_concluir_soma_estatisticas_e_sequencia(fabrica, cliente):
+    casal, a, b = fabrica.casal()
+    tarefa = fabrica.tarefa(casal, para=a, de=b, pontos=15)
+    recompensa = fabrica.recompensa(casal, para=a, de=b, custo=10)
+    navegador = cliente(a)
+
+    navegador.post(f'/tarefa/concluir/{tarefa.id}')
+    navegador.post(f'/resgatar/{recompensa.id}')
+
+    dados = navegador.get('/api/estatisticas?agrupar=dia').get_json()
+    serie = {u['id']: u for u in dados['usuarios']}[a.id]
+    assert serie['serie'] == [{'periodo': date.today().isoformat(), 'pontos_ganhos': 15,
+                               'pontos_gastos': 10, 'tarefas': 1, 'resgates': 1}]
+    assert serie['sequencia'] == {'atual': 1, 'recorde': 1}
+
+
+def test_concluir_duas_vezes_conta_uma(fabrica, cliente):
+    casal, a, b = fabrica.casal()
+    tarefa = fabrica.tarefa(casal, para=a, de=b, pontos=15, recorrente=True, frequencia='diaria')
+    navegador = cliente(a)
+
+    navegador.post(f'/tarefa/concluir/{tarefa.id}')
+    resposta = navegador.post(f'/tarefa/concluir/{tarefa.id}', follow_redirects=True)
+
+    assert 'já foi concluída' in resposta.get_data(as_text=True)
+    db.session.expire_all()
+    estatistica = EstatisticaDiaria.query.filter_by(usuario_id=a.id).one()
+    assert (estatistica.tarefas, estatistica.pontos_ganhos) == (1, 15)
+    assert Tarefa.query.count() == 2  # a concluída e a próxima recorrente
+    assert recarregar(a).saldo == 15
+
+
+def test_recalcular_reproduz_os_totais_incrementais(fabrica, cliente):
+    casal, a, b = fabrica.casal()
+    for pontos in (5, 7):
+        tarefa = fabrica.tarefa(casal, para=a, de=b, pontos=pontos)
+        cliente(a).post(f'/tarefa/concluir/{tarefa.id}')
+    db.session.expire_all()
+    antes = [(e.usuario_id, e.dia, e.pontos_ganhos, e.tarefas) for e in EstatisticaDiaria.query]
+
+    recalcular_estatisticas()
+
+    db.session.expire_all()
+    assert [(e.usuario_id, e.dia, e.pontos_ganhos, e.tarefas) for e in EstatisticaDiaria.query] == antes
+    assert db.session.get(Sequencia, a.id).atual == 1
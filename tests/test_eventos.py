@@ -0,0 +1,70 @@
+"""Log de auditoria: o evento e a mutação são gravados ou desfeitos juntos."""
+
+import pytest
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+import app_comercial
+from app_comercial import EstatisticaDiaria, Evento, Resgate, Tarefa, db, registrar_evento
+
+from conftest import recarregar
+
+
+def test_evento_e_commitado_com_a_mutacao(fabrica, cliente):
+    casal, a, b = fabrica.casal()
+    tarefa = fabrica.tarefa(casal, para=a, de=b, pontos=15)
+    navegador = cliente(a)
+
+    navegador.post(f'/tarefa/concluir/{tarefa.id}')
+
+    assert recarregar(tarefa).concluida
+    [evento] = navegador.get('/api/eventos').get_json()['eventos']
+    assert (evento['seq'], evento['tipo'], evento['alvo_id'], evento['usuario_id']) == \
+        (1, 'tarefa_concluida', tarefa.id, a.id)
+    assert evento['dados']['pontos'] == 15
+
+
+def test_falha_ao_gravar_evento_desfaz_a_mutacao(fabrica, cliente, monkeypatch):
+    casal, a, b = fabrica.casal()
+    tarefa = fabrica.tarefa(casal, para=a, de=b, pontos=15)
+    monkeypatch.setattr(app_comercial, 'SQL_INSERIR_EVENTO',
+                        'INSERT INTO evento_inexistente VALUES (?, ?, ?, ?, ?, ?, ?)')
+
+    with pytest.raises(OperationalError):
+        cliente(a).post(f'/tarefa/concluir/{tarefa.id}')
+    db.session.rollback()  # o request usou a sessão do teste
+
+    assert not recarregar(tarefa).concluida
+    assert EstatisticaDiaria.query.count() == 0
+    assert Evento.query.count() == 0
+
+
+def test_falha_na_mutacao_descarta_o_evento(fabrica):
+    casal, a, b = fabrica.casal()
+    registrar_evento('tarefa_criada', casal.id, a.id, titulo=None)
+    db.session.add(Tarefa(titulo=None, pontos=5, casal_id=casal.id, usuario_id=b.id, criado_por_id=a.id))
+
+    with pytest.raises(IntegrityError):
+        db.session.commit()
+    db.session.rollback()
+    db.session.commit()  # nada pendente: o evento da transação desfeita não volta
+
+    assert Evento.query.count() == 0
+    registrar_evento('tarefa_criada', casal.id, a.id)
+    db.session.commit()
+    assert [e.seq for e in Evento.query] == [1]  # a numeração reservada também foi desfeita
+
+
+def test_usar_o_mesmo_vale_duas_vezes_gera_um_evento(fabrica, cliente):
+    casal, a, b = fabrica.casal()
+    recompensa = fabrica.recompensa(casal, para=a, de=b, custo=10)
+    vale = Resgate(usuario_id=a.id, recompensa_id=recompensa.id, custo=10)
+    db.session.add(vale)
+    db.session.commit()
+    navegador = cliente(a)
+
+    navegador.get(f'/vale/usar/{vale.id}')
+    repetido = navegador.get(f'/vale/usar/{vale.id}', follow_redirects=True)
+
+    assert 'já foi utilizado' in repetido.get_data(as_text=True)
+    assert recarregar(vale).utilizado
+    assert [(e.tipo, e.alvo_id) for e in Evento.query] == [('vale_usado', vale.id)]
@@ -0,0 +1,85 @@
+"""Exportação dos dados do casal: CSV/JSONL em streaming, ZIP com fotos e CLI em lote."""
+
+import csv
+import io
+import json
+import os
+import zipfile
+from datetime import datetime, timedelta
+
+from app_comercial import Resgate, arquivar_historico, db
+
+
+def ler_jsonl(dados):
+    return [json.loads(linha) for linha in dados.decode().splitlines()]
+
+
+def test_csv_inclui_itens_arquivados_e_so_o_casal(fabrica, cliente):
+    casal, a, b = fabrica.casal()
+    fabrica.tarefa(casal, para=a, de=b, titulo='Antiga', pontos=7, concluida=True,
+                   data_conclusao=datetime.now() - timedelta(days=200))
+    fabrica.tarefa(casal, para=a, de=b, titulo='Atual, com vírgula')
+    outro, c, d = fabrica.casal()
+    fabrica.tarefa(outro, para=c, de=d, titulo='De outro casal')
+    arquivar_historico(dias=90)
+
+    resposta = cliente(a).get('/exportar/tarefas.csv')
+
+    assert resposta.headers['Content-Type'] == 'text/csv; charset=utf-8'
+    assert resposta.headers['Content-Disposition'] == 'attachment; filename="tarefas.csv"'
+    linhas = list(csv.DictReader(io.StringIO(resposta.get_data(as_text=True))))
+    assert [(l['titulo'], l['arquivada']) for l in linhas] == [('Atual, com vírgula', 'False'), ('Antiga', 'True')]
+    assert linhas[1]['pontos'] == '7' and linhas[1]['concluida'] == 'True'
+
+
+def test_jsonl_de_resgates_e_tipos_invalidos(fabrica, cliente):
+    casal, a, b = fabrica.casal()
+    recompensa = fabrica.recompensa(casal, para=a, de=b, custo=25, titulo='Cinema')
+    db.session.add(Resgate(usuario_id=a.id, recompensa_id=recompensa.id, custo=25))
+    db.session.commit()
+    navegador = cliente(a)
+
+    [resgate] = ler_jsonl(navegador.get('/exportar/resgates.jsonl').data)
+
+    assert (resgate['titulo'], resgate['custo'], resgate['utilizado'], resgate['arquivada']) == \
+        ('Cinema', 25, False, False)
+    assert navegador.get('/exportar/usuarios.csv').status_code == 404
+    assert navegador.get('/exportar/tarefas.xml').status_code == 404
+    assert navegador.get('/exportar.zip?formato=xml').status_code == 400
+
+
+def test_zip_traz_dados_e_fotos_do_casal(app, fabrica, cliente):
+    casal, a, b = fabrica.casal()
+    pasta = os.path.join(app.config['UPLOAD_FOLDER'], 'tarefas')
+    os.makedirs(pasta, exist_ok=True)
+    with open(os.path.join(pasta, 'prova.jpg'), 'wb') as foto:
+        foto.write(b'\xff\xd8jpeg')
+    fabrica.tarefa(casal, para=a, de=b, titulo='Com foto', foto='tarefas/prova.jpg')
+    fabrica.tarefa(casal, para=a, de=b, titulo='Foto fora da pasta', foto='../app.db')
+    fabrica.recompensa(casal, para=a, de=b, titulo='Jantar')
+
+    resposta = cliente(a).get('/exportar.zip')
+
+    assert resposta.mimetype == 'application/zip'
+    with zipfile.ZipFile(io.BytesIO(resposta.data)) as arquivo:
+        assert sorted(arquivo.namelist()) == ['recompensas.jsonl', 'resgates.jsonl', 'tarefas.jsonl',
+                                              'uploads/tarefas/prova.jpg']
+        assert arquivo.read('uploads/tarefas/prova.jpg') == b'\xff\xd8jpeg'
+        assert [t['titulo'] for t in ler_jsonl(arquivo.read('tarefas.jsonl'))] == ['Com foto', 'Foto fora da pasta']
+        assert arquivo.read('resgates.jsonl') == b''
+
+
+def test_cli_exporta_um_zip_por_casal(app, fabrica, tmp_path):
+    casal, a, b = fabrica.casal()
+    fabrica.tarefa(casal, para=a, de=b, titulo='Exportada pela CLI')
+    casal_id = casal.id
+    pasta = tmp_path / 'exportacoes'
+
+    resultado = app.test_cli_runner().invoke(args=['exportar', '--pasta', str(pasta), '--processos', '1',
+                                                   '--formato', 'csv', '--sem-uploads'])
+
+    assert resultado.exit_code == 0, resultado.output
+    assert '[OK] 1 casais exportados' in resultado.output
+    with zipfile.ZipFile(pasta / f'casal-{casal_id}.zip') as arquivo:
+        assert 'Exportada pela CLI' in arquivo.read('tarefas.csv').decode()
+    assert not list(pasta.glob('*.parcial'))
@@ -0,0 +1,78 @@
+"""Validação de imagens enviadas: corpus de amostras e mutações aleatórias."""
+
+import io
+import random
+
+import pytest
+from werkzeug.datastructures import FileStorage
+
+from app_comercial import IMAGEM_MAX_BYTES, IMAGEM_MAX_PIXELS, ImagemInvalida, ler_cabecalho_imagem, validar_foto
+from benchmark_comercial import FluxoContado, corpus_imagens, mutar_imagem
+
+CORPUS = corpus_imagens()
+MUTACOES = 3000
+
+
+@pytest.mark.parametrize('nome', sorted(n for n, (_dados, passa) in CORPUS.items() if passa))
+def test_aceita_imagem_valida_lendo_so_o_cabecalho(nome):
+    dados, _passa = CORPUS[nome]
+    fluxo = FluxoContado(dados)
+
+    formato, largura, altura = ler_cabecalho_imagem(fluxo)
+
+    assert nome.rsplit('.', 1)[1].replace('jpg', 'jpeg') == formato
+    assert 0 < largura * altura <= IMAGEM_MAX_PIXELS
+    assert fluxo.tell() == 0
+    assert fluxo.lidos < 70_000  # não decodifica os pixels
+
+
+@pytest.mark.parametrize('nome', sorted(n for n, (_dados, passa) in CORPUS.items() if not passa))
+def test_recusa_bombas_e_disfarces(nome):
+    dados, _passa = CORPUS[nome]
+    fluxo = FluxoContado(dados)
+
+    with pytest.raises(ImagemInvalida):
+        ler_cabecalho_imagem(fluxo)
+    assert fluxo.tell() == 0
+
+
+@pytest.mark.parametrize('nome', ['valida.png', 'valida.jpg', 'animada.gif', 'valida-vp8x.webp'])
+def test_recusa_arquivo_truncado(nome):
+    # Cortes antes das dimensões; depois delas o resto é problema do decodificador
+    dados, _passa = CORPUS[nome]
+    for corte in (1, 7, 8, 16, 23):
+        with pytest.raises(ImagemInvalida):
+            ler_cabecalho_imagem(io.BytesIO(dados[:corte]))
+
+
+def test_mutacoes_so_levantam_imagem_invalida():
+    aleatorio = random.Random(20240601)
+    sementes = [dados for dados, _passa in CORPUS.values() if 0 < len(dados) <= 200_000]
+    for _ in range(MUTACOES):
+        dados = mutar_imagem(aleatorio, aleatorio.choice(sementes))
+        fluxo = io.BytesIO(dados)
+        try:
+            _formato, largura, altura = ler_cabecalho_imagem(fluxo)
+        except ImagemInvalida:
+            pass
+        else:
+            assert largura * altura <= IMAGEM_MAX_PIXELS, dados[:32]
+        assert fluxo.tell() == 0
+
+
+def enviar(nome, dados):
+    return FileStorage(io.BytesIO(dados), filename=nome)
+
+
+def test_validar_foto_confere_extensao_e_conteudo(app):
+    with app.test_request_context():
+        assert validar_foto(enviar('foto.JPG', CORPUS['valida.jpg'][0])) == 'jpg'
+        assert validar_foto(enviar('foto.jpg', CORPUS['valida.png'][0])) is None  # PNG com nome de JPEG
+        assert validar_foto(enviar('foto.svg', b'<svg/>')) is None
+        assert validar_foto(enviar('bomba.gif', CORPUS['bomba-quadros.gif'][0])) is None
+
+
+def test_validar_foto_recusa_arquivo_grande(app):
+    dados = CORPUS['valida.png'][0] + b'\x00' * IMAGEM_MAX_BYTES
+    with app.test_request_context():
+        assert validar_foto(enviar('grande.png', dados)) is None
@@ -0,0 +1,72 @@
+"""Prazos de tarefa, varredura de lembretes e caixa de notificações."""
+
+from datetime import datetime, timedelta
+
+from app_comercial import Tarefa, db, proximo_prazo, varrer_lembretes
+
+
+def test_varredura_cria_lembretes_e_atrasos_uma_vez(app, fabrica, cliente):
+    casal, a, b = fabrica.casal()
+    agora = datetime.now()
+    fabrica.tarefa(casal, para=a, de=b, titulo='Vence logo', prazo=agora + timedelta(hours=1))
+    fabrica.tarefa(casal, para=a, de=b, titulo='Atrasada', prazo=agora - timedelta(hours=1))
+    fabrica.tarefa(casal, para=a, de=b, titulo='Longe', prazo=agora + timedelta(hours=10))
+    fabrica.tarefa(casal, para=a, de=b, titulo='Feita', prazo=agora + timedelta(hours=1), concluida=True)
+    fabrica.tarefa(casal, para=a, de=b, titulo='Esquecida', prazo=agora - timedelta(days=3))
+    fabrica.tarefa(casal, para=b, de=a, titulo='Do parceiro', prazo=agora + timedelta(hours=2))
+
+    resultado = app.test_cli_runner().invoke(args=['lembretes-varrer'])
+    assert resultado.exit_code == 0, resultado.output
+    assert resultado.output.startswith('[OK] 3 notificações criadas')
+    assert varrer_lembretes() == 0  # idempotente
+
+    notificacoes = cliente(a).get('/api/notificacoes').get_json()['notificacoes']
+    assert sorted((n['tipo'], n['mensagem'][:12]) for n in notificacoes) == [
+        ('atrasada', '"Atrasada" e'), ('lembrete', '"Vence logo"'),
+    ]
+
+
+def test_marcar_notificacoes_como_lidas(fabrica, cliente):
+    casal, a, b = fabrica.casal()
+    for horas in (1, 2):
+        fabrica.tarefa(casal, para=a, de=b, prazo=datetime.now() + timedelta(hours=horas))
+    varrer_lembretes()
+    navegador = cliente(a)
+    primeira, segunda = navegador.get('/api/notificacoes').get_json()['notificacoes']
+
+    assert navegador.post('/api/notificacoes/lidas', json={'ids': [primeira['id']]}).get_json() == {'marcadas': 1}
+    assert [n['id'] for n in navegador.get('/api/notificacoes').get_json()['notificacoes']] == [segunda['id']]
+    # Notificação de outro usuário não é marcada
+    assert cliente(b).post('/api/notificacoes/lidas', json={}).get_json() == {'marcadas': 0}
+    assert navegador.post('/api/notificacoes/lidas', json={}).get_json() == {'marcadas': 1}
+    assert navegador.get('/api/notificacoes').get_json()['notificacoes'] == []
+
+
+def test_corpo_que_nao_e_objeto_nao_marca_nada(fabrica, cliente):
+    casal, a, b = fabrica.casal()
+    fabrica.tarefa(casal, para=a, de=b, prazo=datetime.now() + timedelta(hours=1))
+    varrer_lembretes()
+    navegador = cliente(a)
+
+    for corpo in (5, [1, 2], 'ids', 0, []):
+        resposta = navegador.post('/api/notificacoes/lidas', json=corpo)
+        assert (resposta.status_code, resposta.get_json()) == (400, {'erro': 'corpo_invalido'})
+    assert len(navegador.get('/api/notificacoes').get_json()['notificacoes']) == 1
+
+
+def test_prazo_no_formulario_e_na_proxima_recorrente(fabrica, cliente):
+    casal, a, b = fabrica.casal()
+    navegador = cliente(b)
+
+    navegador.post('/tarefa/criar', data={'titulo': 'Com prazo', 'prazo': '2030-05-01T18:30'})
+    navegador.post('/tarefa/criar', data={'titulo': 'Prazo ruim', 'prazo': 'amanhã'})
+    assert [(t.titulo, t.prazo) for t in Tarefa.query] == [('Com prazo', datetime(2030, 5, 1, 18, 30))]
+
+    ontem = (datetime.now() - timedelta(days=1)).replace(hour=7, minute=0, second=0, microsecond=0)
+    tarefa = fabrica.tarefa(casal, para=a, de=b, prazo=ontem, recorrente=True, frequencia='diaria')
+    cliente(a).post(f'/tarefa/concluir/{tarefa.id}')
+    db.session.expire_all()
+    proxima = Tarefa.query.filter(Tarefa.id > tarefa.id).one()
+    assert proxima.prazo == proximo_prazo(ontem, 'diaria') > datetime.now()
+    assert proxima.prazo.time() == ontem.time()
+    assert proximo_prazo(None, 'diaria') is None
@@ -0,0 +1,96 @@
+"""Log de segurança em JSON: fila em segundo plano e eventos gravados pelos requests."""
+
+import json
+import logging
+import os
+
+from app_comercial import ArquivoLogRotativo, FilaLog, FormatadorJSON, app_logger
+
+from conftest import app_pronto, config_de_teste
+
+
+def gravar_pela_fila(tmp_path, registrar):
+    arquivo = ArquivoLogRotativo(str(tmp_path / 'security.log'), max_bytes=1048576, backups=1)
+    arquivo.setFormatter(FormatadorJSON())
+    fila = FilaLog(arquivo)
+    logger = logging.getLogger(f'teste.{tmp_path.name}')
+    logger.propagate = False
+    logger.addHandler(fila)
+    try:
+        registrar(logger)
+    finally:
+        fila.parar()
+        logger.removeHandler(fila)
+        arquivo.close()
+    return [json.loads(linha) for linha in (tmp_path / 'security.log').read_text().splitlines()]
+
+
+def test_excecao_chega_ao_arquivo_com_traceback(tmp_path):
+    def registrar(logger):
+        try:
+            {}['chave']
+        except KeyError:
+            logger.exception('falha_%s', 'interna', extra={'dados': {'rota': '/x'}})
+
+    [linha] = gravar_pela_fila(tmp_path, registrar)
+
+    assert (linha['evento'], linha['nivel'], linha['rota']) == ('falha_interna', 'ERROR', '/x')
+    assert linha['erro'].startswith('Traceback (most recent call last):')
+    assert "KeyError: 'chave'" in linha['erro']
+
+
+def test_registro_sem_excecao_nao_tem_erro(tmp_path):
+    [linha] = gravar_pela_fila(tmp_path, lambda logger: logger.warning('login_falhou', extra={'dados': {'ip': '1.2.3.4'}}))
+
+    assert linha['evento'] == 'login_falhou' and linha['ip'] == '1.2.3.4'
+    assert 'erro' not in linha
+
+
+def linhas_do_log(app):
+    """Esvazia a fila do log de segurança e devolve as linhas gravadas para este app"""
+    for fila in app_logger.handlers:
+        if isinstance(fila, FilaLog):
+            fila.parar()
+    caminho = app.config['SECURITY_LOG_PATH']
+    with open(caminho, encoding='utf-8') as arquivo:
+        return [json.loads(linha) for linha in arquivo]
+
+
+def test_login_e_registro_recusados_vao_para_o_log_do_app(app, fabrica, cliente, tmp_path):
+    usuario = fabrica.usuario()
+    navegador = cliente()
+
+    navegador.post('/login', data={'username': usuario.username, 'senha': 'errada'})
+    navegador.post('/registrar', data={'nome': 'Outra', 'username': usuario.username, 'email': 'nova@teste.local',
+                                       'senha': 'segredo', 'confirmar_senha': 'segredo'})
+
+    login, registro = linhas_do_log(app)
+    assert app.config['SECURITY_LOG_PATH'] == str(tmp_path / 'logs' / 'security.log')
+    assert not os.path.exists('logs')  # nada na pasta atual
+    assert (login['evento'], login['rota'], login['ip'], login['motivo']) == \
+        ('login_falhou', '/login', '127.0.0.1', 'senha_incorreta')
+    assert (registro['evento'], registro['rota'], registro['motivo']) == \
+        ('registro_recusado', '/registrar', 'username_existente')
+    assert registro['ip'] == '127.0.0.1'
+
+
+def test_limite_excedido_vai_para_o_log(tmp_path):
+    with app_pronto(config_de_teste(tmp_path, RATELIMIT_ENABLED=True)) as app:
+        navegador = app.test_client()
+        respostas = [navegador.post('/login', data={'username': 'ninguem', 'senha': 'x'}).status_code
+                     for _ in range(6)]
+        linhas = linhas_do_log(app)
+
+    assert respostas[-1] == 429
+    [limite] = [linha for linha in linhas if linha['evento'] == 'limite_excedido']
+    assert (limite['rota'], limite['ip'], limite['limite']) == ('/login', '127.0.0.1', '5 per 1 minute')
+    assert [linha['evento'] for linha in linhas].count('login_falhou') == 5
+
+
+def test_outro_app_no_mesmo_processo_troca_o_arquivo(tmp_path):
+    for nome in ('primeiro', 'segundo'):
+        pasta = tmp_path / nome
+        pasta.mkdir()
+        with app_pronto(config_de_teste(pasta)) as app:
+            app.test_client().post('/login', data={'username': nome, 'senha': 'x'})
+            assert [linha['username'] for linha in linhas_do_log(app)] == [nome]
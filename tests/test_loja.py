@@ -0,0 +1,53 @@
+"""Resgate de recompensas na loja, inclusive resgates simultâneos."""
+
+from app_comercial import Resgate, db
+
+from conftest import recarregar
+
+
+def test_resgatar_desconta_o_custo(fabrica, cliente):
+    casal, a, b = fabrica.casal()
+    fabrica.pontos(casal, a, 80)
+    recompensa = fabrica.recompensa(casal, para=a, de=b, custo=50)
+
+    assert cliente(a).post(f'/resgatar/{recompensa.id}').status_code == 302
+
+    resgate = Resgate.query.one()
+    assert resgate.custo == recompensa.custo == 50
+    assert recarregar(a).saldo == 30
+
+
+def test_resgatar_sem_pontos(fabrica, cliente):
+    casal, a, b = fabrica.casal()
+    fabrica.pontos(casal, a, 20)
+    recompensa = fabrica.recompensa(casal, para=a, de=b, custo=50)
+
+    resposta = cliente(a).post(f'/resgatar/{recompensa.id}', follow_redirects=True)
+    assert 'Pontos insuficientes' in resposta.get_data(as_text=True)
+    assert Resgate.query.count() == 0
+
+
+def test_resgatar_recompensa_pendente_ou_do_parceiro(fabrica, cliente):
+    casal, a, b = fabrica.casal()
+    fabrica.pontos(casal, a, 100)
+    pendente = fabrica.recompensa(casal, para=a, de=b, status='pendente')
+    do_parceiro = fabrica.recompensa(casal, para=b, de=a)
+
+    cliente(a).post(f'/resgatar/{pendente.id}')
+    cliente(a).post(f'/resgatar/{do_parceiro.id}')
+    assert Resgate.query.count() == 0
+
+
+def test_resgates_simultaneos_nao_deixam_saldo_negativo(fabrica, cliente, simultaneos):
+    casal, a, b = fabrica.casal()
+    fabrica.pontos(casal, a, 60)
+    recompensa = fabrica.recompensa(casal, para=a, de=b, custo=50)
+    url = f'/resgatar/{recompensa.id}'
+    clientes = [cliente(a) for _ in range(8)]
+
+    respostas = simultaneos([lambda c=c: c.post(url) for c in clientes])
+
+    assert all(resposta.status_code == 302 for resposta in respostas)
+    db.session.expire_all()
+    assert Resgate.query.count() == 1
+    assert recarregar(a).saldo == 10
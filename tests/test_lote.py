@@ -0,0 +1,105 @@
+"""Ações em lote da API: repetir o mesmo pedido não aplica nada duas vezes."""
+
+from app_comercial import EstatisticaDiaria, Evento, Recompensa, Resgate, Tarefa, db
+
+from conftest import recarregar
+
+
+def test_concluir_em_lote_repetido_conta_uma_vez(fabrica, cliente):
+    casal, a, b = fabrica.casal()
+    ids = [fabrica.tarefa(casal, para=a, de=b, pontos=10, recorrente=True, frequencia='diaria').id
+           for _ in range(3)]
+    api = cliente(a)
+
+    primeira = api.post('/api/tarefas/concluir', json={'ids': ids}).get_json()
+    segunda = api.post('/api/tarefas/concluir', json={'ids': ids}).get_json()
+
+    assert (primeira['processados'], primeira['pontos_ganhos']) == (3, 30)
+    assert (segunda['processados'], segunda['pontos_ganhos']) == (0, 0)
+    assert {r['status'] for r in segunda['resultados']} == {'ja_concluida'}
+    db.session.expire_all()
+    assert Tarefa.query.count() == 6  # 3 concluídas + 3 próximas recorrentes
+    estatistica = EstatisticaDiaria.query.filter_by(usuario_id=a.id).one()
+    assert (estatistica.tarefas, estatistica.pontos_ganhos) == (3, 30)
+    assert recarregar(a).saldo == 30
+
+
+def test_aprovar_em_lote_repetido_avalia_uma_vez(fabrica, cliente):
+    casal, a, b = fabrica.casal()
+    recompensa = fabrica.recompensa(casal, para=a, de=b, custo=40, status='pendente')
+    api = cliente(b)
+
+    primeira = api.post('/api/recompensas/aprovar',
+                        json={'itens': [{'id': recompensa.id, 'acao': 'aprovar', 'custo': 30}]}).get_json()
+    segunda = api.post('/api/recompensas/aprovar',
+                       json={'itens': [{'id': recompensa.id, 'acao': 'rejeitar'}]}).get_json()
+
+    assert primeira['resultados'] == [{'id': recompensa.id, 'status': 'ok', 'acao': 'aprovada', 'custo': 30}]
+    assert segunda['resultados'] == [{'id': recompensa.id, 'status': 'ja_avaliada'}]
+    recompensa = recarregar(recompensa)
+    assert (recompensa.status, recompensa.custo, recompensa.aprovado_por_id) == ('aprovada', 30, b.id)
+
+
+def test_aprovar_e_rejeitar_no_mesmo_lote(fabrica, cliente):
+    casal, a, b = fabrica.casal()
+    aprovar = fabrica.recompensa(casal, para=a, de=b, custo=40, status='pendente')
+    rejeitar = fabrica.recompensa(casal, para=a, de=b, custo=70, status='pendente')
+
+    resposta = cliente(b).post('/api/recompensas/aprovar', json={'itens': [
+        {'id': aprovar.id, 'acao': 'aprovar'},
+        {'id': rejeitar.id, 'acao': 'rejeitar'},
+    ]}).get_json()
+
+    assert resposta['processados'] == 2
+    assert (recarregar(aprovar).status, recarregar(aprovar).custo) == ('aprovada', 40)
+    assert (recarregar(rejeitar).status, recarregar(rejeitar).custo) == ('rejeitada', 70)
+
+
+def test_usar_vales_em_lote_repetido(fabrica, cliente):
+    casal, a, b = fabrica.casal()
+    recompensa = fabrica.recompensa(casal, para=a, de=b)
+    vale = Resgate(usuario_id=a.id, recompensa_id=recompensa.id, custo=recompensa.custo)
+    db.session.add(vale)
+    db.session.commit()
+    api = cliente(a)
+
+    primeira = api.post('/api/vales/usar', json={'ids': [vale.id]}).get_json()
+    segunda = api.post('/api/vales/usar', json={'ids': [vale.id]}).get_json()
+
+    assert primeira['processados'] == 1
+    assert segunda['resultados'] == [{'id': vale.id, 'status': 'ja_utilizado'}]
+    db.session.expire_all()
+    assert Evento.query.filter_by(tipo='vale_usado').count() == 1
+
+
+def test_concluir_em_lote_simultaneo_conta_uma_vez(fabrica, cliente, simultaneos):
+    casal, a, b = fabrica.casal()
+    ids = [fabrica.tarefa(casal, para=a, de=b, pontos=10, recorrente=True, frequencia='diaria').id
+           for _ in range(20)]
+    clientes = [cliente(a) for _ in range(6)]
+
+    respostas = simultaneos([lambda c=c: c.post('/api/tarefas/concluir', json={'ids': ids}).get_json()
+                             for c in clientes])
+
+    assert sorted(r['processados'] for r in respostas) == [0] * 5 + [20]
+    db.session.expire_all()
+    assert Tarefa.query.count() == 40
+    estatistica = EstatisticaDiaria.query.filter_by(usuario_id=a.id).one()
+    assert (estatistica.tarefas, estatistica.pontos_ganhos) == (20, 200)
+    assert Evento.query.filter_by(tipo='tarefa_concluida').count() == 20
+
+
+def test_aprovacao_simultanea_avalia_uma_vez(fabrica, cliente, simultaneos):
+    casal, a, b = fabrica.casal()
+    recompensa = fabrica.recompensa(casal, para=a, de=b, custo=40, status='pendente')
+    itens = [[{'id': recompensa.id, 'acao': 'aprovar', 'custo': custo}] for custo in (10, 20, 30, 40)]
+    clientes = [cliente(b) for _ in itens]
+
+    respostas = simultaneos([lambda c=c, i=i: c.post('/api/recompensas/aprovar', json={'itens': i}).get_json()
+                             for c, i in zip(clientes, itens)])
+
+    vencedoras = [r['resultados'][0] for r in respostas if r['processados']]
+    assert len(vencedoras) == 1
+    assert recarregar(recompensa).custo == vencedoras[0]['custo']
+    db.session.expire_all()
+    assert Evento.query.filter_by(tipo='recompensa_aprovada').count() == 1
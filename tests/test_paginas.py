@@ -0,0 +1,62 @@
+"""Páginas de listagem: sem lazy loads e com número de consultas fixo."""
+
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import event
+
+from app_comercial import Resgate, db
+
+PAGINAS = ['/dashboard', '/tarefas', '/loja', '/aprovacoes', '/recompensas/sugerir',
+           '/historico/conclusoes', '/historico/resgates']
+
+
+@contextmanager
+def contar_consultas():
+    """Conta os comandos SQL enviados a qualquer banco do app dentro do bloco"""
+    contagem = []
+
+    def contar(*_):
+        contagem.append(1)
+
+    engines = list(db.engines.values())
+    for engine in engines:
+        event.listen(engine, 'before_cursor_execute', contar)
+    try:
+        yield contagem
+    finally:
+        for engine in engines:
+            event.remove(engine, 'before_cursor_execute', contar)
+
+
+def popular(fabrica, casal, a, b, quantidade):
+    """Tarefas, recompensas e vales dos dois lados em todos os estados"""
+    for _ in range(quantidade):
+        for usuario, parceiro in ((a, b), (b, a)):
+            fabrica.tarefa(casal, para=usuario, de=parceiro)
+            fabrica.tarefa(casal, para=usuario, de=parceiro, concluida=True)
+            fabrica.recompensa(casal, para=usuario, de=parceiro, status='pendente')
+            aprovada = fabrica.recompensa(casal, para=usuario, de=parceiro)
+            db.session.add(Resgate(usuario_id=usuario.id, recompensa_id=aprovada.id, custo=aprovada.custo))
+    db.session.commit()
+
+
+def test_guarda_de_lazy_load_ligada_em_teste(app):
+    assert app.config['BLOQUEAR_LAZY_LOAD'] is True
+
+
+@pytest.mark.parametrize('pagina', PAGINAS)
+def test_listagem_sem_lazy_load_e_consultas_fixas(fabrica, cliente, pagina):
+    casal, a, b = fabrica.casal()
+    navegador = cliente(a)
+
+    popular(fabrica, casal, a, b, 2)
+    with contar_consultas() as poucas:
+        assert navegador.get(pagina).status_code == 200
+
+    popular(fabrica, casal, a, b, 10)
+    with contar_consultas() as muitas:
+        assert navegador.get(pagina).status_code == 200
+
+    # LazyLoadInesperado já derrubaria o request; isto pega N+1 sem relacionamento
+    assert len(muitas) == len(poucas)
@@ -0,0 +1,32 @@
+"""Import do módulo sem efeitos colaterais e primeiro request num interpretador novo.
+
+O orçamento de tempo fica no `benchmark_comercial.py partida --orcamento-ms`:
+tempo de relógio varia com a carga da máquina e não serve como teste.
+"""
+
+import json
+import os
+import subprocess
+import sys
+
+from benchmark_comercial import SCRIPT_PARTIDA
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def rodar_partida(pasta):
+    ambiente = dict(os.environ, PYTHONPATH=RAIZ, PYTHONDONTWRITEBYTECODE='1',
+                    SECURITY_LOG_PATH=str(pasta / 'logs' / 'security.log'))
+    for variavel in ('DATABASE_PATH', 'ANALYTICS_DATABASE_PATH', 'DATABASE_SHARDS'):
+        ambiente.pop(variavel, None)
+    saida = subprocess.run([sys.executable, '-c', SCRIPT_PARTIDA], cwd=pasta, env=ambiente,
+                           capture_output=True, text=True, timeout=60)
+    assert saida.returncode == 0, saida.stderr
+    return json.loads(saida.stdout.strip().splitlines()[-1])
+
+
+def test_import_nao_cria_arquivos_e_app_responde(tmp_path):
+    partida = rodar_partida(tmp_path)
+
+    assert partida['criados_no_import'] == []
+    assert partida['status'] == 200
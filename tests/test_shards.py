@@ -0,0 +1,135 @@
+"""Roteamento entre shards e mudança de casal de shard (SHARDS=2)."""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+import app_comercial
+from app_comercial import (Casal, Evento, GravacaoForaDoShard, Notificacao, Resgate, Tarefa, Usuario, arquivar_historico,
+                           db, engines_shards, escolher_shard, mover_casal, rotear_shard, shard_do_casal,
+                           varrer_lembretes)
+
+from conftest import app_pronto, config_de_teste
+
+
+@pytest.fixture
+def app(tmp_path):
+    with app_pronto(config_de_teste(tmp_path, SHARDS=2)) as app:
+        yield app
+
+
+def contar(indice, tabela, casal_id):
+    """Linhas do casal gravadas no arquivo do shard `indice` (sem passar pela sessão)"""
+    with engines_shards()[indice].connect() as conexao:
+        return conexao.exec_driver_sql(f'SELECT count(*) FROM main.{tabela} WHERE casal_id = ?',
+                                       (casal_id,)).scalar()
+
+
+def test_trocar_de_shard_com_gravacao_pendente_falha(app):
+    db.session.add(Usuario(nome='Ana', username='ana', email='ana@teste.local', senha_hash='-'))
+    with pytest.raises(GravacaoForaDoShard):
+        rotear_shard(1)
+
+    db.session.flush()
+    with pytest.raises(GravacaoForaDoShard):
+        rotear_shard(1)
+
+    db.session.rollback()
+    rotear_shard(1)
+    assert Usuario.query.count() == 0
+
+
+def test_criar_e_entrar_gravam_vinculo_e_auditoria_no_shard_do_casal(fabrica, cliente):
+    a, b = fabrica.usuario(), fabrica.usuario()
+    shard = escolher_shard(a.id)
+
+    cliente(a).post('/criar-casal')
+    casal = Casal.query.filter_by(parceiro_a_id=a.id).one()
+    cliente(b).post('/entrar-casal', data={'codigo': casal.codigo})
+    cliente(b).post('/tarefa/criar', data={'titulo': 'Regar plantas', 'pontos': '5'})
+
+    assert shard_do_casal(casal.id) == shard
+    assert contar(shard, 'evento', casal.id) == 3  # casal_criado, parceiro_entrou, tarefa_criada
+    assert contar(shard, 'tarefa', casal.id) == 1
+    assert contar(1 - shard, 'evento', casal.id) == contar(1 - shard, 'tarefa', casal.id) == 0
+
+
+def test_falha_antes_do_commit_nao_deixa_casal_pela_metade(fabrica, cliente, monkeypatch):
+    a = fabrica.usuario()
+
+    def falhar(*_args, **_dados):
+        raise RuntimeError('falha simulada')
+
+    monkeypatch.setattr(app_comercial, 'registrar_evento', falhar)
+    with pytest.raises(RuntimeError):
+        cliente(a).post('/criar-casal')
+    db.session.rollback()  # o teardown do request faria isso (aqui o request usa a sessão do teste)
+
+    assert Casal.query.count() == 0
+    assert db.session.get(Usuario, a.id).casal_id is None
+
+
+def test_mover_casal_leva_os_dados_e_mantem_ids(fabrica, cliente):
+    casal, a, b = fabrica.casal()
+    origem = casal.shard
+    destino = 1 - origem
+    tarefa = fabrica.tarefa(casal, para=a, de=b, pontos=30, concluida=True, data_conclusao=datetime.now())
+    recompensa = fabrica.recompensa(casal, para=a, de=b, custo=20)
+    cliente(a).post(f'/resgatar/{recompensa.id}')
+    ids = (tarefa.id, recompensa.id)
+
+    copiadas = mover_casal(casal.id, destino, espera=0)
+
+    assert copiadas > 0
+    assert shard_do_casal(casal.id) == destino
+    assert contar(origem, 'tarefa', casal.id) == contar(origem, 'recompensa', casal.id) == 0
+    rotear_shard(destino)
+    assert (db.session.get(Tarefa, ids[0]).pontos, Resgate.query.one().recompensa_id) == (30, ids[1])
+    assert db.session.get(Usuario, a.id).saldo == 10
+    assert cliente(a).get('/tarefas').status_code == 200
+
+
+def test_casal_em_mudanca_fica_fora_dos_jobs_e_dos_requests(fabrica, cliente):
+    casal, a, b = fabrica.casal()
+    origem = casal.shard
+    atrasada = datetime.now() - timedelta(hours=1)
+    fabrica.tarefa(casal, para=a, de=b, prazo=atrasada)
+    fabrica.tarefa(casal, para=a, de=b, concluida=True, data_conclusao=datetime.now() - timedelta(days=200))
+    db.session.execute(db.update(Casal).where(Casal.id == casal.id).values(shard=-1 - origem))
+    db.session.commit()
+
+    assert cliente(a).get('/tarefas').status_code == 503
+    assert varrer_lembretes() == 0
+    assert arquivar_historico(dias=90) == {'tarefas': 0, 'resgates': 0}
+
+    db.session.execute(db.update(Casal).where(Casal.id == casal.id).values(shard=origem))
+    db.session.commit()
+    assert varrer_lembretes() == 1
+    assert arquivar_historico(dias=90)['tarefas'] == 1
+    assert Notificacao.query.filter_by(casal_id=casal.id).count() == 1
+
+
+def test_rebalancear_reemite_eventos_de_vinculo_que_faltam(app, fabrica, cliente):
+    a, b = fabrica.usuario(), fabrica.usuario()
+    cliente(a).post('/criar-casal')
+    completo = Casal.query.filter_by(parceiro_a_id=a.id).one()
+    cliente(b).post('/entrar-casal', data={'codigo': completo.codigo})
+    # Casal gravado no diretório sem os eventos no shard (queda entre os dois arquivos)
+    perdido, c, d = fabrica.casal()
+    ids = (completo.id, perdido.id, c.id, d.id)
+
+    rebalancear = ['shards-rebalancear', '--espera', '0']
+    simulado = app.test_cli_runner().invoke(args=rebalancear + ['--simular'])
+    assert simulado.output.splitlines()[-1] == '[OK] 2 eventos de vínculo faltando'
+    resultado = app.test_cli_runner().invoke(args=rebalancear)
+    assert resultado.output.splitlines()[-1] == '[OK] 2 eventos de vínculo reemitidos'
+    assert app.test_cli_runner().invoke(args=rebalancear).output == '[OK] 0 casais movidos\n'
+
+    eventos = []
+    for indice in range(2):
+        rotear_shard(indice)
+        eventos += [(e.casal_id, e.tipo, e.usuario_id, e.dados) for e in Evento.query.order_by(Evento.casal_id)]
+    assert sorted(eventos) == sorted([
+        (ids[0], 'casal_criado', a.id, None), (ids[0], 'parceiro_entrou', b.id, None),
+        (ids[1], 'casal_criado', ids[2], '{"reparado":true}'), (ids[1], 'parceiro_entrou', ids[3], '{"reparado":true}'),
+    ])
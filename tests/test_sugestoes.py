@@ -0,0 +1,113 @@
+"""Sugestões de tarefa: modelos padrão, modelos aprendidos do casal e backfill."""
+
+import threading
+import time
+
+import app_comercial
+
+
+def sugerir(navegador, q):
+    return navegador.get('/api/sugestoes', query_string={'q': q}).get_json()['sugestoes']
+
+
+def criar_tarefa(navegador, titulo, pontos=10, frequencia=None):
+    campos = {'titulo': titulo, 'pontos': pontos}
+    if frequencia:
+        campos.update(recorrente='1', frequencia=frequencia)
+    return navegador.post('/tarefa/criar', data=campos)
+
+
+def test_modelos_padrao_por_prefixo_de_qualquer_palavra(fabrica, cliente):
+    _casal, a, _b = fabrica.casal()
+    navegador = cliente(a)
+
+    assert [s['titulo'] for s in sugerir(navegador, 'lav')] == ['Lavar a louça', 'Lavar a roupa']
+    assert [s['titulo'] for s in sugerir(navegador, 'ROUPA')] == ['Lavar a roupa', 'Passar roupa',
+                                                                  'Trocar a roupa de cama']
+    [louca] = sugerir(navegador, 'louca')
+    assert (louca['pontos'], louca['frequencia'], louca['origem']) == (10, 'diaria', 'padrao')
+    assert sugerir(navegador, '') == [] and sugerir(navegador, 'xyz') == []
+
+
+def test_titulo_repetido_vira_sugestao_so_do_casal(fabrica, cliente):
+    _casal, a, _b = fabrica.casal()
+    _outro, c, _d = fabrica.casal()
+    navegador = cliente(a)
+
+    criar_tarefa(navegador, 'Lavar o carro', pontos=30, frequencia='semanal')
+    assert 'Lavar o carro' not in [s['titulo'] for s in sugerir(navegador, 'lav')]  # um uso só
+    for _ in range(2):
+        criar_tarefa(navegador, 'lavar o CARRO ', pontos=30, frequencia='semanal')
+    # Mesmo título de um modelo padrão: o do casal substitui o padrão
+    criar_tarefa(navegador, 'Lavar a louça', pontos=25)
+    criar_tarefa(navegador, 'Lavar a louça', pontos=25)
+
+    sugestoes = sugerir(navegador, 'lav')  # os mais usados do casal primeiro
+    assert [(s['titulo'], s['pontos'], s['origem']) for s in sugestoes] == [
+        ('lavar o CARRO', 30, 'casal'), ('Lavar a louça', 25, 'casal'), ('Lavar a roupa', 15, 'padrao'),
+    ]
+    assert [s['origem'] for s in sugerir(cliente(c), 'lav')] == ['padrao', 'padrao']
+
+
+def test_modelos_aprender_recalcula_do_historico(app, fabrica, cliente):
+    casal, a, b = fabrica.casal()
+    for _ in range(2):
+        fabrica.tarefa(casal, para=b, de=a, titulo='Consertar a torneira', pontos=40)
+    fabrica.tarefa(casal, para=b, de=a, titulo='Consertar a porta')
+
+    resultado = app.test_cli_runner().invoke(args=['modelos-aprender'])
+
+    assert resultado.exit_code == 0, resultado.output
+    assert resultado.output == '[OK] 2 modelos de tarefa recalculados\n'
+    [torneira] = sugerir(cliente(a), 'cons')
+    assert (torneira['titulo'], torneira['pontos'], torneira['origem']) == ('Consertar a torneira', 40, 'casal')
+
+
+def test_primeira_carga_simultanea_sincroniza_uma_vez(app, fabrica, cliente, simultaneos, monkeypatch):
+    _casal, a, _b = fabrica.casal()
+    navegadores = [cliente(a) for _ in range(6)]
+    for _ in range(2):
+        criar_tarefa(navegadores[0], 'Lavar o carro', pontos=30)
+    assert not app.extensions['sugestoes'].carregado
+
+    chamadas = []
+    sincronizar = app_comercial.sincronizar_sugestoes
+
+    def sincronizar_devagar(indice):
+        chamadas.append(indice)
+        time.sleep(0.2)  # as outras threads chegam enquanto a carga roda
+        sincronizar(indice)
+    monkeypatch.setattr(app_comercial, 'sincronizar_sugestoes', sincronizar_devagar)
+
+    resultados = simultaneos([lambda n=n: [s['titulo'] for s in sugerir(n, 'lav')] for n in navegadores])
+
+    assert len(chamadas) == 1
+    assert all(titulos[0] == 'Lavar o carro' for titulos in resultados)  # ninguém viu o índice pela metade
+
+
+def test_sincronizacao_nao_trava_as_outras_threads(app, fabrica, cliente, simultaneos, monkeypatch):
+    _casal, a, _b = fabrica.casal()
+    navegadores = [cliente(a) for _ in range(6)]
+    sugerir(navegadores[0], 'lav')  # primeira carga
+    for _ in range(2):
+        criar_tarefa(navegadores[0], 'Lavar o carro', pontos=30)
+
+    respondidas = threading.Semaphore(0)
+    esperas = []
+    sincronizar = app_comercial.sincronizar_sugestoes
+
+    def sincronizar_devagar(indice):
+        # Segura a sincronização até as outras threads responderem sem ela
+        esperas.append(all(respondidas.acquire(timeout=5) for _ in navegadores[1:]))
+        sincronizar(indice)
+    monkeypatch.setattr(app_comercial, 'sincronizar_sugestoes', sincronizar_devagar)
+
+    def buscar(navegador):
+        titulos = [s['titulo'] for s in sugerir(navegador, 'lav')]
+        respondidas.release()
+        return titulos
+    resultados = simultaneos([lambda n=n: buscar(n) for n in navegadores])
+
+    assert esperas == [True]  # uma sincronização só, e ninguém esperou por ela
+    assert resultados.count(['Lavar a louça', 'Lavar a roupa']) == len(navegadores) - 1
+    assert sugerir(navegadores[0], 'lav')[0]['titulo'] == 'Lavar o carro'
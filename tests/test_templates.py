@@ -0,0 +1,46 @@
+"""Cache de bytecode dos templates e aquecimento no boot."""
+
+from app_comercial import aquecer_templates, rotulo_frequencia
+
+from conftest import app_pronto, config_de_teste
+
+
+def contar_compilacoes(app, monkeypatch):
+    compilados = []
+    compilar = app.jinja_env.compile
+
+    def compilar_contando(fonte, nome=None, *args, **kwargs):
+        compilados.append(nome)
+        return compilar(fonte, nome, *args, **kwargs)
+    monkeypatch.setattr(app.jinja_env, 'compile', compilar_contando)
+    return compilados
+
+
+def test_aquecer_preenche_o_cache_e_o_proximo_boot_nao_compila(tmp_path, monkeypatch):
+    pasta = tmp_path / 'cache-templates'
+    pasta.mkdir()
+    config = config_de_teste(tmp_path, TEMPLATE_BYTECODE_CACHE=True, TEMPLATE_CACHE_DIR=str(pasta))
+
+    with app_pronto(config) as app:
+        resultado = app.test_cli_runner().invoke(args=['templates-aquecer'])
+        total = len([nome for nome in app.jinja_env.list_templates() if nome.endswith('.html')])
+    assert resultado.exit_code == 0, resultado.output
+    assert resultado.output.startswith(f'[OK] {total} templates compilados')
+    assert len(list(pasta.iterdir())) == total
+
+    # Outro worker (app novo, mesma pasta) só lê o bytecode
+    with app_pronto(config) as app:
+        compilados = contar_compilacoes(app, monkeypatch)
+        assert aquecer_templates(app) == total
+        assert compilados == []
+
+
+def test_sem_cache_compila_em_memoria(app, fabrica, cliente, monkeypatch):
+    _casal, a, _b = fabrica.casal()
+    compilados = contar_compilacoes(app, monkeypatch)
+
+    assert app.jinja_env.bytecode_cache is None
+    assert cliente(a).get('/tarefas').status_code == 200
+    assert cliente(a).get('/tarefas').status_code == 200
+    assert compilados == ['comercial/tarefas.html']  # uma vez só, depois fica no cache em memória
+    assert (rotulo_frequencia('semanal'), rotulo_frequencia('bimestral')) == ('Semanal', 'Recorrente')
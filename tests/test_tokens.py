@@ -0,0 +1,92 @@
+"""Tokens da API: login, rotação do refresh, revogação por reuso e expiração."""
+
+from datetime import datetime, timedelta
+
+from app_comercial import TokenRenovacao, db
+
+
+def entrar(api, usuario, senha='segredo'):
+    return api.post('/api/token', json={'username': usuario.username, 'senha': senha})
+
+
+def renovar(api, refresh_token):
+    return api.post('/api/token/renovar', json={'refresh_token': refresh_token})
+
+
+def portador(tokens):
+    return {'Authorization': f"Bearer {tokens['access_token']}"}
+
+
+def test_login_e_acesso_com_bearer(fabrica, cliente):
+    _casal, a, _b = fabrica.casal()
+    api = cliente()
+
+    tokens = entrar(api, a).get_json()
+
+    assert tokens['token_type'] == 'Bearer'
+    assert api.get('/api/estatisticas', headers=portador(tokens)).status_code == 200
+    assert entrar(api, a, senha='errada').status_code == 401
+
+
+def test_renovar_troca_o_refresh_e_o_antigo_deixa_de_valer(fabrica, cliente):
+    _casal, a, _b = fabrica.casal()
+    api = cliente()
+    primeiro = entrar(api, a).get_json()
+
+    segundo = renovar(api, primeiro['refresh_token']).get_json()
+
+    assert segundo['refresh_token'] != primeiro['refresh_token']
+    assert api.get('/api/estatisticas', headers=portador(segundo)).status_code == 200
+    assert renovar(api, segundo['refresh_token']).status_code == 200
+
+
+def test_reuso_de_refresh_revoga_a_familia(fabrica, cliente):
+    _casal, a, _b = fabrica.casal()
+    api = cliente()
+    primeiro = entrar(api, a).get_json()
+    segundo = renovar(api, primeiro['refresh_token']).get_json()
+
+    reuso = renovar(api, primeiro['refresh_token'])
+
+    assert (reuso.status_code, reuso.get_json()) == (401, {'erro': 'refresh_token_revogado'})
+    assert renovar(api, segundo['refresh_token']).get_json() == {'erro': 'refresh_token_revogado'}
+    db.session.expire_all()
+    assert all(token.revogado for token in TokenRenovacao.query.filter_by(usuario_id=a.id))
+    # Outro login abre uma família nova
+    assert renovar(api, entrar(api, a).get_json()['refresh_token']).status_code == 200
+
+
+def test_token_de_acesso_expirado_ou_adulterado(app, fabrica, cliente):
+    _casal, a, _b = fabrica.casal()
+    api = cliente()
+    tokens = entrar(api, a).get_json()
+
+    adulterado = {'Authorization': f"Bearer {tokens['access_token'][:-2]}xx"}
+    assert api.get('/api/estatisticas', headers=adulterado).get_json() == {'erro': 'token_invalido'}
+
+    app.config['API_TOKEN_ACESSO_SEGUNDOS'] = -1
+    resposta = api.get('/api/estatisticas', headers=portador(tokens))
+    assert (resposta.status_code, resposta.get_json()) == (401, {'erro': 'token_invalido'})
+    assert resposta.headers['WWW-Authenticate'] == 'Bearer'
+
+
+def test_refresh_vencido(fabrica, cliente):
+    _casal, a, _b = fabrica.casal()
+    api = cliente()
+    tokens = entrar(api, a).get_json()
+    db.session.execute(db.update(TokenRenovacao).values(expira_em=datetime.now() - timedelta(seconds=1)))
+    db.session.commit()
+
+    assert renovar(api, tokens['refresh_token']).get_json() == {'erro': 'refresh_token_invalido'}
+
+
+def test_token_emitido_antes_de_entrar_no_casal(fabrica, cliente):
+    casal, _a, _b = fabrica.casal(completo=False)
+    novo = fabrica.usuario()
+    api = cliente()
+    tokens = entrar(api, novo).get_json()
+    assert api.get('/api/estatisticas', headers=portador(tokens)).get_json() == {'erro': 'sem_casal'}
+
+    cliente(novo).post('/entrar-casal', data={'codigo': casal.codigo})
+
+    assert api.get('/api/estatisticas', headers=portador(tokens)).status_code == 200